@@ -0,0 +1,147 @@
+# aggregate.py
+"""
+Population-wide summaries computed straight from a PlanStore's columns.
+
+The per-plan figures of story_api._summarize_plan (leg/activity counts,
+travel minutes by mode, first start / last end) plus departure-time and
+serverScore distributions, summed over every person instead of a 200-person
+sample. Results are a few KB and are cached next to the store.
+"""
+import array
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from metrics import cache_lookup
+from plan_store import KIND_ACTIVITY, MISSING, PlanStore
+from run_registry import registry
+
+HOUR = 3600
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+def _hour_histogram(counts: Dict[int, int]) -> List[int]:
+    if not counts:
+        return []
+    out = [0] * (max(counts) + 1)
+    for hour, n in counts.items():
+        out[hour] = n
+    return out
+
+def _to_minutes(sec: int) -> int:
+    return int(round(sec / 60.0)) if sec else 0
+
+def _score_distribution(scores: "array.array", bins: int) -> Dict[str, Any]:
+    if not scores:
+        return {"min": None, "max": None, "mean": None, "quantiles": {}, "histogram": {"edges": [], "counts": []}}
+    ordered = sorted(scores)
+    n = len(ordered)
+    lo, hi = ordered[0], ordered[-1]
+    width = (hi - lo) / bins if hi > lo else 1.0
+    counts = [0] * bins
+    for v in ordered:
+        counts[min(bins - 1, int((v - lo) / width))] += 1
+    return {
+        "min": lo,
+        "max": hi,
+        "mean": sum(ordered) / n,
+        "quantiles": {f"p{int(q * 100)}": ordered[min(n - 1, int(q * n))] for q in QUANTILES},
+        "histogram": {"edges": [lo + i * width for i in range(bins + 1)], "counts": counts},
+    }
+
+def aggregate_store(store: PlanStore, selected_only: bool = True, score_bins: int = 20) -> Dict[str, Any]:
+    """One pass over the store's step columns; with selected_only, only each person's selected plan counts."""
+    c = store.cols
+    person_plan_start = c["person_plan_start"]
+    person_selected = c["person_selected"]
+    plan_step_start = c["plan_step_start"]
+    server_score = c["plan_server_score"]
+    kind_col = c["step_kind"]
+    label_col = c["step_label"]
+    t0_col = c["step_t0"]
+    t1_col = c["step_t1"]
+    dur_col = c["step_dur"]
+
+    act_counts: Dict[int, int] = defaultdict(int)
+    leg_counts: Dict[int, int] = defaultdict(int)
+    travel_sec: Dict[int, int] = defaultdict(int)
+    departures: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    first_start_hist: Dict[int, int] = defaultdict(int)
+    last_end_hist: Dict[int, int] = defaultdict(int)
+    scores = array.array("d")
+
+    n_persons = len(store)
+    for i in range(n_persons):
+        first = person_plan_start[i]
+        if selected_only:
+            plan_ids = (first + person_selected[i],)
+        else:
+            plan_ids = range(first, person_plan_start[i + 1])
+        for p in plan_ids:
+            scores.append(server_score[p])
+            first_start = MISSING
+            last_end = MISSING
+            for k in range(plan_step_start[p], plan_step_start[p + 1]):
+                label = label_col[k]
+                if kind_col[k] == KIND_ACTIVITY:
+                    act_counts[label] += 1
+                    if first_start == MISSING:
+                        first_start = t0_col[k]
+                    if t1_col[k] != MISSING:
+                        last_end = t1_col[k]
+                else:
+                    leg_counts[label] += 1
+                    d = dur_col[k]
+                    if d != MISSING and d > 0:
+                        travel_sec[label] += d
+                    dep = t0_col[k]
+                    if dep != MISSING:
+                        departures[label][dep // HOUR] += 1
+            if first_start != MISSING:
+                first_start_hist[first_start // HOUR] += 1
+            if last_end != MISSING:
+                last_end_hist[last_end // HOUR] += 1
+
+    labels = store.labels
+
+    def name(code: int) -> str:
+        return str(labels[code]) if code >= 0 else "?"
+
+    total_legs = sum(leg_counts.values())
+    total_travel = sum(travel_sec.values())
+    return {
+        "persons": n_persons,
+        "plans": len(scores),
+        "selectedOnly": selected_only,
+        "activityCounts": {name(k): v for k, v in act_counts.items()},
+        "legCounts": {name(k): v for k, v in leg_counts.items()},
+        "modeShare": {name(k): v / total_legs for k, v in leg_counts.items()} if total_legs else {},
+        "travelMinutesByMode": {name(k): _to_minutes(v) for k, v in travel_sec.items()},
+        "totalTravelMinutes": _to_minutes(total_travel),
+        "departureHistogram": {
+            "binMinutes": HOUR // 60,
+            "modes": {name(k): _hour_histogram(v) for k, v in departures.items()},
+        },
+        "firstStartHistogram": _hour_histogram(first_start_hist),
+        "lastEndHistogram": _hour_histogram(last_end_hist),
+        "serverScore": _score_distribution(scores, max(1, score_bins)),
+    }
+
+def cached_aggregate(store: PlanStore, selected_only: bool = True, score_bins: int = 20) -> Dict[str, Any]:
+    """aggregate_store, memoized as JSON inside the (immutable) store directory."""
+    path = os.path.join(store.path, f"aggregate-{'sel' if selected_only else 'all'}-{score_bins}.json")
+    try:
+        with open(path, encoding="utf-8") as fh:
+            result = json.load(fh)
+        cache_lookup("aggregate", True)
+        return result
+    except (OSError, ValueError):
+        pass
+    cache_lookup("aggregate", False)
+    result = aggregate_store(store, selected_only, score_bins)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(result, fh, ensure_ascii=False)
+    os.replace(tmp, path)
+    registry.grown(store.meta["key"])  # the JSON counts toward the run's size on disk
+    return result
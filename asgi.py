@@ -0,0 +1,168 @@
+# asgi.py
+"""
+ASGI entry point:  uvicorn asgi:app --host 127.0.0.1 --port 5000
+
+/story and /story/batch are served on the event loop with the async OpenAI
+client, so a slow LLM answer parks a coroutine instead of a worker. Every other
+route is the Flask app (server.app) running in a thread pool via a2wsgi; plan
+and facility parsing for new uploads is sent to a process pool
+($ASGI_INGEST_WORKERS, default 2), so it neither blocks the loop nor competes
+with it for the GIL.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from a2wsgi import WSGIMiddleware
+
+import server
+import story_api
+from metrics import HTTP_REQUESTS, HTTP_SECONDS
+
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))
+INGEST_WORKERS = int(os.getenv("ASGI_INGEST_WORKERS", "2"))
+MAX_JSON_BYTES = 16 << 20  # story bodies are one or a few plans
+
+flask_app = WSGIMiddleware(server.app, workers=WSGI_THREADS)
+
+# ---- tiny HTTP helpers (the async routes are plain ASGI callables) ----
+
+class _BodyTooLarge(Exception):
+    pass
+
+async def _read_json(receive) -> Any:
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body = message.get("body", b"")
+        size += len(body)
+        if size > MAX_JSON_BYTES:
+            raise _BodyTooLarge()
+        chunks.append(body)
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(b"".join(chunks) or b"null")
+    except ValueError:
+        return None
+
+def _headers(scope, content_type: str) -> List[Tuple[bytes, bytes]]:
+    headers = [(b"content-type", content_type.encode("latin-1"))]
+    origin = dict(scope["headers"]).get(b"origin", b"").decode("latin-1")
+    # same CORS answer as server.add_cors_headers
+    if origin in server.CORS_ORIGINS:
+        headers += [
+            (b"access-control-allow-origin", origin.encode("latin-1")),
+            (b"vary", b"Origin"),
+            (b"access-control-allow-headers", b"Content-Type"),
+            (b"access-control-allow-methods", b"POST, OPTIONS"),
+        ]
+    return headers
+
+async def _send_json(scope, send, obj: Any, status: int = 200) -> None:
+    await send({"type": "http.response.start", "status": status,
+                "headers": _headers(scope, "application/json")})
+    await send({"type": "http.response.body", "body": json.dumps(obj, ensure_ascii=False).encode("utf-8")})
+
+# ---- async routes ----
+
+async def story(scope, receive, send) -> None:
+    """POST /story: same body and answer as story_api.generate_story."""
+    try:
+        job = story_api.story_request(await _read_json(receive))
+    except story_api.StoryRequestError as e:
+        return await _send_json(scope, send, {"error": str(e)}, e.status)
+    # a $STORY_CACHE_DB lookup is a blocking SQLite read
+    cached = await asyncio.to_thread(story_api.story_cache.get, job["cache_key"])
+    if cached is None:
+        cached = await story_api.arun_story(job)
+    await _send_json(scope, send, cached)
+
+async def story_batch(scope, receive, send) -> None:
+    """POST /story/batch: same body and NDJSON stream as story_api.generate_story_batch."""
+    try:
+        # cache lookups for every item, off the event loop
+        batch = await asyncio.to_thread(story_api.batch_request, await _read_json(receive))
+    except story_api.StoryRequestError as e:
+        return await _send_json(scope, send, {"error": str(e)}, e.status)
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": _headers(scope, "application/x-ndjson")})
+    ready = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch["ready"])
+    if ready:
+        await send({"type": "http.response.body", "body": ready.encode("utf-8"), "more_body": True})
+
+    limit = asyncio.Semaphore(batch["concurrency"])
+    timeout = batch["timeout"]
+
+    async def one(job: Dict[str, Any], owners: List[Tuple[int, Any]]) -> str:
+        async with limit:
+            return story_api.batch_lines(await story_api.arun_story(job, timeout), owners)
+
+    tasks = [asyncio.ensure_future(one(job, owners)) for job, owners in batch["todo"].values()]
+    try:
+        for done in asyncio.as_completed(tasks):
+            await send({"type": "http.response.body", "body": (await done).encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        # client went away: drop the calls that have not finished
+        for task in tasks:
+            task.cancel()
+
+ROUTES: Dict[str, Callable[..., Awaitable[None]]] = {
+    "/story": story,
+    "/story/batch": story_batch,
+}
+
+# ---- app ----
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            server.start_ingest_pool(INGEST_WORKERS)
+            server.prebuild_tile_layers()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            server.stop_ingest_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    route: Optional[Callable[..., Awaitable[None]]] = None
+    if scope["type"] == "http" and scope["method"] == "POST":
+        route = ROUTES.get(scope["path"])
+    if route is None:
+        return await flask_app(scope, receive, send)
+
+    # the same HTTP metrics server.record_request keeps for the Flask routes
+    t0 = time.perf_counter()
+    status: Optional[int] = None
+
+    async def send_observed(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            # until the response starts: a streamed body is still to come
+            HTTP_SECONDS.observe(time.perf_counter() - t0, route=scope["path"])
+        await send(message)
+
+    try:
+        await route(scope, receive, send_observed)
+    except _BodyTooLarge:
+        await _send_json(scope, send_observed, {"error": "request body too large"}, 413)
+    finally:
+        if status is None:  # raised before answering
+            HTTP_SECONDS.observe(time.perf_counter() - t0, route=scope["path"])
+        HTTP_REQUESTS.inc(route=scope["path"], method=scope["method"], status=str(status or 500))
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="127.0.0.1", port=5000)
@@ -0,0 +1,70 @@
+# benchmarks/bench_finalize.py
+"""
+Per-plan finalization loop vs. the batched NumPy engine, on parsed-but-not-finalized plans.
+
+    python benchmarks/bench_finalize.py --persons 20000 --batch 256 2048 16384
+
+Plans are captured unfinalized from a synthetic population, copied per run, and
+finalized by plans.finalize_plan (one plan at a time) and plan_engine.finalize_batch
+(`--batch` plans at a time). Steps/sec per engine is printed as JSON lines and
+the results are checked to be identical.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _capture(persons: int):
+    """(plan_obj, last_leg_arrival) for every plan, before finalization."""
+    import plans
+    from synthetic import SyntheticPlansStream
+
+    captured = []
+    builder = plans._PlanBuilder(selected_only=False, engine="batch")
+    builder._finalize_batch = captured.extend  # collect the batches instead of finalizing them
+    for _ in plans.PARSER_BACKENDS["expat"](SyntheticPlansStream(persons), builder):
+        pass
+    return captured
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persons", type=int, default=20_000)
+    ap.add_argument("--batch", type=int, nargs="+", default=[256, 2048, 16384])
+    args = ap.parse_args()
+
+    from plan_engine import finalize_batch
+    from plans import finalize_plan
+
+    base = _capture(args.persons)
+    n_steps = sum(len(p["steps"]) for p, _ in base)
+
+    work = copy.deepcopy(base)
+    t0 = time.perf_counter()
+    for plan_obj, lla in work:
+        plan_obj["serverScore"] = finalize_plan(plan_obj["steps"], lla)
+    elapsed = time.perf_counter() - t0
+    reference = [p for p, _ in work]
+    print(json.dumps({"engine": "plan", "plans": len(base), "steps": n_steps,
+                      "seconds": round(elapsed, 3), "steps_per_sec": round(n_steps / elapsed)}))
+
+    ok = True
+    for size in args.batch:
+        work = copy.deepcopy(base)
+        t0 = time.perf_counter()
+        for i in range(0, len(work), size):
+            finalize_batch(work[i:i + size])
+        elapsed = time.perf_counter() - t0
+        same = [p for p, _ in work] == reference
+        ok = ok and same
+        print(json.dumps({"engine": "batch", "batch": size, "plans": len(base), "steps": n_steps,
+                          "seconds": round(elapsed, 3), "steps_per_sec": round(n_steps / elapsed),
+                          "identical": same}))
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# benchmarks/bench_mapped_io.py
+"""
+Text-stream vs memory-mapped bytes input for the plans parser.
+
+    python benchmarks/bench_mapped_io.py                     # 100k persons, .xml.gz and .xml
+    python benchmarks/bench_mapped_io.py --persons 1000000 --backends expat
+
+"text" is the old upload path: gzip.open(..., "rt") / TextIOWrapper, so every
+byte is decoded to str and re-encoded by the parser. "mapped" is
+mapped_io.open_mapped: the file is mmapped and the parser gets raw bytes, with
+gzip inflated in GZIP_BLOCK pieces. Both must produce the same persons.
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _open_text(path: str):
+    fh = open(path, "rb")
+    if fh.read(2) == b"\x1f\x8b":
+        fh.seek(0)
+        return gzip.open(fh, "rt", encoding="utf-8")
+    fh.seek(0)
+    return io.TextIOWrapper(fh, encoding="utf-8")
+
+def _run(path: str, backend: str, mode: str) -> dict:
+    from mapped_io import open_mapped
+    from plans import iter_persons
+
+    digest = hashlib.sha256()
+    n = 0
+    t0 = time.perf_counter()
+    with (open_mapped(path) if mode == "mapped" else _open_text(path)) as f:
+        for person in iter_persons(f, selected_only=False, backend=backend):
+            digest.update(person["personId"].encode("utf-8"))
+            digest.update(str(person["plans"][0]["serverScore"]).encode("ascii"))
+            n += 1
+    elapsed = time.perf_counter() - t0
+    return {"persons": n, "seconds": elapsed, "digest": digest.hexdigest()}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persons", type=int, default=100_000)
+    ap.add_argument("--backends", nargs="+", default=["expat", "etree"])
+    ap.add_argument("--repeat", type=int, default=3, help="best of N")
+    args = ap.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from synthetic import write_plans
+
+    with tempfile.TemporaryDirectory(prefix="dtsbui-mapped-") as tmp:
+        gz = write_plans(os.path.join(tmp, "plans.xml.gz"), args.persons)
+        plain = os.path.join(tmp, "plans.xml")
+        with gzip.open(gz, "rb") as src, open(plain, "wb") as dst:
+            dst.write(src.read())
+        mb = os.path.getsize(plain) / (1024 * 1024)
+
+        failed = False
+        for path in (gz, plain):
+            for backend in args.backends:
+                digests = set()
+                for mode in ("text", "mapped"):
+                    best = min((_run(path, backend, mode) for _ in range(args.repeat)), key=lambda r: r["seconds"])
+                    digests.add(best["digest"])
+                    print(f"{os.path.basename(path):13s} {backend:6s} {mode:6s} "
+                          f"{best['persons'] / best['seconds']:10,.0f} persons/s "
+                          f"{mb / best['seconds']:7.1f} MB/s (uncompressed XML)")
+                if len(digests) != 1:
+                    print(f"  MISMATCH between text and mapped for {backend}")
+                    failed = True
+        sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/bench_memory.py
+"""
+Parse a multi-GB synthetic population under a fixed memory ceiling.
+
+    python benchmarks/bench_memory.py                          # 2M persons (~2.6 GB of XML)
+    python benchmarks/bench_memory.py --persons 200000 --ceiling-mb 200
+
+The XML is generated on the fly (nothing is written to disk) and every backend
+runs in its own subprocess with ParseBudget(max_rss_mb=ceiling), so a leak
+aborts the parse with ParseBudgetExceeded and the script exits non-zero.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _run_one(backend: str, persons: int, ceiling_mb: float) -> dict:
+    from plans import ParseBudget, ParseBudgetExceeded, current_rss_mb, iter_persons
+    from synthetic import SyntheticPlansStream
+
+    stream = SyntheticPlansStream(persons)
+    budget = ParseBudget(max_rss_mb=ceiling_mb, check_every=5000)
+    n = 0
+    peak = 0.0
+    error = None
+    t0 = time.perf_counter()
+    try:
+        for _ in iter_persons(stream, selected_only=False, backend=backend, budget=budget):
+            n += 1
+            if n % 5000 == 0:
+                peak = max(peak, current_rss_mb())
+    except ParseBudgetExceeded as e:
+        error = str(e)
+    return {
+        "backend": backend,
+        "persons": n,
+        "xml_gb": round(stream.chars_read / 1e9, 2),
+        "seconds": round(time.perf_counter() - t0, 1),
+        "max_sampled_rss_mb": round(peak, 1),
+        "ceiling_mb": ceiling_mb,
+        "error": error,
+    }
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persons", type=int, default=2_000_000)
+    ap.add_argument("--ceiling-mb", type=float, default=256)
+    ap.add_argument("--backends", nargs="+", default=None)
+    ap.add_argument("--_worker", metavar="BACKEND", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args._worker:
+        print(json.dumps(_run_one(args._worker, args.persons, args.ceiling_mb)))
+        return 0
+
+    from plans import PARSER_BACKENDS
+
+    ok = True
+    for backend in args.backends or list(PARSER_BACKENDS):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--_worker", backend,
+             "--persons", str(args.persons), "--ceiling-mb", str(args.ceiling_mb)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        res = json.loads(out)
+        print(json.dumps(res))
+        ok = ok and res["error"] is None
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# benchmarks/bench_parsers.py
+"""
+Compare plans parser backends on synthetic populations.
+
+    python benchmarks/bench_parsers.py                       # 10k / 100k / 1M persons
+    python benchmarks/bench_parsers.py --persons 10000 --backends etree expat
+
+Each (size, backend) run happens in a fresh subprocess so peak RSS is per backend.
+Output digests (sha256 of the JSON of every person, all plans) must agree across
+backends; a mismatch exits non-zero.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _run_one(path: str, backend: str) -> dict:
+    from plans import iter_persons, output_person
+
+    digest = hashlib.sha256()
+    n = 0
+    t0 = time.perf_counter()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for person in iter_persons(f, selected_only=False, backend=backend):
+            digest.update(json.dumps(output_person(person), sort_keys=True).encode("utf-8"))
+            n += 1
+    elapsed = time.perf_counter() - t0
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    return {
+        "backend": backend,
+        "persons": n,
+        "seconds": round(elapsed, 3),
+        "persons_per_sec": round(n / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(rss_mb, 1),
+        "digest": digest.hexdigest(),
+    }
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persons", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--backends", nargs="+", default=None)
+    ap.add_argument("--workdir", default=None, help="where synthetic files are kept (reused across runs)")
+    ap.add_argument("--_worker", nargs=2, metavar=("PATH", "BACKEND"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args._worker:
+        print(json.dumps(_run_one(*args._worker)))
+        return 0
+
+    from plans import PARSER_BACKENDS
+    from synthetic import write_plans
+
+    backends = args.backends or list(PARSER_BACKENDS)
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "dtsbui-bench")
+    os.makedirs(workdir, exist_ok=True)
+
+    ok = True
+    for persons in args.persons:
+        path = os.path.join(workdir, f"plans_{persons}.xml.gz")
+        if not os.path.exists(path):
+            write_plans(path, persons)
+        results = []
+        for backend in backends:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--_worker", path, backend],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            res = json.loads(out)
+            res["size"] = persons
+            results.append(res)
+            print(json.dumps(res))
+        if len({r["digest"] for r in results}) > 1:
+            print(f"MISMATCH: backends disagree on {path}", file=sys.stderr)
+            ok = False
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# benchmarks/bench_startup.py
+"""
+Cold start: how long until a fresh worker can answer.
+
+    python benchmarks/bench_startup.py                      # import, wsgi, asgi; 5 runs each
+    python benchmarks/bench_startup.py --modes import asgi --runs 10 --json
+
+    import  `import server` in a fresh interpreter, without $OPENAI_API_KEY
+            (a plan-only deployment); also the slowest modules of one run (-X importtime)
+    wsgi    process spawn -> first 200 from GET /metrics, Flask's threaded dev server
+    asgi    the same for uvicorn asgi:app (lifespan starts the ingest pool)
+
+For the server modes, the first and second POST /story to benchmarks/openai_stub.py
+(no delay) are timed as well: the OpenAI client is built on the first /story,
+so that is where its import cost shows up now.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import openai_stub  # noqa: E402  (benchmarks/ is the script dir)
+
+SERVE = {
+    "wsgi": [sys.executable, "-c",
+             "import sys, server; from werkzeug.serving import run_simple; "
+             "run_simple('127.0.0.1', int(sys.argv[1]), server.app, threaded=True)"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--log-level", "warning",
+             "--port"],
+}
+_IMPORT = ("import time; t0 = time.perf_counter(); import server; "
+           "print(time.perf_counter() - t0)")
+_STORY = json.dumps({"personId": "p0", "plan": {"steps": [
+    {"kind": "activity", "type": "Home", "startTime": "00:00:00", "endTime": "07:30:00"},
+    {"kind": "leg", "mode": "pt", "depTime": "07:30:00", "travelTime": "00:30:00"},
+    {"kind": "activity", "type": "Work", "startTime": "08:00:00", "endTime": "17:00:00"},
+]}}).encode("utf-8")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _plan_only_env() -> Dict[str, str]:
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "OPENAI_BASE_URL")}
+    env["LOG_LEVEL"] = "WARNING"
+    return env
+
+def _stats(xs: List[float]) -> Dict[str, float]:
+    return {"p50_s": round(statistics.median(xs), 4), "min_s": round(min(xs), 4), "max_s": round(max(xs), 4)}
+
+def _slowest_imports(top: int) -> List[Dict[str, Any]]:
+    """Modules with the largest cumulative import time in one `import server` (-X importtime)."""
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=ROOT,
+                         env=_plan_only_env(), check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|", 2)
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1e3, 1)} for us, name in rows[1:top + 1]]
+
+def run_import(runs: int) -> Dict[str, Any]:
+    times, wall = [], []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", _IMPORT], cwd=ROOT, env=_plan_only_env(),
+                             check=True, capture_output=True, text=True).stdout
+        wall.append(time.perf_counter() - t0)
+        times.append(float(out.strip().splitlines()[-1]))
+    return {"mode": "import", "runs": runs, "import": _stats(times), "process": _stats(wall),
+            "slowest": _slowest_imports(8)}
+
+def _first_answer(base: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            urllib.request.urlopen(base + "/metrics", timeout=1).read()
+            return
+        except (OSError, urllib.error.HTTPError):
+            time.sleep(0.005)
+    raise RuntimeError("server did not start")
+
+def _story(base: str) -> float:
+    req = urllib.request.Request(base + "/story", data=_STORY, headers={"Content-Type": "application/json"})
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        resp.read()
+    return time.perf_counter() - t0
+
+def run_server(mode: str, runs: int) -> Dict[str, Any]:
+    ready, story_first, story_second = [], [], []
+    stub = openai_stub.serve(_free_port(), 0.0)
+    try:
+        for _ in range(runs):
+            port = _free_port()
+            env = dict(_plan_only_env(),
+                       OPENAI_API_KEY="stub",
+                       OPENAI_BASE_URL=f"http://127.0.0.1:{stub.server_address[1]}/v1",
+                       PLAN_STORE_DIR=tempfile.mkdtemp(prefix="dtsbui-startup-"),
+                       STORY_CACHE_TTL="0")
+            base = f"http://127.0.0.1:{port}"
+            t0 = time.perf_counter()
+            proc = subprocess.Popen(SERVE[mode] + [str(port)], cwd=ROOT, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _first_answer(base, proc)
+                ready.append(time.perf_counter() - t0)
+                story_first.append(_story(base))
+                story_second.append(_story(base))
+            finally:
+                proc.terminate()
+                proc.wait(timeout=10)
+    finally:
+        stub.shutdown()
+    return {"mode": mode, "runs": runs, "first_request": _stats(ready),
+            "first_story": _stats(story_first), "second_story": _stats(story_second)}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--modes", nargs="+", choices=["import"] + sorted(SERVE), default=["import", "wsgi", "asgi"])
+    ap.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    ap.add_argument("--json", action="store_true", help="print one JSON object per mode")
+    args = ap.parse_args()
+
+    for mode in args.modes:
+        res = run_import(args.runs) if mode == "import" else run_server(mode, args.runs)
+        if args.json:
+            print(json.dumps(res), flush=True)
+        elif mode == "import":
+            slow = ", ".join(f"{m['module']} {m['cumulative_ms']:.0f}ms" for m in res["slowest"][:4])
+            print(f"import   import server {res['import']['p50_s']:6.3f}s | process {res['process']['p50_s']:6.3f}s "
+                  f"| slowest: {slow}", flush=True)
+        else:
+            print(f"{mode:8s} first request {res['first_request']['p50_s']:6.3f}s | first /story "
+                  f"{res['first_story']['p50_s']:6.3f}s | second /story {res['second_story']['p50_s']:6.3f}s",
+                  flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_wire_format.py
+"""
+/upload payload: JSON vs the msgpack column layout (plan_columns).
+
+    python benchmarks/bench_wire_format.py                       # 20k persons, selected plans
+    python benchmarks/bench_wire_format.py --persons 100000 --all-plans --json
+
+Both encodings start from the same ingested plan store, as /upload does.
+Reported per format: encode time (store -> bytes, what the server pays),
+bytes on the wire raw and gzipped (Flask-Compress level 6), and decode time.
+"decode" for msgpack is unpacking the map: the typed columns are then used
+as-is (Int32Array / Float32Array views in the browser); "decode+rows" also
+rebuilds the per-person dicts, which is the cost a JSON consumer gets for free.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _best(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persons", type=int, default=20_000)
+    ap.add_argument("--all-plans", action="store_true", help="selected_only=false")
+    ap.add_argument("--repeat", type=int, default=3, help="best of N")
+    ap.add_argument("--json", action="store_true", help="print one JSON object per format")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="dtsbui-wire-") as tmp:
+        os.environ["PLAN_STORE_DIR"] = tmp  # before plan_store is imported
+        import msgpack
+        import plan_store
+        from mapped_io import open_mapped
+        from plan_columns import decode_msgpack, encode_msgpack
+        from plans import iter_persons
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from synthetic import write_plans
+
+        path = write_plans(os.path.join(tmp, "plans.xml.gz"), args.persons)
+        with open_mapped(path) as f:
+            store = plan_store.ingest(iter_persons(f, selected_only=False), "0" * 64)
+        selected_only = not args.all_plans
+        n = len(store)
+
+        def enc_json() -> bytes:
+            persons = list(store.iter_persons(limit=n, selected_only=selected_only))
+            return json.dumps(persons).encode("utf-8")
+
+        formats = {
+            "json": (enc_json, json.loads, None),
+            "msgpack": (lambda: encode_msgpack(store, 0, n, selected_only),
+                        lambda b: msgpack.unpackb(b, raw=False), decode_msgpack),
+        }
+        for name, (encode, decode, rows) in formats.items():
+            enc_s, body = _best(encode, args.repeat)
+            dec_s, _ = _best(lambda: decode(body), args.repeat)
+            res = {
+                "format": name,
+                "persons": n,
+                "encode_s": round(enc_s, 4),
+                "bytes": len(body),
+                "gzip_bytes": len(gzip.compress(body, 6)),
+                "decode_s": round(dec_s, 4),
+            }
+            if rows is not None:
+                res["decode_rows_s"] = round(_best(lambda: rows(body), args.repeat)[0], 4)
+            if args.json:
+                print(json.dumps(res))
+            else:
+                extra = f" | decode+rows {res['decode_rows_s']:7.3f}s" if "decode_rows_s" in res else ""
+                print(f"{name:8s} encode {res['encode_s']:7.3f}s | {res['bytes'] / 1e6:7.2f} MB "
+                      f"(gzip {res['gzip_bytes'] / 1e6:6.2f} MB) | decode {res['decode_s']:7.3f}s{extra}")
+        store.close()
+
+if __name__ == "__main__":
+    main()
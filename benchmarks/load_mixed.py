@@ -0,0 +1,160 @@
+# benchmarks/load_mixed.py
+"""
+Mixed /story + /upload load test: does a slow LLM stall plan uploads?
+
+    python benchmarks/load_mixed.py                          # wsgi vs asgi
+    python benchmarks/load_mixed.py --modes wsgi wsgi-threaded asgi --stories 32 --delay 3
+
+For each serving mode a fresh server process is started against an OpenAI stub
+(benchmarks/openai_stub.py) that takes --delay seconds per completion:
+
+    wsgi            one synchronous worker (what a single gunicorn sync worker gives you)
+    wsgi-threaded   Flask's threaded dev server (app.run default)
+    asgi            uvicorn asgi:app
+
+Uploads are timed once with the server idle and once while --stories story
+requests are waiting on the stub. Every upload is a different synthetic file,
+so each one is a real parse, not a plan-store hit.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import openai_stub  # noqa: E402  (benchmarks/ is the script dir)
+from synthetic import write_plans  # noqa: E402
+
+SERVE = {
+    "wsgi": [sys.executable, "-c",
+             "import sys, server; from werkzeug.serving import run_simple; "
+             "run_simple('127.0.0.1', int(sys.argv[1]), server.app, threaded=False)"],
+    "wsgi-threaded": [sys.executable, "-c",
+                      "import sys, server; from werkzeug.serving import run_simple; "
+                      "run_simple('127.0.0.1', int(sys.argv[1]), server.app, threaded=True)"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--log-level", "warning",
+             "--port"],
+}
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_up(base: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            urllib.request.urlopen(base + "/", timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return  # 404 is fine: it answers
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+def _post(url: str, body: bytes, content_type: str, timeout: float = 300) -> float:
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        resp.read()
+    return time.perf_counter() - t0
+
+def _upload(base: str, path: str) -> float:
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as fh:
+        data = fh.read()
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"plans.xml.gz\"\r\n"
+            "Content-Type: application/gzip\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return _post(base + "/upload?limit=50", body, f"multipart/form-data; boundary={boundary}")
+
+def _story(base: str, i: int) -> float:
+    steps = [
+        {"kind": "activity", "type": "Home", "startTime": "00:00:00", "endTime": f"07:{i % 60:02d}:00"},
+        {"kind": "leg", "mode": "pt", "depTime": f"07:{i % 60:02d}:00", "travelTime": "00:30:00"},
+        {"kind": "activity", "type": "Work", "startTime": "08:00:00", "endTime": "17:00:00"},
+    ]
+    body = json.dumps({"personId": f"p{i}", "plan": {"steps": steps}}).encode("utf-8")
+    return _post(base + "/story", body, "application/json")
+
+def _summary(xs: List[float]) -> Dict[str, float]:
+    xs = sorted(xs)
+    return {"p50": round(statistics.median(xs), 3), "max": round(xs[-1], 3)} if xs else {}
+
+def run_mode(mode: str, files: List[str], stories: int, delay: float, workdir: str) -> Dict:
+    stub = openai_stub.serve(_free_port(), delay)
+    port = _free_port()
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{stub.server_address[1]}/v1",
+               PLAN_STORE_DIR=tempfile.mkdtemp(dir=workdir),
+               STORY_CACHE_TTL="0",
+               LOG_LEVEL="WARNING")
+    proc = subprocess.Popen(SERVE[mode] + [str(port)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        _wait_up(base, proc)
+        half = len(files) // 2
+        idle = [_upload(base, path) for path in files[:half]]
+
+        story_times: List[float] = []
+        with ThreadPoolExecutor(max_workers=stories) as pool:
+            futures = [pool.submit(_story, base, i) for i in range(stories)]
+            time.sleep(min(0.5, delay / 4))  # let the story requests reach the stub first
+            loaded = [_upload(base, path) for path in files[half:]]
+            story_times = [f.result() for f in futures]
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        stub.shutdown()
+    return {
+        "mode": mode,
+        "upload_idle_s": _summary(idle),
+        "upload_under_story_load_s": _summary(loaded),
+        "story_s": _summary(story_times),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--modes", nargs="+", choices=sorted(SERVE), default=["wsgi", "asgi"])
+    ap.add_argument("--stories", type=int, default=16, help="concurrent /story requests")
+    ap.add_argument("--uploads", type=int, default=6, help="uploads per mode (half idle, half under load)")
+    ap.add_argument("--persons", type=int, default=5000, help="persons per uploaded file")
+    ap.add_argument("--delay", type=float, default=2.0, help="stub LLM latency, seconds")
+    ap.add_argument("--json", action="store_true", help="print one JSON object per mode")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dtsbui-load-")
+    try:
+        for m, mode in enumerate(args.modes):
+            files = [write_plans(os.path.join(workdir, f"plans_{m}_{i}.xml.gz"), args.persons, seed=1000 * m + i)
+                     for i in range(max(2, args.uploads))]
+            res = run_mode(mode, files, args.stories, args.delay, workdir)
+            if args.json:
+                print(json.dumps(res))
+            else:
+                print(f"{mode:14s} upload idle p50 {res['upload_idle_s']['p50']:7.3f}s | "
+                      f"under story load p50 {res['upload_under_story_load_s']['p50']:7.3f}s "
+                      f"max {res['upload_under_story_load_s']['max']:7.3f}s | "
+                      f"story p50 {res['story_s']['p50']:7.3f}s max {res['story_s']['max']:7.3f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
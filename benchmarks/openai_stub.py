@@ -0,0 +1,85 @@
+# benchmarks/openai_stub.py
+"""
+Stand-in for the OpenAI chat completions API, for load tests without a key or network.
+
+    python benchmarks/openai_stub.py --port 8099 --delay 2.0
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub python server.py
+
+Every POST .../chat/completions sleeps `delay` seconds (each request on its own
+thread) and answers with a schema-valid {title, one_liner, bubble} object built
+from the request's response_format.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+def completion(request: Dict[str, Any]) -> Dict[str, Any]:
+    """A chat.completion body whose content satisfies the story json_schema."""
+    try:
+        props = request["response_format"]["json_schema"]["schema"]["properties"]
+        bubble = props["bubble"]["enum"][0]
+    except (KeyError, IndexError, TypeError):
+        bubble = "stub"
+    content = {
+        "title": "スタブの一日",
+        "one_liner": "これは負荷試験用のスタブ応答です。" * 5,
+        "bubble": bubble,
+    }
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)},
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+class _Handler(BaseHTTPRequestHandler):
+    delay = 0.0
+    calls = 0
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with _Handler._lock:
+            _Handler.calls += 1
+        time.sleep(self.delay)
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        out = json.dumps(completion(json.loads(body or b"{}"))).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port: int = 8099, delay: float = 2.0) -> ThreadingHTTPServer:
+    """Start the stub on a daemon thread; returns the server (call .shutdown() to stop)."""
+    handler = type("StubHandler", (_Handler,), {"delay": delay})
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--delay", type=float, default=2.0, help="seconds per completion")
+    args = ap.parse_args()
+    httpd = serve(args.port, args.delay)
+    print(f"OpenAI stub on http://127.0.0.1:{args.port}/v1 (delay {args.delay}s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        httpd.shutdown()
@@ -0,0 +1,337 @@
+# benchmarks/suite.py
+"""
+End-to-end benchmark suite on synthetic MATSim data: parsing, /upload and /story.
+
+    python benchmarks/suite.py                                     # every scenario, 20k persons
+    python benchmarks/suite.py --persons 50000 --plans 3 --steps 9 --facilities 5000 --no-gzip
+    python benchmarks/suite.py --scenarios parse upload_cold --json
+    python benchmarks/suite.py --out bench-main.json               # on the baseline commit
+    python benchmarks/suite.py --compare bench-main.json          # on the change: exit 1 on regression
+
+Scenarios, each in a fresh subprocess with its own empty plan store (so peak RSS is per scenario):
+
+    parse        plans.iter_persons over the mapped file, all plans; no HTTP
+    upload_cold  POST /upload on an empty plan store: hash, parse the first 200 persons, answer
+                 as JSON (the background ingest of the whole run is waited for between samples)
+    upload_warm  POST /upload of a run already in the store
+    summarize    story_api._summarize_plan on each selected plan
+    story        POST /story against benchmarks/openai_stub.py (--llm-delay s per completion),
+                 one request per person; persons with identical days, and every
+                 iteration after the first, hit the story cache
+
+HTTP scenarios go through Flask's test client with Accept-Encoding: gzip, so
+the whole app (routing, compression) is measured without socket noise.
+Input files are generated by benchmarks/synthetic.py from the knobs and seed,
+so two commits benchmarked with the same arguments parse identical bytes.
+
+Per scenario: latency percentiles (ms) over the samples (one per iteration,
+or one per plan / request for summarize and story), throughput (persons or requests per
+second, from the median iteration), peak RSS of the scenario's process, and
+RSS once the app was imported. --out writes {meta, results}, with meta
+holding the git commit, Python and machine next to the knobs. --compare
+flags scenarios whose p50 latency or peak RSS grew by more than --threshold.
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ("parse", "upload_cold", "upload_warm", "summarize", "story")
+PERCENTILES = (50, 90, 99)
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    """Nearest-rank percentiles, mean and max of per-iteration seconds, in ms."""
+    ordered = sorted(samples)
+    n = len(ordered)
+    out = {f"p{q}_ms": round(ordered[min(n - 1, max(0, -(-q * n // 100) - 1))] * 1e3, 3) for q in PERCENTILES}
+    out["mean_ms"] = round(sum(ordered) / n * 1e3, 3)
+    out["max_ms"] = round(ordered[-1] * 1e3, 3)
+    return out
+
+def _timed(fn: Callable[[], Any], iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+# ---- scenarios (run inside the --_worker subprocess) ----
+
+def _post_upload(client, plans: str, facilities: Optional[str], query: str = "limit=200"):
+    data = {"file": (open(plans, "rb"), os.path.basename(plans))}
+    if facilities:
+        data["facilities"] = (open(facilities, "rb"), os.path.basename(facilities))
+    resp = client.post(f"/upload?{query}", data=data, content_type="multipart/form-data",
+                       headers={"Accept-Encoding": "gzip"})
+    if resp.status_code != 200:
+        raise RuntimeError(f"/upload answered {resp.status_code}: {resp.data[:200]!r}")
+    return resp
+
+def _selected_plans(plans: str, facilities: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    """Up to `limit` persons with their selected plan, in the /upload JSON shape /story takes."""
+    import server
+    resp = _post_upload(server.app.test_client(), plans, facilities, f"limit={limit}")
+    body = resp.get_data()
+    return json.loads(gzip.decompress(body) if resp.headers.get("Content-Encoding") == "gzip" else body)
+
+def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    res: Dict[str, Any] = {"scenario": name}
+    if name == "parse":
+        import facility_store
+        import plan_store
+        from mapped_io import open_mapped
+        from plans import iter_persons
+        fac = {}
+        if args.facilities_path:  # built once, outside the timed runs (as the facilities cache would)
+            with open(args.facilities_path, "rb") as fh, open_mapped(fh) as f:
+                fac = facility_store.build_table(plan_store.content_key(fh), facility_store.iter_facilities(f))
+        res["rss_ready_mb"] = round(_peak_rss_mb(), 1)
+        counts = []
+
+        def parse() -> None:
+            with open_mapped(args.plans_path) as f:
+                counts.append(sum(1 for _ in iter_persons(f, fac, selected_only=False)))
+        samples = _timed(parse, args.iterations)
+        res["persons"] = counts[-1]
+        res["input_mb"] = round(os.path.getsize(args.plans_path) / 1e6, 2)
+        unit, per = "persons_per_s", counts[-1]
+
+    elif name in ("upload_cold", "upload_warm"):
+        import plan_store
+        import server
+        client = server.app.test_client()
+        res["rss_ready_mb"] = round(_peak_rss_mb(), 1)
+        sizes = []
+        jobs = []
+
+        def wait_ingest() -> None:
+            # a new run is answered from a bounded parse and stored by a background job
+            while jobs:
+                job = server.ingest_jobs.get(jobs.pop())
+                while job is not None and job.status not in ("done", "error"):
+                    time.sleep(0.005)
+
+        def upload() -> None:
+            resp = _post_upload(client, args.plans_path, args.facilities_path)
+            sizes.append(len(resp.get_data()))
+            if resp.headers.get("X-Ingest-Job"):
+                jobs.append(resp.headers["X-Ingest-Job"])
+
+        if name == "upload_warm":
+            upload()
+            wait_ingest()
+            samples = _timed(upload, args.iterations)
+        else:
+            samples = []
+            for _ in range(args.iterations):
+                # facility tables, runs: everything is parsed again
+                for entry in os.listdir(plan_store.STORE_DIR) if os.path.isdir(plan_store.STORE_DIR) else []:
+                    path = os.path.join(plan_store.STORE_DIR, entry)
+                    if os.path.isdir(path):  # the run registry's SQLite files stay
+                        shutil.rmtree(path, ignore_errors=True)
+                samples += _timed(upload, 1)
+                wait_ingest()  # outside the sample: the response does not wait for it
+        res["response_bytes"] = sizes[-1]
+        unit, per = "requests_per_s", 1
+
+    elif name == "summarize":
+        import story_api
+        plans = [p["plans"][0]["steps"] for p in _selected_plans(args.plans_path, args.facilities_path,
+                                                                 args.story_persons)]
+        res["rss_ready_mb"] = round(_peak_rss_mb(), 1)
+        samples = []
+        for _ in range(args.iterations):
+            for steps in plans:
+                t0 = time.perf_counter()
+                story_api._summarize_plan(steps)
+                samples.append(time.perf_counter() - t0)
+        res["plans"] = len(plans)
+        unit, per = "plans_per_s", 1
+
+    elif name == "story":
+        import openai_stub
+        stub = openai_stub.serve(0, args.llm_delay)  # port 0: any free port
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+        os.environ["OPENAI_API_KEY"] = "stub"
+        import metrics
+        import server
+        persons = _selected_plans(args.plans_path, args.facilities_path, args.story_persons)
+        client = server.app.test_client()
+        res["rss_ready_mb"] = round(_peak_rss_mb(), 1)
+        samples = []
+        for _ in range(args.iterations):
+            for p in persons:
+                body = {"personId": p["personId"], "plan": p["plans"][0]}
+                t0 = time.perf_counter()
+                resp = client.post("/story", json=body)
+                samples.append(time.perf_counter() - t0)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"/story answered {resp.status_code}: {resp.data[:200]!r}")
+        stub.shutdown()
+        res["requests"] = len(samples)
+        res["llm_calls"] = openai_stub._Handler.calls
+        res["cache_hits"] = int(metrics.CACHE_LOOKUPS.value(cache="story", result="hit"))
+        unit, per = "requests_per_s", 1
+    else:
+        raise ValueError(f"unknown scenario: {name!r}")
+
+    res["samples"] = len(samples)
+    res.update(_latency(samples))
+    median = sorted(samples)[len(samples) // 2]
+    res[unit] = round(per / median, 1) if median > 0 else None
+    res["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    return res
+
+# ---- driver ----
+
+def _git(*cmd: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *cmd], cwd=ROOT, check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _inputs(args: argparse.Namespace, workdir: str) -> None:
+    """Generate (or reuse) the plans and facilities files for the knobs; sets args.*_path."""
+    from synthetic import write_facilities, write_plans
+    ext = ".xml.gz" if args.gzip else ".xml"
+    tag = f"{args.persons}p-{args.plans}pl-{args.steps or 'mixed'}st-{args.facilities}f-s{args.seed}"
+    args.plans_path = os.path.join(workdir, f"plans-{tag}{ext}")
+    args.facilities_path = os.path.join(workdir, f"facilities-{args.facilities}f-s{args.seed}{ext}") \
+        if args.facilities else None
+    if not os.path.exists(args.plans_path):
+        write_plans(args.plans_path + ".tmp", args.persons, args.plans, args.seed, args.steps, args.facilities)
+        os.replace(args.plans_path + ".tmp", args.plans_path)
+    if args.facilities_path and not os.path.exists(args.facilities_path):
+        write_facilities(args.facilities_path + ".tmp", args.facilities, args.seed)
+        os.replace(args.facilities_path + ".tmp", args.facilities_path)
+
+def _params(args: argparse.Namespace) -> Dict[str, Any]:
+    keys = ("persons", "plans", "steps", "facilities", "gzip", "seed", "iterations", "story_persons", "llm_delay")
+    return {k: getattr(args, k) for k in keys}
+
+def _run_worker(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    cmd = [sys.executable, os.path.abspath(__file__), "--_worker", name,
+           "--_plans-path", args.plans_path, "--_facilities-path", args.facilities_path or "",
+           "--iterations", str(args.iterations), "--story-persons", str(args.story_persons),
+           "--llm-delay", str(args.llm_delay)]
+    with tempfile.TemporaryDirectory(prefix="dtsbui-suite-") as store_dir:
+        env = dict(os.environ, PLAN_STORE_DIR=store_dir, STORY_CACHE_DB="")
+        env.setdefault("OPENAI_API_KEY", "stub")  # the story routes are registered even when unused
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"scenario {name} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+# (metric, lower is better) pairs checked by --compare
+_COMPARED = (("p50_ms", True), ("peak_rss_mb", True))
+
+def compare(base: Dict[str, Any], results: List[Dict[str, Any]], params: Dict[str, Any],
+            threshold: float) -> List[str]:
+    """Lines describing regressions of `results` against a previous --out document."""
+    if base.get("meta", {}).get("params") != params:
+        print("note: baseline was run with other parameters, ratios may not be meaningful", file=sys.stderr)
+    old = {r["scenario"]: r for r in base.get("results", [])}
+    bad = []
+    for res in results:
+        prev = old.get(res["scenario"])
+        if prev is None:
+            continue
+        for metric, lower_better in _COMPARED:
+            a, b = prev.get(metric), res.get(metric)
+            if not a or b is None:
+                continue
+            ratio = b / a
+            line = f"{res['scenario']:12s} {metric:12s} {a:10.2f} -> {b:10.2f}  ({ratio:5.2f}x)"
+            worse = ratio > 1 + threshold if lower_better else ratio < 1 - threshold
+            if worse:
+                bad.append(line)
+            print(("REGRESSION " if worse else "           ") + line, file=sys.stderr)
+    return bad
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persons", type=int, default=20_000)
+    ap.add_argument("--plans", type=int, default=2, help="plans per person")
+    ap.add_argument("--steps", type=int, default=None, help="steps per plan (default: mixed 3-9)")
+    ap.add_argument("--facilities", type=int, default=0, help="locate activities through a facilities file")
+    ap.add_argument("--no-gzip", dest="gzip", action="store_false", help="plain .xml inputs")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--iterations", type=int, default=5, help="timed runs per scenario")
+    ap.add_argument("--story-persons", type=int, default=200, help="plans sent to /story and summarize")
+    ap.add_argument("--llm-delay", type=float, default=0.0, help="stub seconds per completion")
+    ap.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    ap.add_argument("--workdir", default=None, help="where generated inputs are kept (reused across runs)")
+    ap.add_argument("--json", action="store_true", help="print one JSON object per scenario")
+    ap.add_argument("--out", default=None, help="write {meta, results} here")
+    ap.add_argument("--compare", default=None, metavar="BASELINE_JSON", help="a previous --out file")
+    ap.add_argument("--threshold", type=float, default=0.10, help="allowed growth before --compare fails")
+    ap.add_argument("--_worker", help=argparse.SUPPRESS)
+    ap.add_argument("--_plans-path", dest="plans_path", help=argparse.SUPPRESS)
+    ap.add_argument("--_facilities-path", dest="facilities_path", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args._worker:
+        args.facilities_path = args.facilities_path or None
+        print(json.dumps(run_scenario(args._worker, args)))
+        return 0
+
+    params = _params(args)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dtsbui-suite-inputs-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        _inputs(args, workdir)
+        results = []
+        for name in args.scenarios:
+            res = _run_worker(name, args)
+            results.append(res)
+            if args.json:
+                print(json.dumps(res), flush=True)
+            else:
+                rate = next((f"{v:>10.1f} {k}" for k, v in res.items() if k.endswith("_per_s") and v), "")
+                print(f"{name:12s} p50 {res['p50_ms']:9.2f} ms | p90 {res['p90_ms']:9.2f} | "
+                      f"p99 {res['p99_ms']:9.2f} | peak RSS {res['peak_rss_mb']:7.1f} MB | {rate}", flush=True)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    doc = {
+        "meta": {
+            "commit": _git("rev-parse", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "params": params,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(doc, fh, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            if compare(json.load(fh), results, params, args.threshold):
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# benchmarks/synthetic.py
+"""
+Deterministic synthetic MATSim population (plans v6) and facilities (v2) files for benchmarks.
+
+    python benchmarks/synthetic.py 100000 /tmp/plans_100k.xml.gz
+    python benchmarks/synthetic.py 20000 /tmp/plans.xml --plans 5 --steps 9 \
+        --facilities 5000 --facilities-out /tmp/facilities.xml.gz
+
+A path ending in .gz is gzipped. The same arguments and seed always give the same bytes.
+"""
+import argparse
+import gzip
+import random
+from typing import Iterator, Optional
+
+ACT_TYPES = ["Home", "Work", "Shopping", "Business", "Leisure"]
+MODES = ["car", "walk", "pt", "bike"]
+
+def _clock(sec: int) -> str:
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}"
+
+def iter_plans_xml(persons: int, plans_per_person: int = 2, seed: int = 0,
+                   steps: Optional[int] = None, facilities: int = 0) -> Iterator[str]:
+    """
+    Yield the XML text of a population in small pieces.
+    Mixes end_time / max_dur / open activities, legs with and without
+    dep_time/trav_time, unscored plans and plan-less persons, so every branch
+    of the parser is exercised.
+    `steps` fixes the steps (activities + legs) per plan, rounded up to an odd
+    number; by default plans have 2-5 activities. With `facilities`, activities
+    reference facility ids f0 .. f<facilities - 1> instead of carrying x/y.
+    """
+    rnd = random.Random(seed)
+    yield ('<?xml version="1.0" encoding="utf-8"?>\n'
+           '<!DOCTYPE population SYSTEM "http://www.matsim.org/files/dtd/population_v6.dtd">\n'
+           '<population>\n'
+           '<attributes><attribute name="coordinateReferenceSystem" class="java.lang.String">Atlantis</attribute></attributes>\n')
+    for p in range(persons):
+        if rnd.random() < 0.02:
+            yield f'<person id="{p}"/>\n'
+            continue
+        yield (f'<person id="{p}">\n<attributes><attribute name="age" class="java.lang.Integer">'
+               f'{rnd.randint(1, 90)}</attribute></attributes>\n')
+        sel = rnd.randrange(plans_per_person)
+        for k in range(plans_per_person):
+            score = "" if rnd.random() < 0.1 else f' score="{rnd.uniform(-50, 150):.6f}"'
+            yield f'<plan{score} selected="{"yes" if k == sel else "no"}">\n'
+            t = rnd.randint(5 * 3600, 9 * 3600)
+            n_acts = max(1, (steps + 1) // 2) if steps else rnd.randint(2, 5)
+            for a in range(n_acts):
+                act = rnd.choice(ACT_TYPES)
+                if facilities:
+                    loc = f'facility="f{rnd.randrange(facilities)}"'
+                else:
+                    loc = f'x="{rnd.uniform(0, 1e4):.3f}" y="{rnd.uniform(0, 1e4):.3f}"'
+                if a == n_acts - 1:
+                    yield f'<activity type="{act}" {loc} />\n'
+                    break
+                c = rnd.random()
+                if c < 0.6:
+                    t += rnd.randint(1800, 4 * 3600)
+                    yield f'<activity type="{act}" {loc} end_time="{_clock(t)}" />\n'
+                elif c < 0.8:
+                    md = rnd.randint(600, 7200)
+                    t += md
+                    yield f'<activity type="{act}" {loc} max_dur="{_clock(md)}" />\n'
+                else:
+                    yield f'<activity type="{act}" {loc} />\n'
+                tt = rnd.randint(60, 3600)
+                dep = f' dep_time="{_clock(t)}"' if rnd.random() < 0.8 else ""
+                trav = f' trav_time="{_clock(tt)}"' if rnd.random() < 0.9 else ""
+                yield (f'<leg mode="{rnd.choice(MODES)}"{dep}{trav}>\n'
+                       f'<route type="generic" start_link="1" end_link="2" trav_time="{_clock(tt)}"></route>\n'
+                       '</leg>\n')
+                t += tt
+            yield '</plan>\n'
+        yield '</person>\n'
+    yield '</population>\n'
+
+class SyntheticPlansStream:
+    """
+    Read-only text stream over iter_plans_xml, so arbitrarily large populations
+    can be parsed without ever being written to disk.
+    """
+
+    def __init__(self, persons: int, plans_per_person: int = 2, seed: int = 0):
+        self._pieces = iter_plans_xml(persons, plans_per_person, seed)
+        self._buf = ""
+        self.chars_read = 0
+
+    def read(self, size: int = -1) -> str:
+        parts = [self._buf]
+        have = len(self._buf)
+        for piece in self._pieces:
+            parts.append(piece)
+            have += len(piece)
+            if 0 <= size <= have:
+                break
+        data = "".join(parts)
+        if size < 0:
+            size = len(data)
+        self._buf = data[size:]
+        out = data[:size]
+        self.chars_read += len(out)
+        return out
+
+def iter_facilities_xml(facilities: int, seed: int = 0) -> Iterator[str]:
+    """Yield a facilities file with ids f0 .. f<facilities - 1>, as referenced by iter_plans_xml."""
+    rnd = random.Random(seed)
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<facilities>\n'
+    for k in range(facilities):
+        yield (f'<facility id="f{k}" x="{rnd.uniform(0, 1e4):.3f}" y="{rnd.uniform(0, 1e4):.3f}">'
+               f'<activity type="{rnd.choice(ACT_TYPES)}"/></facility>\n')
+    yield '</facilities>\n'
+
+def _write(path: str, pieces: Iterator[str]) -> str:
+    # mtime=0: the same content always gives the same .gz bytes (and the same content hash)
+    if path.endswith(".gz"):
+        with open(path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            for piece in pieces:
+                gz.write(piece.encode("utf-8"))
+    else:
+        with open(path, "w", encoding="utf-8") as fh:
+            for piece in pieces:
+                fh.write(piece)
+    return path
+
+def write_plans(path: str, persons: int, plans_per_person: int = 2, seed: int = 0,
+                steps: Optional[int] = None, facilities: int = 0) -> str:
+    """Write a synthetic plans file; gzip when the path ends in .gz."""
+    return _write(path, iter_plans_xml(persons, plans_per_person, seed, steps, facilities))
+
+def write_facilities(path: str, facilities: int, seed: int = 0) -> str:
+    """Write a synthetic facilities file; gzip when the path ends in .gz."""
+    return _write(path, iter_facilities_xml(facilities, seed))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("persons", type=int)
+    ap.add_argument("path")
+    ap.add_argument("--plans", type=int, default=2, help="plans per person")
+    ap.add_argument("--steps", type=int, default=None, help="steps per plan (default: 3-9)")
+    ap.add_argument("--facilities", type=int, default=0, help="locate activities by facility id")
+    ap.add_argument("--facilities-out", default=None, help="also write the facilities file here")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    write_plans(args.path, args.persons, args.plans, args.seed, args.steps, args.facilities)
+    if args.facilities_out:
+        write_facilities(args.facilities_out, args.facilities, args.seed)
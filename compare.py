@@ -0,0 +1,168 @@
+# compare.py
+"""
+Baseline vs scenario: per-person and population deltas between two PlanStores.
+
+Persons are matched by personId in one pass over both stores. When both runs
+list the same persons in the same order (the usual case: one population,
+re-simulated), rows are paired directly. Otherwise the join merges the two
+stores' idx_person_order indexes (persons sorted by id, written at ingest),
+which is a sort-merge join over the mapped files: memory stays flat whatever
+the order. Each person is reduced to its selected plan's main mode (the mode
+with the most travel time), travel seconds and serverScore.
+"""
+import array
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from plan_store import KIND_LEG, MISSING, PlanStore
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+Metrics = Tuple[Optional[str], int, float]  # main mode, travel seconds, serverScore
+
+def join_rows(base: PlanStore, scen: PlanStore) -> Iterator[Tuple[int, int]]:
+    """(baseline row, scenario row) per personId; -1 on the side that lacks the person."""
+    if base.same_persons(scen):
+        for i in range(len(base)):
+            yield i, i
+        return
+    ob, os_ = base.cols["idx_person_order"], scen.cols["idx_person_order"]
+    nb, ns = len(ob), len(os_)
+    i = j = 0
+    id_b = base.person_id_bytes(ob[0]) if nb else None
+    id_s = scen.person_id_bytes(os_[0]) if ns else None
+    while i < nb or j < ns:
+        if j >= ns or (i < nb and id_b < id_s):
+            yield ob[i], -1
+            i += 1
+            id_b = base.person_id_bytes(ob[i]) if i < nb else None
+        elif i >= nb or id_s < id_b:
+            yield -1, os_[j]
+            j += 1
+            id_s = scen.person_id_bytes(os_[j]) if j < ns else None
+        else:
+            yield ob[i], os_[j]
+            i += 1
+            j += 1
+            id_b = base.person_id_bytes(ob[i]) if i < nb else None
+            id_s = scen.person_id_bytes(os_[j]) if j < ns else None
+
+def person_metrics(store: PlanStore, row: int) -> Metrics:
+    """(main mode, travel seconds, serverScore) of the person's selected plan."""
+    c = store.cols
+    p = c["person_plan_start"][row] + c["person_selected"][row]
+    if p >= c["person_plan_start"][row + 1]:
+        return None, 0, 0.0  # no plans
+    kind, label, dur = c["step_kind"], c["step_label"], c["step_dur"]
+    by_mode: Dict[int, int] = {}
+    travel = 0
+    for k in range(c["plan_step_start"][p], c["plan_step_start"][p + 1]):
+        if kind[k] == KIND_LEG:
+            d = dur[k]
+            d = d if d != MISSING and d > 0 else 0
+            by_mode[label[k]] = by_mode.get(label[k], 0) + d
+            travel += d
+    main = None
+    if by_mode:
+        code = max(by_mode, key=by_mode.__getitem__)  # first mode wins ties
+        main = store.labels[code] if code >= 0 else None
+    return main, travel, c["plan_server_score"][p]
+
+def _quantiles(values: "array.array") -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    n = len(ordered)
+    return {f"p{int(q * 100)}": ordered[min(n - 1, int(q * n))] for q in QUANTILES}
+
+def _mode_key(mode: Optional[str]) -> str:
+    return "none" if mode is None else mode  # persons without legs
+
+def _share(counts: Dict[Optional[str], int], n: int) -> Dict[str, float]:
+    return {_mode_key(k): v / n for k, v in counts.items()} if n else {}
+
+def compare_stores(base: PlanStore, scen: PlanStore, limit: int = 200,
+                   changed_only: bool = True) -> Dict[str, Any]:
+    """
+    {"summary": population deltas, "persons": up to `limit` per-person deltas in join order
+    (only persons whose main mode, travel time or serverScore changed, with changed_only),
+    "truncated": whether more persons qualified}.
+    """
+    matched = only_base = only_scen = mode_changed = improved = worsened = 0
+    switches: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    main_b: Dict[Optional[str], int] = defaultdict(int)
+    main_s: Dict[Optional[str], int] = defaultdict(int)
+    travel_b = travel_s = 0
+    score_b = score_s = 0.0
+    score_delta = array.array("d")
+    travel_delta = array.array("d")
+    persons: List[Dict[str, Any]] = []
+    truncated = False
+
+    for rb, rs in join_rows(base, scen):
+        if rb < 0:
+            only_scen += 1
+            continue
+        if rs < 0:
+            only_base += 1
+            continue
+        matched += 1
+        mb, tb, sb = person_metrics(base, rb)
+        ms, ts, ss = person_metrics(scen, rs)
+        main_b[mb] += 1
+        main_s[ms] += 1
+        travel_b += tb
+        travel_s += ts
+        score_b += sb
+        score_s += ss
+        score_delta.append(ss - sb)
+        travel_delta.append((ts - tb) / 60.0)
+        if mb != ms:
+            mode_changed += 1
+            switches[_mode_key(mb)][_mode_key(ms)] += 1
+        if ss > sb:
+            improved += 1
+        elif ss < sb:
+            worsened += 1
+        if changed_only and mb == ms and tb == ts and sb == ss:
+            continue
+        if len(persons) >= limit:
+            truncated = True
+            continue
+        persons.append({
+            "personId": base.person_id(rb),
+            "baseline": {"mainMode": mb, "travelSec": tb, "serverScore": sb},
+            "scenario": {"mainMode": ms, "travelSec": ts, "serverScore": ss},
+            "delta": {"travelSec": ts - tb, "serverScore": ss - sb},
+            "modeChanged": mb != ms,
+        })
+
+    share_b, share_s = _share(main_b, matched), _share(main_s, matched)
+    summary = {
+        "matched": matched,
+        "onlyBaseline": only_base,
+        "onlyScenario": only_scen,
+        "modeChanged": mode_changed,
+        "mainModeShare": {
+            "baseline": share_b,
+            "scenario": share_s,
+            "delta": {m: share_s.get(m, 0.0) - share_b.get(m, 0.0) for m in sorted(set(share_b) | set(share_s))},
+        },
+        "mainModeSwitches": {k: dict(v) for k, v in switches.items()},
+        "travelMinutes": {
+            "baseline": round(travel_b / 60.0),
+            "scenario": round(travel_s / 60.0),
+            "delta": round((travel_s - travel_b) / 60.0),
+            "meanDeltaPerPerson": (travel_s - travel_b) / 60.0 / matched if matched else None,
+            "deltaQuantiles": _quantiles(travel_delta),
+        },
+        "serverScore": {
+            "baselineMean": score_b / matched if matched else None,
+            "scenarioMean": score_s / matched if matched else None,
+            "meanDelta": (score_s - score_b) / matched if matched else None,
+            "deltaQuantiles": _quantiles(score_delta),
+            "improved": improved,
+            "worsened": worsened,
+        },
+    }
+    return {"summary": summary, "persons": persons, "truncated": truncated}
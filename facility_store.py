@@ -0,0 +1,157 @@
+# facility_store.py
+"""
+Cached, memory-mapped facility coordinate tables.
+
+A facilities file is parsed once per content hash into
+STORE_DIR/facilities/<hash>/: facility ids sorted by their UTF-8 bytes
+(one blob plus end offsets) and a float64 (x, y) array in the same order.
+Lookups binary-search the mapped ids, so nothing is rebuilt per request.
+"""
+import array
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from plan_store import STORE_DIR, map_column
+
+FACILITY_DIR = os.path.join(STORE_DIR, "facilities")
+TABLE_VERSION = 1
+LOOKUP_CACHE_SIZE = 100_000  # facility ids repeat a lot (home/work), so memoize hits
+
+_IDS = "ids.bin"
+_ID_END = "id_end"
+_XY = "xy"
+_META = "meta.json"
+
+def iter_facilities(f) -> Iterator[Tuple[str, float, float]]:
+    """(facilityId, x, y) for every facility with usable coordinates in a facilities XML (v2) text stream."""
+    root = None
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            if elem.tag == "facility":
+                fid = elem.attrib.get("id")
+                x = elem.attrib.get("x")
+                y = elem.attrib.get("y")
+                if fid and x and y:
+                    try:
+                        yield fid, float(x), float(y)
+                    except Exception:
+                        pass
+        elif elem.tag == "facility":
+            elem.clear()
+            root.clear()
+
+class FacilityTable:
+    """
+    Read-only {facilityId: (x, y)} view over a committed table.
+    Supports the dict calls the plan parser uses: get(), `in`, len().
+    """
+
+    def __init__(self, path: str, meta: Dict):
+        self.path = path
+        self.meta = meta
+        self._maps = []
+        views = {}
+        for name, code in ((_IDS, "B"), (_ID_END, "q"), (_XY, "d")):
+            mm, view = map_column(os.path.join(path, name), code)
+            if mm is not None:
+                self._maps.append(mm)
+            views[name] = view
+        self._ids = views[_IDS]
+        self._id_end = views[_ID_END]
+        self._xy = views[_XY]
+        self._n = len(self._id_end)
+        self._cache: Dict[str, Optional[Tuple[float, float]]] = {}
+
+    def __reduce__(self):
+        # worker processes re-map the files instead of receiving the data
+        return (_open_table_at, (self.path,))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _id_at(self, i: int) -> bytes:
+        start = self._id_end[i - 1] if i > 0 else 0
+        return bytes(self._ids[start:self._id_end[i]])
+
+    def index_of(self, fid: str) -> int:
+        """Row of `fid` in the sorted table, or -1."""
+        key = fid.encode("utf-8")
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self._n and self._id_at(lo) == key else -1
+
+    def get(self, fid: str, default=None) -> Optional[Tuple[float, float]]:
+        try:
+            xy = self._cache[fid]
+        except KeyError:
+            i = self.index_of(fid)
+            xy = (self._xy[2 * i], self._xy[2 * i + 1]) if i >= 0 else None
+            if len(self._cache) < LOOKUP_CACHE_SIZE:
+                self._cache[fid] = xy
+        return default if xy is None else xy
+
+    def __contains__(self, fid: str) -> bool:
+        return self.get(fid) is not None
+
+def _open_table_at(path: str) -> Optional[FacilityTable]:
+    try:
+        with open(os.path.join(path, _META), encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != TABLE_VERSION:
+        return None
+    return FacilityTable(path, meta)
+
+def open_table(key: str) -> Optional[FacilityTable]:
+    """The cached table for a facilities content hash, or None."""
+    return _open_table_at(os.path.join(FACILITY_DIR, key))
+
+def build_table(key: str, rows: Iterable[Tuple[str, float, float]]) -> FacilityTable:
+    """Sort rows by id (last duplicate wins, like the old dict) and commit them as a table."""
+    latest: Dict[bytes, Tuple[float, float]] = {}
+    for fid, x, y in rows:
+        latest[fid.encode("utf-8")] = (x, y)
+
+    os.makedirs(FACILITY_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=FACILITY_DIR)
+    try:
+        id_end = array.array("q")
+        xy = array.array("d")
+        end = 0
+        with open(os.path.join(tmp, _IDS), "wb") as ids:
+            for fid in sorted(latest):
+                ids.write(fid)
+                end += len(fid)
+                id_end.append(end)
+                xy.extend(latest[fid])
+        del latest
+        with open(os.path.join(tmp, _ID_END), "wb") as fh:
+            id_end.tofile(fh)
+        with open(os.path.join(tmp, _XY), "wb") as fh:
+            xy.tofile(fh)
+        with open(os.path.join(tmp, _META), "w", encoding="utf-8") as fh:
+            json.dump({"version": TABLE_VERSION, "key": key, "facilities": len(id_end)}, fh)
+        try:
+            os.rename(tmp, os.path.join(FACILITY_DIR, key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # built concurrently elsewhere
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    table = open_table(key)
+    if table is None:
+        raise RuntimeError(f"facility table {key} missing after build")
+    return table
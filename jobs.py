@@ -0,0 +1,119 @@
+# jobs.py
+"""
+Background ingest jobs.
+
+JobQueue runs callables on a fixed set of worker threads fed by a bounded
+queue: when all workers are busy and the queue is full, submit() raises
+QueueFull instead of piling more parses onto the CPUs. Each Job carries the
+progress its function reports (bytes read, persons parsed) so /jobs/<id> can
+show it while the parse runs.
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 256  # persons between bytes-read updates
+
+class QueueFull(Exception):
+    """No worker free and no queue slot left; retry later."""
+
+class Job:
+    def __init__(self, bytes_total: int = 0):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"   # queued -> running -> done | error
+        self.phase: Optional[str] = None
+        self.bytes_total = bytes_total
+        self.bytes_read = 0
+        self.persons = 0
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+
+    def track(self, persons: Iterable[Dict[str, Any]], raw) -> Iterator[Dict[str, Any]]:
+        """Pass persons through, counting them and sampling raw.tell() as bytes read."""
+        for person in persons:
+            self.persons += 1
+            if self.persons % PROGRESS_EVERY == 0:
+                self.bytes_read = raw.tell()
+            yield person
+        self.bytes_read = self.bytes_total
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "phase": self.phase,
+            "bytesRead": self.bytes_read,
+            "bytesTotal": self.bytes_total,
+            "persons": self.persons,
+            "personsPerSec": round(self.persons / elapsed, 1) if elapsed > 0 else 0.0,
+            "elapsedSec": round(elapsed, 3),
+            "error": self.error,
+        }
+
+class JobQueue:
+    """`workers` threads, at most `max_queued` waiting jobs; finished jobs are kept `keep_sec`."""
+
+    def __init__(self, workers: int, max_queued: int, keep_sec: float = 3600):
+        self.workers = max(1, workers)
+        self.keep_sec = keep_sec
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_queued))
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._threads: list = []
+
+    def submit(self, job: Job, fn: Callable[..., Any], *args) -> Job:
+        """Queue fn(job, *args); its return value becomes job.result."""
+        self._start()
+        self._prune()
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait((job, fn, args))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f"{self.workers} ingest jobs running and {self._queue.maxsize} waiting")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _start(self) -> None:
+        with self._lock:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._work, name=f"ingest-job-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.keep_sec
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+                del self._jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            job, fn, args = self._queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.result = fn(job, *args)
+                job.status = "done"
+            except Exception as e:
+                logger.warning("job %s failed: %s", job.id, e)
+                job.error = str(e) or type(e).__name__
+                job.status = "error"
+            finally:
+                job.finished = time.time()
+                self._queue.task_done()
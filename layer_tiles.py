@@ -0,0 +1,401 @@
+# layer_tiles.py
+"""
+Pre-rendered GeoJSON tiles for the static map layers in assets/data.
+
+Each layer (a .geojson file, or a .zip holding one) is cut once per content
+hash into STORE_DIR/tiles/<layer>/<version>/<z>/<x>/<y>.json.gz for zooms
+TILE_MIN_ZOOM..TILE_MAX_ZOOM of the usual XYZ (Web Mercator) scheme, so a map
+view only downloads the features it shows. Per zoom, geometries are
+simplified (Douglas-Peucker, TILE_SIMPLIFY_PX screen pixels) and coordinates
+rounded to a fraction of a pixel. A feature crossing tiles is clipped to each
+tile plus a TILE_BUFFER_PX margin (so strokes meet at the seams). Tiles hold
+geometry only: each feature carries its "id", an index into the layer's
+properties.json.gz, written once per version instead of once per tile and
+zoom. Past TILE_MAX_ZOOM the client keeps using max-zoom tiles.
+
+Building takes seconds per layer, so it never runs inside a request: the
+server queues it at startup (and when a source changes) and answers 503
+until the tiles are there.
+
+    python layer_tiles.py            # pre-render every layer ahead of time
+"""
+import gzip
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from hashlib import sha256
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from plan_store import STORE_DIR
+
+LAYER_DIR = os.getenv("LAYER_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "data")
+TILE_DIR = os.path.join(STORE_DIR, "tiles")
+TILE_MIN_ZOOM = int(os.getenv("TILE_MIN_ZOOM", "8"))
+TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "14"))
+TILE_SIMPLIFY_PX = float(os.getenv("TILE_SIMPLIFY_PX", "1.0"))
+TILE_BUFFER_PX = float(os.getenv("TILE_BUFFER_PX", "8"))  # margin kept around each tile when clipping
+TILE_VERSION = 2  # bump when the tiling itself changes
+
+_META = "meta.json"
+_PROPERTIES = "properties.json.gz"
+EMPTY_TILE = gzip.compress(b'{"type":"FeatureCollection","features":[]}', mtime=0)
+
+_versions: Dict[Tuple[str, int, int], str] = {}  # (path, mtime_ns, size) -> version
+_build_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+# ---- layer sources ----
+def layer_sources() -> Dict[str, str]:
+    """{layer name: file} for every .geojson / .zip in LAYER_DIR."""
+    out = {}
+    try:
+        names = sorted(os.listdir(LAYER_DIR))
+    except OSError:
+        return {}
+    for fn in names:
+        stem, ext = os.path.splitext(fn)
+        if ext.lower() in (".geojson", ".zip"):
+            out[stem] = os.path.join(LAYER_DIR, fn)
+    return out
+
+def _source_version(path: str) -> str:
+    st = os.stat(path)
+    memo = (path, st.st_mtime_ns, st.st_size)
+    version = _versions.get(memo)
+    if version is None:
+        version = _versions[memo] = _hash_source(path)
+    return version
+
+def _hash_source(path: str) -> str:
+    h = sha256(f"v{TILE_VERSION}:{TILE_MIN_ZOOM}-{TILE_MAX_ZOOM}:{TILE_SIMPLIFY_PX}:{TILE_BUFFER_PX}:".encode("ascii"))
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+def _read_features(path: str) -> List[Dict[str, Any]]:
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            members = [n for n in zf.namelist() if n.lower().endswith(".geojson")]
+            if not members:
+                raise ValueError(f"{os.path.basename(path)}: no .geojson inside")
+            data = json.loads(zf.read(members[0]))
+    else:
+        with open(path, "rb") as fh:
+            data = json.load(fh)
+    return data.get("features") or []
+
+# ---- geometry ----
+def _tile_of(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    n = 1 << z
+    lat = max(-85.05112878, min(85.05112878, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(n - 1, max(0, x)), min(n - 1, max(0, y))
+
+def _positions(coords) -> Iterator[List[float]]:
+    if coords and isinstance(coords[0], (int, float)):
+        yield coords
+    else:
+        for c in coords or ():
+            yield from _positions(c)
+
+def _bbox(geom: Dict[str, Any]) -> Optional[Tuple[float, float, float, float]]:
+    if geom.get("type") == "GeometryCollection":
+        boxes = [b for b in map(_bbox, geom.get("geometries") or []) if b]
+        if not boxes:
+            return None
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+    pts = list(_positions(geom.get("coordinates")))
+    if not pts:
+        return None
+    xs = [p[0] for p in pts]
+    ys = [p[1] for p in pts]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def simplify_line(pts: List[List[float]], tol: float, keep: int) -> List[List[float]]:
+    """Douglas-Peucker; keeps the input when the result would have fewer than `keep` points."""
+    if len(pts) <= keep:
+        return pts
+    tol2 = tol * tol
+    marked = [False] * len(pts)
+    marked[0] = marked[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        a, b = stack.pop()
+        ax, ay = pts[a][0], pts[a][1]
+        dx, dy = pts[b][0] - ax, pts[b][1] - ay
+        seg2 = dx * dx + dy * dy
+        worst, worst_d = -1, tol2
+        for i in range(a + 1, b):
+            px, py = pts[i][0] - ax, pts[i][1] - ay
+            if seg2 == 0.0:
+                d = px * px + py * py
+            else:
+                cross = px * dy - py * dx
+                d = cross * cross / seg2
+            if d > worst_d:
+                worst, worst_d = i, d
+        if worst >= 0:
+            marked[worst] = True
+            stack.append((a, worst))
+            stack.append((worst, b))
+    out = [p for p, m in zip(pts, marked) if m]
+    return out if len(out) >= keep else pts
+
+def _round(pts: List[List[float]], digits: int) -> List[List[float]]:
+    out: List[List[float]] = []
+    for p in pts:
+        q = [round(p[0], digits), round(p[1], digits)]
+        if not out or out[-1] != q:
+            out.append(q)
+    return out
+
+def _simplify(geom: Dict[str, Any], tol: float, digits: int) -> Dict[str, Any]:
+    t = geom.get("type")
+    c = geom.get("coordinates")
+    if t == "GeometryCollection":
+        return {"type": t, "geometries": [_simplify(g, tol, digits) for g in geom.get("geometries") or []]}
+    if t == "Point":
+        return {"type": t, "coordinates": [round(c[0], digits), round(c[1], digits)]}
+    if t == "MultiPoint":
+        return {"type": t, "coordinates": [[round(p[0], digits), round(p[1], digits)] for p in c]}
+
+    def line(pts):
+        return simplify_line(_round(pts, digits), tol, 2) if len(pts) > 1 else pts
+
+    def ring(pts):
+        r = simplify_line(_round(pts, digits), tol, 4)
+        return r if len(r) >= 4 else pts
+
+    if t == "LineString":
+        return {"type": t, "coordinates": line(c)}
+    if t == "MultiLineString":
+        return {"type": t, "coordinates": [line(l) for l in c]}
+    if t == "Polygon":
+        return {"type": t, "coordinates": [ring(r) for r in c]}
+    if t == "MultiPolygon":
+        return {"type": t, "coordinates": [[ring(r) for r in poly] for poly in c]}
+    return geom
+
+def _zoom_tolerance(z: int) -> Tuple[float, int]:
+    """(simplification tolerance in degrees, decimal digits kept) at zoom z."""
+    px = 360.0 / (256 * (1 << z))
+    return px * TILE_SIMPLIFY_PX, max(0, math.ceil(-math.log10(px / 8)))
+
+# ---- clipping ----
+def _tile_lon(x: float, z: int) -> float:
+    return x / (1 << z) * 360.0 - 180.0
+
+def _tile_lat(y: float, z: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y / (1 << z)))))
+
+def _cut(a: List[float], b: List[float], k: float, axis: int, digits: int) -> List[float]:
+    """Where segment a-b crosses coordinate k on `axis`."""
+    t = (k - a[axis]) / (b[axis] - a[axis])
+    other = round(a[1 - axis] + t * (b[1 - axis] - a[1 - axis]), digits)
+    return [k, other] if axis == 0 else [other, k]
+
+def _clip_points(pts: List[List[float]], k1: float, k2: float, axis: int, digits: int,
+                 ring: bool) -> List[List[List[float]]]:
+    """
+    The parts of a line (or closed ring) with k1 <= coordinate <= k2 on `axis`. A line
+    comes back as the pieces inside the slab; a ring as one ring running along the slab
+    edges where it was cut (Sutherland-Hodgman against two parallel planes).
+    """
+    parts: List[List[List[float]]] = []
+    cur: List[List[float]] = []
+    for a, b in zip(pts, pts[1:]):
+        ak, bk = a[axis], b[axis]
+        if ak < k1:
+            if bk > k1:
+                cur.append(_cut(a, b, k1, axis, digits))  # enters from below
+        elif ak > k2:
+            if bk < k2:
+                cur.append(_cut(a, b, k2, axis, digits))  # enters from above
+        else:
+            cur.append(a)
+        exited = False
+        if bk < k1 <= ak:
+            cur.append(_cut(a, b, k1, axis, digits))
+            exited = True
+        if ak <= k2 < bk:
+            cur.append(_cut(a, b, k2, axis, digits))
+            exited = True
+        if exited and not ring:
+            if len(cur) > 1:
+                parts.append(cur)
+            cur = []
+    if pts and k1 <= pts[-1][axis] <= k2:
+        cur.append(pts[-1])
+    if ring:
+        if cur and cur[0] != cur[-1]:
+            cur.append(cur[0])
+        return [cur] if len(cur) >= 4 else []
+    if len(cur) > 1:
+        parts.append(cur)
+    return parts
+
+def _clip(geom: Dict[str, Any], k1: float, k2: float, axis: int, digits: int) -> Optional[Dict[str, Any]]:
+    """geom cut to the slab k1..k2 on `axis` (0: lon, 1: lat); None when nothing is left."""
+    t = geom.get("type")
+    c = geom.get("coordinates")
+    if t == "GeometryCollection":
+        parts = [g for g in (_clip(g, k1, k2, axis, digits) for g in geom.get("geometries") or []) if g]
+        return {"type": t, "geometries": parts} if parts else None
+    if t == "Point":
+        return geom if k1 <= c[axis] <= k2 else None
+    if t == "MultiPoint":
+        pts = [p for p in c if k1 <= p[axis] <= k2]
+        return {"type": t, "coordinates": pts} if pts else None
+    if t in ("LineString", "MultiLineString"):
+        lines = [piece for l in (c if t == "MultiLineString" else [c])
+                 for piece in _clip_points(l, k1, k2, axis, digits, ring=False)]
+        if not lines:
+            return None
+        return {"type": "LineString", "coordinates": lines[0]} if len(lines) == 1 else \
+            {"type": "MultiLineString", "coordinates": lines}
+
+    def polygon(rings):
+        out = [_clip_points(r, k1, k2, axis, digits, ring=True) for r in rings]
+        if not out or not out[0]:
+            return None  # the outer ring is gone, and its holes with it
+        return [r[0] for r in out if r]
+
+    if t == "Polygon":
+        p = polygon(c)
+        return {"type": t, "coordinates": p} if p else None
+    if t == "MultiPolygon":
+        polys = [p for p in map(polygon, c) if p]
+        return {"type": t, "coordinates": polys} if polys else None
+    return geom
+
+def _tile_pieces(geom: Dict[str, Any], x0: int, y0: int, x1: int, y1: int, z: int,
+                 digits: int) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """(x, y, part of geom in that buffered tile) over the tile range; cut into columns, then rows."""
+    buf = TILE_BUFFER_PX / 256
+    for tx in range(x0, x1 + 1):
+        column = geom if x0 == x1 else _clip(
+            geom, round(_tile_lon(tx - buf, z), digits), round(_tile_lon(tx + 1 + buf, z), digits), 0, digits)
+        if column is None:
+            continue
+        for ty in range(y0, y1 + 1):
+            piece = column if y0 == y1 else _clip(  # tile y grows southwards
+                column, round(_tile_lat(ty + 1 + buf, z), digits), round(_tile_lat(ty - buf, z), digits), 1, digits)
+            if piece is not None:
+                yield tx, ty, piece
+
+# ---- building ----
+def _layer_path(name: str, version: str) -> str:
+    return os.path.join(TILE_DIR, name, version)
+
+def build_layer(name: str, source: str, version: str) -> Dict[str, Any]:
+    """Cut one layer into gzip tiles under TILE_DIR/<name>/<version> (atomically); returns its meta."""
+    features = _read_features(source)
+    boxes = [_bbox(f.get("geometry") or {}) for f in features]
+    os.makedirs(os.path.join(TILE_DIR, name), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.join(TILE_DIR, name))
+    tiles = 0
+    try:
+        for z in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1):
+            tol, digits = _zoom_tolerance(z)
+            per_tile: Dict[Tuple[int, int], List[str]] = {}
+            for fid, (feature, box) in enumerate(zip(features, boxes)):
+                if box is None:
+                    continue
+                x0, y1 = _tile_of(box[0], box[1], z)  # tile y grows southwards
+                x1, y0 = _tile_of(box[2], box[3], z)
+                head = '{"type":"Feature","id":%d,"properties":{},"geometry":' % fid
+                geom = _simplify(feature["geometry"], tol, digits)
+                for tx, ty, piece in _tile_pieces(geom, x0, y0, x1, y1, z, digits):
+                    per_tile.setdefault((tx, ty), []).append(
+                        head + json.dumps(piece, ensure_ascii=False, separators=(",", ":")) + "}")
+            for (tx, ty), items in per_tile.items():
+                d = os.path.join(tmp, str(z), str(tx))
+                os.makedirs(d, exist_ok=True)
+                body = '{"type":"FeatureCollection","features":[' + ",".join(items) + "]}"
+                with open(os.path.join(d, f"{ty}.json.gz"), "wb") as fh:
+                    fh.write(gzip.compress(body.encode("utf-8"), 6, mtime=0))
+                tiles += 1
+        props = json.dumps([f.get("properties") or {} for f in features], ensure_ascii=False, separators=(",", ":"))
+        with open(os.path.join(tmp, _PROPERTIES), "wb") as fh:
+            fh.write(gzip.compress(props.encode("utf-8"), 6, mtime=0))
+        known = [b for b in boxes if b]
+        meta = {
+            "version": version,
+            "layer": name,
+            "minZoom": TILE_MIN_ZOOM,
+            "maxZoom": TILE_MAX_ZOOM,
+            "features": len(features),
+            "tiles": tiles,
+            "bounds": [min(b[0] for b in known), min(b[1] for b in known),
+                       max(b[2] for b in known), max(b[3] for b in known)] if known else None,
+        }
+        with open(os.path.join(tmp, _META), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False)
+        try:
+            os.rename(tmp, _layer_path(name, version))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # built concurrently by another process
+        return meta
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+def current_layer(name: str) -> Optional[Tuple[str, str]]:
+    """(source file, tile version) of a layer as its source is now; None for an unknown layer."""
+    source = layer_sources().get(name)
+    if source is None:
+        return None
+    return source, _source_version(source)
+
+def built_meta(name: str, version: str) -> Optional[Dict[str, Any]]:
+    """Meta of a built tile version; None while it is not built."""
+    try:
+        with open(os.path.join(_layer_path(name, version), _META), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+def ensure_built(name: str, source: str, version: str) -> Dict[str, Any]:
+    """Meta of that tile version, building it first unless it exists (one build per layer at a time)."""
+    meta = built_meta(name, version)
+    if meta is None:
+        with _locks_guard:
+            lock = _build_locks.setdefault(name, threading.Lock())
+        with lock:
+            meta = built_meta(name, version) or build_layer(name, source, version)
+    return meta
+
+def layer_meta(name: str) -> Optional[Dict[str, Any]]:
+    """Meta of the layer's current tiles, building them first if the source changed; None for an unknown layer."""
+    current = current_layer(name)
+    return None if current is None else ensure_built(name, *current)
+
+def read_tile(name: str, version: str, z: int, x: int, y: int) -> Optional[bytes]:
+    """Gzipped tile bytes (EMPTY_TILE where the layer has nothing); None if that version was never built."""
+    root = _layer_path(name, version)
+    if not os.path.isdir(root):
+        return None
+    try:
+        with open(os.path.join(root, str(z), str(x), f"{y}.json.gz"), "rb") as fh:
+            return fh.read()
+    except OSError:
+        return EMPTY_TILE
+
+def read_properties(name: str, version: str) -> Optional[bytes]:
+    """Gzipped JSON list of every feature's properties, indexed by feature id; None if that version was never built."""
+    try:
+        with open(os.path.join(_layer_path(name, version), _PROPERTIES), "rb") as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    for layer in layer_sources():
+        m = layer_meta(layer)
+        print(f"{layer}: {m['features']} features -> {m['tiles']} tiles (version {m['version']})")
@@ -0,0 +1,147 @@
+# mapped_io.py
+"""
+Byte readers over memory-mapped uploads, for the plans and facilities parsers.
+
+An upload is mapped once (Werkzeug already spooled it to a temp file, so no
+extra copy is made) and handed to the parser as raw bytes: expat and
+ElementTree decode UTF-8 themselves, so the str round trip of
+TextIOWrapper / gzip.open(..., "rt") goes away. Gzip input is inflated
+GZIP_BLOCK compressed bytes at a time instead of gzip's 8 KB reads.
+"""
+import io
+import mmap
+import os
+import time
+import zlib
+from typing import Optional, Union
+
+from metrics import STAGE_SECONDS
+
+GZIP_BLOCK = 256 << 10         # compressed bytes per inflate call (~2 MB of XML)
+GZIP_MAX_OUT = 64 << 20         # cap per inflate call, so a bomb can't balloon one block
+_GZIP_MAGIC = b"\x1f\x8b"
+
+class MappedReader(io.RawIOBase):
+    """read()/tell() over an mmap (or any bytes-like buffer)."""
+
+    def __init__(self, buf, owner: Optional[mmap.mmap] = None):
+        self._buf = buf
+        self._mm = owner
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._buf) if size is None or size < 0 else min(len(self._buf), self._pos + size)
+        data = self._buf[self._pos:end]
+        self._pos = end
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        super().close()
+
+class GzipBlockReader(MappedReader):
+    """
+    Decompressing reader over a mapped .gz (multi-member files included).
+    Reads may come back short: each returns at most what one inflate call produced,
+    handed over without another copy when it fits. tell() is the position in the
+    compressed input, which is what progress reporting wants.
+    """
+
+    def __init__(self, buf, owner: Optional[mmap.mmap] = None):
+        super().__init__(buf, owner)
+        self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._out = b""
+        self._out_pos = 0
+        self._eof = False
+        self.inflate_sec = 0.0  # recorded as stage "inflate" on close
+
+    def _inflate(self) -> bytes:
+        z = self._z
+        if z.eof:
+            rest = z.unused_data
+            # the next member's magic may straddle a block boundary: read on until it is whole
+            while len(rest) < len(_GZIP_MAGIC) and self._pos < len(self._buf):
+                more = self._buf[self._pos:self._pos + GZIP_BLOCK]
+                self._pos += len(more)
+                rest += more
+            if not rest.startswith(_GZIP_MAGIC):
+                self._eof = True  # end of input, or trailing padding after the last member
+                return b""
+            z = self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = rest
+        elif z.unconsumed_tail:
+            data = z.unconsumed_tail
+        else:
+            data = self._buf[self._pos:self._pos + GZIP_BLOCK]
+            self._pos += len(data)
+            if not data:
+                self._eof = True
+                if not z.eof:
+                    raise EOFError("compressed file ended before the end-of-stream marker was reached")
+                return b""
+        t0 = time.perf_counter()
+        out = z.decompress(data, GZIP_MAX_OUT)
+        self.inflate_sec += time.perf_counter() - t0
+        return out
+
+    def close(self) -> None:
+        if not self.closed:
+            STAGE_SECONDS.observe(self.inflate_sec, stage="inflate")
+        super().close()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(GZIP_MAX_OUT), b""))
+        while self._out_pos >= len(self._out):
+            if self._eof:
+                return b""
+            self._out = self._inflate()
+            self._out_pos = 0
+        out = self._out
+        if self._out_pos == 0 and len(out) <= size:
+            self._out_pos = len(out)
+            return out
+        data = out[self._out_pos:self._out_pos + size]
+        self._out_pos += len(data)
+        return data
+
+def _map(source) -> Union[mmap.mmap, bytes]:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            return _map(fh)
+    stream = getattr(source, "stream", source)  # Werkzeug FileStorage
+    try:
+        fd = stream.fileno()  # a SpooledTemporaryFile rolls over to disk here
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        stream.seek(0)  # in-memory stream (small upload, tests): nothing to map
+        return stream.read()
+    if hasattr(stream, "flush"):
+        stream.flush()
+    if os.fstat(fd).st_size == 0:
+        return b""
+    # the mapping dups the descriptor, so it outlives the upload (which Flask closes)
+    return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+def open_mapped(source) -> MappedReader:
+    """
+    Binary reader over a path, a Werkzeug FileStorage or a binary stream; gzip is
+    detected by its magic bytes. Close it to release the mapping.
+    """
+    with STAGE_SECONDS.time(stage="open"):
+        buf = _map(source)
+    owner = buf if isinstance(buf, mmap.mmap) else None
+    cls = GzipBlockReader if buf[:2] == _GZIP_MAGIC else MappedReader
+    return cls(buf, owner)
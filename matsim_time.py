@@ -0,0 +1,47 @@
+# matsim_time.py
+"""
+MATSim clock strings <-> integer seconds, shared by the plan parser and the story API.
+
+Internally everything works in integer seconds; strings are produced only when a
+payload is written out. Both directions are memoized with bounded LRU caches,
+since a population repeats the same few thousand clock values millions of times.
+"""
+import os
+from functools import lru_cache
+from typing import Any, Optional
+
+TIME_CACHE_SIZE = int(os.getenv("MATSIM_TIME_CACHE_SIZE", str(1 << 17)))  # > 30h of distinct seconds
+
+@lru_cache(maxsize=TIME_CACHE_SIZE)
+def _parse(s: str) -> Optional[int]:
+    try:
+        parts = s.split(":")
+        if not (1 <= len(parts) <= 3):
+            return None
+        h = int(parts[0])
+        m = int(parts[1]) if len(parts) >= 2 else 0
+        sec = int(parts[2]) if len(parts) == 3 else 0
+        if not (0 <= m < 60 and 0 <= sec < 60 and h >= 0):
+            return None
+        return h * 3600 + m * 60 + sec
+    except Exception:
+        return None
+
+def parse_time_to_seconds(time_str: Any) -> Optional[int]:
+    """Accepts H:MM[:SS] where H may be >= 24 (MATSim allows >24h). -> seconds or None."""
+    if not isinstance(time_str, str) or not time_str:
+        return None
+    return _parse(time_str)
+
+@lru_cache(maxsize=TIME_CACHE_SIZE)
+def _format(sec: int) -> str:
+    h = sec // 3600
+    m = (sec % 3600) // 60
+    s = sec % 60
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+def sec_to_time(sec: Optional[float]) -> Optional[str]:
+    """Seconds -> "HH:MM:SS" (hours keep counting past 24); None stays None."""
+    if sec is None:
+        return None
+    return _format(max(0, int(round(sec))))
@@ -0,0 +1,162 @@
+# metrics.py
+"""
+In-process counters and histograms, rendered in the Prometheus text format (GET /metrics).
+
+Kept dependency- and Flask-free so the parser and caches can record into it
+from anywhere. Each metric is a module-level object; labels are keyword
+arguments, and every (label values) tuple gets its own series:
+
+    STAGE_SECONDS.observe(0.25, stage="parse")
+    with STAGE_SECONDS.time(stage="jsonify"):
+        ...
+    CACHE_LOOKUPS.inc(cache="story", result="hit")
+
+Values live in the process that recorded them: parse work done in worker
+processes (plans_parallel, the ASGI ingest pool) is not counted there, the
+serving process records the pool round trip as stage "ingest_pool" instead.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# seconds: sub-millisecond cache hits up to multi-minute ingests
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_REGISTRY: List["_Metric"] = []
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.doc}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self._samples())
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(v)}"
+
+class Histogram(_Metric):
+    """Bucketed observations (cumulative on output) plus their count and sum, per label set."""
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = TIME_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., +Inf count, sum
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)  # first bucket with value <= le; len(): +Inf
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall time of the with-block (also when it raises)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return int(sum(series[:-1])) if series else 0
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-1])}"
+
+def render_prometheus() -> str:
+    """Every registered metric, in the Prometheus text exposition format (version 0.0.4)."""
+    return "".join(m.render() for m in _REGISTRY)
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---- the metrics the app records ----
+
+STAGE_SECONDS = Histogram(
+    "dtsbui_stage_seconds",
+    "Time per processing stage: open (map upload), inflate (gunzip), parse (XML to persons, "
+    "includes inflate and finalize), finalize (times/durations/serverScore), ingest_pool, "
+    "jsonify, msgpack, ndjson.",
+    ("stage",),
+)
+HTTP_REQUESTS = Counter("dtsbui_http_requests_total", "HTTP requests by route, method and status.",
+                        ("route", "method", "status"))
+HTTP_SECONDS = Histogram("dtsbui_http_request_seconds", "Time to build a response, by route.", ("route",))
+PERSONS_PARSED = Counter("dtsbui_persons_parsed_total", "Persons emitted by the plans parser.")
+CACHE_LOOKUPS = Counter("dtsbui_cache_lookups_total",
+                        "Cache lookups by cache (story, plan_store, facilities, network, aggregate) and result.",
+                        ("cache", "result"))
+LLM_SECONDS = Histogram("dtsbui_llm_request_seconds", "LLM completion latency by outcome (ok, bad_json, error).",
+                        ("outcome",))
+LLM_TOKENS = Histogram("dtsbui_llm_tokens", "Tokens per LLM completion from resp.usage, by kind.",
+                       ("kind",), buckets=TOKEN_BUCKETS)
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,254 @@
+# network_store.py
+"""
+Cached, memory-mapped MATSim network tables and the transit routes drawn from them.
+
+A network file is stream-parsed once per content hash into
+STORE_DIR/network/<hash>/: node coordinates, and per link its from/to node
+rows, length, mode set and id. Routes for a mode (the links allowing it,
+e.g. "bus") are chained into polylines, simplified to NETWORK_SIMPLIFY_M
+meters and cached next to the table as gzipped GeoJSON, so the browser gets
+a few hundred lines instead of the raw network XML.
+"""
+import array
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from hashlib import sha256
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from layer_tiles import simplify_line
+from plan_store import STORE_DIR, map_column
+
+NETWORK_DIR = os.path.join(STORE_DIR, "network")
+NETWORK_SIMPLIFY_M = float(os.getenv("NETWORK_SIMPLIFY_M", "5"))  # route geometry tolerance (CRS units)
+TABLE_VERSION = 1
+
+# column name -> array typecode
+_COLUMNS: Dict[str, str] = {
+    "node_x": "d",
+    "node_y": "d",
+    "link_from": "i",     # node row, -1 when the node is missing
+    "link_to": "i",
+    "link_length": "d",
+    "link_modes": "i",    # index into meta["modeSets"]
+    "link_id_end": "q",   # end offsets into link_ids.bin
+}
+_LINK_IDS = "link_ids.bin"
+_META = "meta.json"
+
+def iter_network(f) -> Iterator[Tuple]:
+    """("node", id, x, y) and ("link", id, from, to, length, modes) rows of a network XML stream."""
+    root = None
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            a = elem.attrib
+            if elem.tag == "node":
+                try:
+                    yield "node", a.get("id"), float(a.get("x")), float(a.get("y"))
+                except (TypeError, ValueError):
+                    pass
+            elif elem.tag == "link":
+                try:
+                    length = float(a.get("length") or "nan")
+                except ValueError:
+                    length = float("nan")
+                yield "link", a.get("id") or "", a.get("from"), a.get("to"), length, a.get("modes") or ""
+        elif elem.tag in ("node", "link"):
+            elem.clear()
+            root.clear()
+
+class NetworkTable:
+    """Read-only view over a committed network table."""
+
+    def __init__(self, path: str, meta: Dict[str, Any]):
+        self.path = path
+        self.meta = meta
+        self.mode_sets: List[str] = meta.get("modeSets") or []
+        self._maps = []
+        self.cols: Dict[str, memoryview] = {}
+        for name, code in list(_COLUMNS.items()) + [(_LINK_IDS, "B")]:
+            mm, view = map_column(os.path.join(path, name), code)
+            if mm is not None:
+                self._maps.append(mm)
+            self.cols[name] = view
+
+    def __reduce__(self):
+        return (_open_table_at, (self.path,))
+
+    @property
+    def n_links(self) -> int:
+        return len(self.cols["link_from"])
+
+    def link_id(self, i: int) -> str:
+        ends = self.cols["link_id_end"]
+        return bytes(self.cols[_LINK_IDS][ends[i - 1] if i > 0 else 0:ends[i]]).decode("utf-8")
+
+    def routes(self, mode: str, tolerance: float = NETWORK_SIMPLIFY_M) -> Dict[str, Any]:
+        """
+        Links allowing `mode` as a GeoJSON FeatureCollection (in the network's CRS).
+        Both directions of a road count once; links are chained through nodes where the
+        line neither branches nor ends, so one feature is one unbranched stretch.
+        """
+        c = self.cols
+        codes = {i for i, ms in enumerate(self.mode_sets) if mode in ms.split(",")}
+        frm, to, modes = c["link_from"], c["link_to"], c["link_modes"]
+        # undirected edge (a, b), a < b -> links on it
+        edges: Dict[Tuple[int, int], List[int]] = {}
+        for i in range(self.n_links):
+            if modes[i] in codes and frm[i] >= 0 and to[i] >= 0 and frm[i] != to[i]:
+                a, b = frm[i], to[i]
+                edges.setdefault((a, b) if a < b else (b, a), []).append(i)
+        adj: Dict[int, List[Tuple[int, int]]] = {}
+        for e in edges:
+            adj.setdefault(e[0], []).append(e)
+            adj.setdefault(e[1], []).append(e)
+
+        seen = set()
+        chains: List[Tuple[List[int], List[Tuple[int, int]]]] = []
+
+        def walk(node: int, e: Tuple[int, int]) -> None:
+            nodes, path = [node], []
+            while e not in seen:
+                seen.add(e)
+                path.append(e)
+                node = e[1] if e[0] == node else e[0]
+                nodes.append(node)
+                nxt = adj[node]
+                if len(nxt) != 2:
+                    break
+                e = nxt[0] if nxt[1] == e else nxt[1]
+            chains.append((nodes, path))
+
+        for node, incident in adj.items():
+            if len(incident) != 2:
+                for e in incident:
+                    if e not in seen:
+                        walk(node, e)
+        for e in edges:  # closed loops: every node has degree 2
+            if e not in seen:
+                walk(e[0], e)
+
+        xs, ys, length = c["node_x"], c["node_y"], c["link_length"]
+        features = []
+        for nodes, path in chains:
+            links = [i for e in path for i in edges[e]]
+            meters = [length[edges[e][0]] for e in path]  # one direction per road
+            coords = simplify_line([[xs[n], ys[n]] for n in nodes], tolerance, 2)
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": [[round(x, 2), round(y, 2)] for x, y in coords]},
+                "properties": {
+                    "mode": mode,
+                    "linkIds": [self.link_id(i) for i in links],
+                    "length": round(sum(m for m in meters if m == m), 1),
+                },
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+    def routes_version(self, mode: str, tolerance: float = NETWORK_SIMPLIFY_M) -> str:
+        """Hash naming one cached routes() result of this table."""
+        return sha256(f"{self.meta.get('key')}\0{mode}\0{tolerance}".encode("utf-8")).hexdigest()[:24]
+
+    def routes_gzip(self, mode: str, tolerance: float = NETWORK_SIMPLIFY_M) -> bytes:
+        """routes() as gzipped JSON, cached in the table directory per mode and tolerance."""
+        path = os.path.join(self.path, f"routes-{self.routes_version(mode, tolerance)}.json.gz")
+        try:
+            with open(path, "rb") as fh:
+                return fh.read()
+        except OSError:
+            pass
+        body = gzip.compress(json.dumps(self.routes(mode, tolerance), ensure_ascii=False,
+                                        separators=(",", ":")).encode("utf-8"), 6, mtime=0)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=self.path)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(body)
+        os.replace(tmp, path)
+        return body
+
+    def close(self) -> None:
+        for view in self.cols.values():
+            view.release()
+        self.cols = {}
+        for mm in self._maps:
+            try:
+                mm.close()
+            except BufferError:
+                pass
+        self._maps = []
+
+def _open_table_at(path: str) -> Optional[NetworkTable]:
+    try:
+        with open(os.path.join(path, _META), encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != TABLE_VERSION:
+        return None
+    return NetworkTable(path, meta)
+
+def open_table(key: str) -> Optional[NetworkTable]:
+    """The cached table for a network content hash, or None."""
+    return _open_table_at(os.path.join(NETWORK_DIR, key))
+
+def build_table(key: str, rows: Iterator[Tuple]) -> NetworkTable:
+    """Commit iter_network() rows as a table; links may reference nodes defined later."""
+    cols = {name: array.array(code) for name, code in _COLUMNS.items()}
+    node_row: Dict[str, int] = {}
+    mode_sets: Dict[str, int] = {}
+    pending: List[Tuple[str, str]] = []  # (from, to) node ids, resolved once all nodes are known
+
+    os.makedirs(NETWORK_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=NETWORK_DIR)
+    try:
+        end = 0
+        with open(os.path.join(tmp, _LINK_IDS), "wb") as ids:
+            for row in rows:
+                if row[0] == "node":
+                    _, nid, x, y = row
+                    node_row[nid] = len(cols["node_x"])
+                    cols["node_x"].append(x)
+                    cols["node_y"].append(y)
+                    continue
+                _, lid, a, b, length, modes = row
+                key_modes = ",".join(sorted(m.strip() for m in modes.split(",") if m.strip()))
+                code = mode_sets.setdefault(key_modes, len(mode_sets))
+                pending.append((a, b))
+                cols["link_length"].append(length)
+                cols["link_modes"].append(code)
+                raw = lid.encode("utf-8")
+                ids.write(raw)
+                end += len(raw)
+                cols["link_id_end"].append(end)
+        for a, b in pending:
+            cols["link_from"].append(node_row.get(a, -1))
+            cols["link_to"].append(node_row.get(b, -1))
+        del pending, node_row
+        for name, data in cols.items():
+            with open(os.path.join(tmp, name), "wb") as fh:
+                data.tofile(fh)
+        meta = {
+            "version": TABLE_VERSION,
+            "key": key,
+            "nodes": len(cols["node_x"]),
+            "links": len(cols["link_from"]),
+            "modeSets": sorted(mode_sets, key=mode_sets.__getitem__),
+        }
+        with open(os.path.join(tmp, _META), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False)
+        try:
+            os.rename(tmp, os.path.join(NETWORK_DIR, key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # built concurrently elsewhere
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    table = open_table(key)
+    if table is None:
+        raise RuntimeError(f"network table {key} missing after build")
+    return table
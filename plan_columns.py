@@ -0,0 +1,155 @@
+# plan_columns.py
+"""
+Column-oriented MessagePack encoding of plan payloads (Accept: application/x-msgpack).
+
+The JSON payload repeats every key per step and spells times as strings.
+Here a page of persons is one msgpack map whose columns are raw
+little-endian typed arrays (msgpack bin), so the browser can view them as
+Int32Array / Float32Array without parsing anything per step:
+
+    labels                   activity types and modes; steps.label indexes it (-1: none)
+    persons.id               [str]
+    persons.selectedPlanIndex int32
+    persons.planStart        int32, P + 1 offsets into plans
+    plans.selected           uint8
+    plans.matsimScore        float64 (NaN: none)
+    plans.serverScore        float64
+    plans.stepStart          int32, N + 1 offsets into steps
+    steps.kind               uint8 (0 activity, 1 leg)
+    steps.label              int32
+    steps.t0 / steps.t1      int32 seconds: startTime/endTime, or depTime/travelTime (MISSING: none)
+    steps.durationSec        int32 (MISSING: none)
+    steps.x / steps.y        float32 (NaN: none; legs are always NaN)
+
+With selected_only each person carries just its selected plan (planStart is
+then 0, 1, 2, ...). Columns are cut straight out of the PlanStore.
+"""
+import array
+import sys
+from typing import Any, Dict, List
+
+import msgpack
+
+from matsim_time import sec_to_time
+from plan_store import KIND_ACTIVITY, MISSING, PlanStore
+
+MSGPACK_MIMETYPE = "application/x-msgpack"
+FORMAT = "dtsbui-columns/1"
+
+def _bin(a: array.array) -> bytes:
+    if sys.byteorder != "little":
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def _gather(col: memoryview, ranges: List[range], code: str) -> array.array:
+    out = array.array(code)
+    for r in ranges:
+        out.frombytes(col[r.start:r.stop].tobytes())
+    return out
+
+def encode_msgpack(store: PlanStore, start: int = 0, limit: int = 200, selected_only: bool = True) -> bytes:
+    """Persons [start, start + limit) of a store in the column layout above."""
+    c = store.cols
+    stop = min(len(store), start + max(0, limit))
+    rows = range(max(0, start), stop)
+    plan_start = c["person_plan_start"]
+    selected = c["person_selected"]
+    if selected_only:
+        plan_ranges = [range(plan_start[r] + selected[r], plan_start[r] + selected[r] + 1) for r in rows]
+        person_plans = array.array("i", range(len(rows) + 1))
+    else:
+        plan_ranges = [range(plan_start[rows.start], plan_start[rows.stop])] if rows else []
+        base = plan_start[rows.start] if rows else 0
+        person_plans = array.array("i", (plan_start[r] - base for r in range(rows.start, rows.stop + 1)))
+
+    step_start = c["plan_step_start"]
+    step_ranges: List[range] = []
+    plan_steps = array.array("i", [0])
+    for pr in plan_ranges:
+        for p in pr:
+            a, b = step_start[p], step_start[p + 1]
+            if step_ranges and step_ranges[-1].stop == a:
+                step_ranges[-1] = range(step_ranges[-1].start, b)  # keep runs contiguous
+            else:
+                step_ranges.append(range(a, b))
+            plan_steps.append(plan_steps[-1] + b - a)
+
+    payload = {
+        "format": FORMAT,
+        "labels": store.labels,
+        "persons": {
+            "id": [store.person_id(r) for r in rows],
+            "selectedPlanIndex": _bin(array.array("i", (selected[r] for r in rows))),
+            "planStart": _bin(person_plans),
+        },
+        "plans": {
+            "selected": _bin(_gather(c["plan_selected"], plan_ranges, "b")),
+            "matsimScore": _bin(_gather(c["plan_matsim_score"], plan_ranges, "d")),
+            "serverScore": _bin(_gather(c["plan_server_score"], plan_ranges, "d")),
+            "stepStart": _bin(plan_steps),
+        },
+        "steps": {
+            "kind": _bin(_gather(c["step_kind"], step_ranges, "b")),
+            "label": _bin(_gather(c["step_label"], step_ranges, "i")),
+            "t0": _bin(_gather(c["step_t0"], step_ranges, "i")),
+            "t1": _bin(_gather(c["step_t1"], step_ranges, "i")),
+            "durationSec": _bin(_gather(c["step_dur"], step_ranges, "i")),
+            "x": _bin(array.array("f", _gather(c["step_x"], step_ranges, "d"))),
+            "y": _bin(array.array("f", _gather(c["step_y"], step_ranges, "d"))),
+        },
+    }
+    return msgpack.packb(payload, use_bin_type=True)
+
+def _col(raw: bytes, code: str) -> array.array:
+    a = array.array(code)
+    a.frombytes(raw)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def decode_msgpack(data: bytes) -> List[Dict[str, Any]]:
+    """
+    Back to the /upload JSON shape (times as H:MM:SS strings again). Reference for
+    clients and the benchmark; the browser reads the columns directly.
+    """
+    doc = msgpack.unpackb(data, raw=False)
+    labels = doc["labels"]
+    pc, lc, sc = doc["persons"], doc["plans"], doc["steps"]
+    sel, p_start = _col(pc["selectedPlanIndex"], "i"), _col(pc["planStart"], "i")
+    chosen, m_score, s_score = _col(lc["selected"], "b"), _col(lc["matsimScore"], "d"), _col(lc["serverScore"], "d")
+    s_start = _col(lc["stepStart"], "i")
+    kind, label = _col(sc["kind"], "b"), _col(sc["label"], "i")
+    t0, t1, dur = _col(sc["t0"], "i"), _col(sc["t1"], "i"), _col(sc["durationSec"], "i")
+    xs, ys = _col(sc["x"], "f"), _col(sc["y"], "f")
+
+    def t(v: int):
+        return None if v == MISSING else sec_to_time(v)
+
+    def steps(p: int) -> List[Dict[str, Any]]:
+        out = []
+        for k in range(s_start[p], s_start[p + 1]):
+            name = labels[label[k]] if label[k] >= 0 else None
+            d = None if dur[k] == MISSING else dur[k]
+            if kind[k] == KIND_ACTIVITY:
+                out.append({"kind": "activity", "type": name, "startTime": t(t0[k]), "endTime": t(t1[k]),
+                            "x": None if xs[k] != xs[k] else xs[k], "y": None if ys[k] != ys[k] else ys[k],
+                            "durationSec": d})
+            else:
+                out.append({"kind": "leg", "mode": name, "depTime": t(t0[k]), "travelTime": t(t1[k]),
+                            "durationSec": d})
+        return out
+
+    persons = []
+    for i, pid in enumerate(pc["id"]):
+        persons.append({
+            "personId": pid,
+            "plans": [{
+                "selected": bool(chosen[p]),
+                "matsimScore": None if m_score[p] != m_score[p] else m_score[p],
+                "serverScore": s_score[p],
+                "steps": steps(p),
+            } for p in range(p_start[i], p_start[i + 1])],
+            "selectedPlanIndex": sel[i],
+        })
+    return persons
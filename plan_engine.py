@@ -0,0 +1,107 @@
+# plan_engine.py
+"""
+Batched plan finalization.
+
+Instead of walking each plan's steps at </plan>, many plans are laid out as
+flat NumPy arrays (kind, weight code, start/end/travel seconds, plan index) and
+end-time backfill, durationSec and serverScore are computed for the whole batch
+at once. Results match plans.finalize_plan exactly.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from plans import DEFAULT_WEIGHTS
+
+_NONE = np.iinfo(np.int64).min  # "no time" marker inside int64 arrays
+
+def _weight_table(weights, labels: Dict[Tuple[int, Optional[str]], int]) -> np.ndarray:
+    table = np.zeros(len(labels), dtype=np.float64)
+    for (kind, label), code in labels.items():
+        group = weights["act"] if kind == 0 else weights["leg"]
+        table[code] = group.get(label, group["__other__"])
+    return table
+
+def finalize_batch(batch: List[Tuple[Dict[str, Any], Optional[int]]], weights=DEFAULT_WEIGHTS) -> None:
+    """
+    Finalize (plan_obj, last_leg_arrival) pairs in place: fills activity
+    endTime where missing, durationSec on every step and plan_obj["serverScore"].
+    Times are integer seconds, as produced by the plans builder.
+    """
+    if not batch:
+        return
+
+    steps_flat: List[Dict[str, Any]] = []
+    plan_of: List[int] = []
+    code: List[int] = []
+    anchor: List[int] = []   # activity startTime / leg depTime: what a backfill copies
+    end: List[int] = []      # activity endTime / leg travelTime
+    labels: Dict[Tuple[int, Optional[str]], int] = {}
+    lla = np.full(len(batch), _NONE, dtype=np.int64)
+
+    for p, (plan_obj, last_leg_arrival) in enumerate(batch):
+        if last_leg_arrival is not None:
+            lla[p] = last_leg_arrival
+        steps = plan_obj["steps"]
+        steps_flat.extend(steps)
+        plan_of.extend([p] * len(steps))
+        for s in steps:
+            if s["kind"] == "activity":
+                key = (0, s["type"])
+                a = s["startTime"]
+                e = s["endTime"]
+            else:
+                key = (1, s["mode"])
+                a = s["depTime"]
+                e = s["travelTime"]
+            anchor.append(_NONE if a is None else a)
+            end.append(_NONE if e is None else e)
+            c = labels.get(key)
+            if c is None:
+                c = labels[key] = len(labels)
+            code.append(c)
+
+    n = len(steps_flat)
+    plan_of_a = np.asarray(plan_of, dtype=np.int64)
+    code_a = np.asarray(code, dtype=np.int64)
+    anchor_a = np.asarray(anchor, dtype=np.int64)
+    end_a = np.asarray(end, dtype=np.int64)
+    is_act = np.zeros(len(labels), dtype=bool)
+    for (kind, _), c in labels.items():
+        is_act[c] = kind == 0
+    is_act = is_act[code_a]
+
+    # ---- backfill: first later step of the same plan with a known anchor, else last leg arrival ----
+    idx = np.where(anchor_a != _NONE, np.arange(n, dtype=np.int64), n)
+    nearest = np.minimum.accumulate(idx[::-1])[::-1]          # nearest anchor at or after i
+    after = np.empty(n, dtype=np.int64)
+    after[:-1] = nearest[1:]
+    after[-1:] = n                                             # nearest anchor strictly after i
+    in_plan = after < n
+    in_plan[in_plan] = plan_of_a[after[in_plan]] == plan_of_a[in_plan]
+
+    needs_end = is_act & (end_a == _NONE)
+    from_next = needs_end & in_plan
+    end_a[from_next] = anchor_a[after[from_next]]
+    from_lla = needs_end & ~in_plan
+    end_a[from_lla] = lla[plan_of_a[from_lla]]
+
+    # ---- durations: activity end - start, leg travel time ----
+    act_ok = is_act & (anchor_a != _NONE) & (end_a != _NONE)
+    leg_ok = ~is_act & (end_a != _NONE)
+    dur = np.where(act_ok, end_a - anchor_a, np.where(leg_ok, end_a, 0))
+    has_dur = act_ok | leg_ok
+
+    # ---- scores: one weighted bincount over the whole batch ----
+    w = _weight_table(weights, labels)[code_a]
+    scores = np.bincount(plan_of_a, weights=dur * w, minlength=len(batch))
+
+    # ---- write back ----
+    end_l = end_a.tolist()
+    for i in np.flatnonzero(needs_end).tolist():
+        e = end_l[i]
+        steps_flat[i]["endTime"] = None if e == _NONE else e
+    for s, d, ok in zip(steps_flat, dur.tolist(), has_dur.tolist()):
+        s["durationSec"] = d if ok else None
+    for (plan_obj, _), score in zip(batch, scores.tolist()):
+        plan_obj["serverScore"] = score
@@ -0,0 +1,184 @@
+# plan_query.py
+"""
+Filtered, cursor-paginated reads over a PlanStore.
+
+A page starts at a person row (the cursor) and walks candidate rows in file
+order. Candidates come from the narrowest index that applies: the mode /
+activity inverted indexes, the serverScore order, or plain row order. Each
+candidate is then checked against the full filter on its plans. The walk
+stops after `limit` matches or QUERY_SCAN_LIMIT candidates, so every page has
+bounded cost wherever it sits in the file. A short page with a nextCursor just
+means "keep going".
+"""
+import bisect
+import heapq
+import math
+import os
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from plan_store import KIND_ACTIVITY, KIND_LEG, MISSING, PlanStore
+
+QUERY_SCAN_LIMIT = int(os.getenv("QUERY_SCAN_LIMIT", "200000"))  # candidates checked per page
+SCORE_SORT_MAX = 1 / 8  # above this share of persons, a score range is checked row by row
+_BITMAP_WINDOW = 1 << 16  # rows of the score bitmap scanned at a time, so a page stops early
+
+class PersonFilter:
+    """
+    modes / activities: match persons with a leg of any listed mode and an activity of
+    any listed type. min_score / max_score bound serverScore. t_from / t_to (seconds)
+    require a step overlapping that window; when modes/activities are given, it must
+    be one of those steps. Everything has to hold within one plan: the selected plan,
+    or any plan with selected_only=False.
+    """
+
+    def __init__(self, modes: Sequence[str] = (), activities: Sequence[str] = (),
+                 min_score: Optional[float] = None, max_score: Optional[float] = None,
+                 t_from: Optional[int] = None, t_to: Optional[int] = None,
+                 selected_only: bool = True):
+        self.modes = list(modes)
+        self.activities = list(activities)
+        self.min_score = min_score
+        self.max_score = max_score
+        self.t_from = t_from
+        self.t_to = t_to
+        self.selected_only = selected_only
+
+    @property
+    def has_window(self) -> bool:
+        return self.t_from is not None or self.t_to is not None
+
+    @property
+    def has_score(self) -> bool:
+        return self.min_score is not None or self.max_score is not None
+
+class _Matcher:
+    """A PersonFilter resolved against one store's label codes and columns."""
+
+    def __init__(self, store: PlanStore, f: PersonFilter):
+        self.store = store
+        self.f = f
+        codes = {label: code for code, label in enumerate(store.labels)}
+        self.mode_codes = {codes[m] for m in f.modes if m in codes}
+        self.act_codes = {codes[a] for a in f.activities if a in codes}
+        # an unknown mode/activity name can never match
+        self.impossible = (bool(f.modes) and not self.mode_codes) or (bool(f.activities) and not self.act_codes)
+        self.lo = -math.inf if f.min_score is None else f.min_score
+        self.hi = math.inf if f.max_score is None else f.max_score
+        self.w0 = -math.inf if f.t_from is None else f.t_from
+        self.w1 = math.inf if f.t_to is None else f.t_to
+
+    def _postings(self, kind: int, codes: Iterable[int]) -> List[Sequence[int]]:
+        return [self.store.postings(kind, c, self.f.selected_only) for c in codes]
+
+    def candidates(self, cursor: int) -> Iterator[int]:
+        """Ascending rows >= cursor that might match (a superset of the matches)."""
+        n = len(self.store)
+        lists = []
+        if self.mode_codes:
+            lists.append(self._postings(KIND_LEG, self.mode_codes))
+        if self.act_codes:
+            lists.append(self._postings(KIND_ACTIVITY, self.act_codes))
+        if lists:
+            # drive with the smaller union; the rest is checked per candidate
+            driver = min(lists, key=lambda ls: sum(len(p) for p in ls))
+            iters = [iter(p[bisect.bisect_left(p, cursor):]) for p in driver]
+            last = -1
+            for row in heapq.merge(*iters):
+                if row != last:
+                    yield row
+                    last = row
+            return
+        if self.f.has_score and self.f.selected_only:
+            rows = self._score_rows(n, cursor)
+            if rows is not None:
+                yield from rows
+                return
+        yield from range(cursor, n)
+
+    def _score_rows(self, n: int, cursor: int) -> Optional[Iterator[int]]:
+        """
+        Ascending rows >= cursor whose selected serverScore is in range; None if too many to be
+        worth it. The idx_score_order slice is marked in a row bitmap that is then walked in row
+        order, so nothing is sorted per request.
+        """
+        order = self.store.cols["idx_score_order"]
+        score = self.store.cols["plan_server_score"]
+        plan_start = self.store.cols["person_plan_start"]
+        selected = self.store.cols["person_selected"]
+
+        def key(j: int) -> float:
+            r = order[j]
+            return score[plan_start[r] + selected[r]]
+
+        a = bisect.bisect_left(range(n), self.lo, key=key)
+        b = bisect.bisect_right(range(n), self.hi, key=key)
+        if b - a > n * SCORE_SORT_MAX:
+            return None
+        import numpy as np  # deferred, like rescore: not on the server's import path
+
+        marked = np.zeros(n, dtype=bool)
+        marked[np.frombuffer(order[a:b], dtype=np.int32)] = True
+
+        def walk() -> Iterator[int]:
+            for start in range(cursor, n, _BITMAP_WINDOW):
+                for r in np.flatnonzero(marked[start:start + _BITMAP_WINDOW]).tolist():
+                    yield start + r
+        return walk()
+
+    def _plans(self, row: int) -> Iterable[int]:
+        c = self.store.cols
+        first = c["person_plan_start"][row]
+        if self.f.selected_only:
+            return (first + c["person_selected"][row],)
+        return range(first, c["person_plan_start"][row + 1])
+
+    def _plan_matches(self, p: int) -> bool:
+        c = self.store.cols
+        if not (self.lo <= c["plan_server_score"][p] <= self.hi):
+            return False
+        modes, acts = self.mode_codes, self.act_codes
+        need_mode, need_act = bool(modes), bool(acts)
+        window = self.f.has_window
+        if not (need_mode or need_act or window):
+            return True
+        kind_col, label_col, t0_col, t1_col = c["step_kind"], c["step_label"], c["step_t0"], c["step_t1"]
+        in_window = not window
+        for k in range(c["plan_step_start"][p], c["plan_step_start"][p + 1]):
+            label = label_col[k]
+            if kind_col[k] == KIND_LEG:
+                hit = label in modes
+                need_mode = need_mode and not hit
+            else:
+                hit = label in acts
+                need_act = need_act and not hit
+            if not in_window and (hit or not (modes or acts)):
+                t0, t1 = t0_col[k], t1_col[k]
+                start = 0 if t0 == MISSING else t0
+                if kind_col[k] == KIND_LEG:
+                    end = start + (0 if t1 == MISSING else t1)  # legs store travel time
+                else:
+                    end = math.inf if t1 == MISSING else t1
+                in_window = start <= self.w1 and end >= self.w0
+            if in_window and not need_mode and not need_act:
+                return True
+        return False
+
+    def matches(self, row: int) -> bool:
+        return any(self._plan_matches(p) for p in self._plans(row))
+
+def query_rows(store: PlanStore, f: PersonFilter, cursor: int = 0, limit: int = 100,
+               scan_limit: Optional[int] = None) -> Tuple[List[int], Optional[int]]:
+    """(matching rows, next cursor or None when the store is exhausted)."""
+    scan_limit = scan_limit or QUERY_SCAN_LIMIT
+    m = _Matcher(store, f)
+    if m.impossible or limit <= 0:
+        return [], None
+    rows: List[int] = []
+    scanned = 0
+    for row in m.candidates(max(0, cursor)):
+        if len(rows) >= limit or scanned >= scan_limit:
+            return rows, row
+        scanned += 1
+        if m.matches(row):
+            rows.append(row)
+    return rows, None
@@ -0,0 +1,109 @@
+# plan_spatial.py
+"""
+Bounding-box reads over the activity grid of a PlanStore (see plan_store).
+
+The grid is built at ingest over every selected-plan activity that has
+coordinates, in the run's projected CRS (the x/y of the plans / facilities
+files, not lon/lat). A request names a bbox in that CRS and the map zoom:
+
+* when at most `max_points` activities can be in view, they come back as points;
+* otherwise they are clustered on a grid sized for the zoom (about CLUSTER_PX
+  screen pixels per cluster), built from per-cell counts and coordinate sums,
+  so the cost depends on the number of grid cells in view, not on the points.
+"""
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+from plan_store import PlanStore
+
+ACTIVITY_MAX_POINTS = int(os.getenv("ACTIVITY_MAX_POINTS", "5000"))  # above this, clusters
+CLUSTER_PX = int(os.getenv("ACTIVITY_CLUSTER_PX", "60"))  # cluster spacing on screen
+GEO_LATITUDE = float(os.getenv("GEO_LATITUDE", "36"))  # study area, for Web Mercator scale
+_M_PER_PX_Z0 = 2 * math.pi * 6378137 / 256  # Web Mercator meters per pixel at zoom 0, equator
+
+Bbox = Tuple[float, float, float, float]
+
+def cluster_size(zoom: float) -> float:
+    """Ground size (meters) of CLUSTER_PX screen pixels at this Leaflet / Web Mercator zoom."""
+    return CLUSTER_PX * _M_PER_PX_Z0 * math.cos(math.radians(GEO_LATITUDE)) / (2 ** zoom)
+
+def _cell_range(grid: Dict[str, Any], bbox: Bbox) -> Tuple[int, int, int, int]:
+    """Grid cells [ix0, ix1] x [iy0, iy1] overlapping bbox (empty ranges when outside)."""
+    x0, y0, cell = grid["x0"], grid["y0"], grid["cell"]
+
+    def clamp(v: float, n: int) -> int:
+        return min(n - 1, max(0, int(math.floor(v))))
+
+    minx, miny, maxx, maxy = bbox
+    nx, ny = grid["nx"], grid["ny"]
+    if not nx or maxx < x0 or maxy < y0 or minx > x0 + nx * cell or miny > y0 + ny * cell:
+        return 0, -1, 0, -1
+    return (clamp((minx - x0) / cell, nx), clamp((maxx - x0) / cell, nx),
+            clamp((miny - y0) / cell, ny), clamp((maxy - y0) / cell, ny))
+
+def _points(store: PlanStore, bbox: Bbox, rng: Tuple[int, int, int, int]) -> List[Dict[str, Any]]:
+    c = store.cols
+    start, xs, ys = c["idx_geo_start"], c["idx_geo_x"], c["idx_geo_y"]
+    labels, rows = c["idx_geo_label"], c["idx_geo_row"]
+    nx = store.meta["grid"]["nx"]
+    minx, miny, maxx, maxy = bbox
+    ix0, ix1, iy0, iy1 = rng
+    out = []
+    for iy in range(iy0, iy1 + 1):
+        # the cells of one grid row are contiguous in the index
+        for k in range(start[iy * nx + ix0], start[iy * nx + ix1 + 1]):
+            x, y = xs[k], ys[k]
+            if minx <= x <= maxx and miny <= y <= maxy:
+                label = labels[k]
+                out.append({
+                    "x": x,
+                    "y": y,
+                    "type": store.labels[label] if label >= 0 else None,
+                    "personId": store.person_id(rows[k]),
+                })
+    return out
+
+def _clusters(store: PlanStore, rng: Tuple[int, int, int, int], size: float) -> List[Dict[str, Any]]:
+    """Grid cells merged k x k, k chosen so a cluster is about `size` across."""
+    c = store.cols
+    start, sum_x, sum_y = c["idx_geo_start"], c["idx_geo_sum_x"], c["idx_geo_sum_y"]
+    grid = store.meta["grid"]
+    nx = grid["nx"]
+    k = max(1, int(round(size / grid["cell"])))
+    ix0, ix1, iy0, iy1 = rng
+    acc: Dict[Tuple[int, int], List[float]] = {}
+    for iy in range(iy0, iy1 + 1):
+        for ix in range(ix0, ix1 + 1):
+            cell = iy * nx + ix
+            n = start[cell + 1] - start[cell]
+            if n:
+                a = acc.get((ix // k, iy // k))
+                if a is None:
+                    acc[(ix // k, iy // k)] = [n, sum_x[cell], sum_y[cell]]
+                else:
+                    a[0] += n
+                    a[1] += sum_x[cell]
+                    a[2] += sum_y[cell]
+    return [{"x": sx / n, "y": sy / n, "count": int(n)} for n, sx, sy in acc.values()]
+
+def query_activities(store: PlanStore, bbox: Bbox, zoom: float,
+                     max_points: int = ACTIVITY_MAX_POINTS) -> Dict[str, Any]:
+    """
+    {"points": [{x, y, type, personId}]} when few activities are in view, else
+    {"clusters": [{x, y, count}], "clusterSize": meters}. Clusters cover whole grid
+    cells, so they can include activities just outside the bbox.
+    """
+    grid = store.meta.get("grid") or {}
+    rng = _cell_range(grid, bbox)
+    ix0, ix1, iy0, iy1 = rng
+    start = store.cols["idx_geo_start"]
+    nx = grid.get("nx", 0)
+    # upper bound: everything in the overlapping cells
+    in_cells = sum(start[iy * nx + ix1 + 1] - start[iy * nx + ix0] for iy in range(iy0, iy1 + 1))
+    if in_cells <= max_points:
+        points = _points(store, bbox, rng)
+        return {"points": points, "total": len(points)}
+    size = max(cluster_size(zoom), grid["cell"])
+    clusters = _clusters(store, rng, size)
+    return {"clusters": clusters, "total": sum(cl["count"] for cl in clusters), "clusterSize": size}
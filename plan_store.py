@@ -0,0 +1,572 @@
+# plan_store.py
+"""
+On-disk columnar store for parsed MATSim plans.
+
+A plans upload is parsed once (all plans, durations and serverScore already
+computed) and written as flat typed columns under STORE_DIR/<content hash>/.
+Later uploads of the same bytes are served from the memory-mapped columns
+without touching the XML again.
+
+Commit also writes the query indexes used by plan_query: persons sorted by id,
+persons sorted by selected-plan serverScore, and inverted indexes from each
+activity type / leg mode to the persons using it (in the selected plan, and in
+any plan), plus a grid index over the activity locations of selected plans
+(see plan_spatial).
+"""
+import array
+import bisect
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import tempfile
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from matsim_time import sec_to_time
+
+STORE_DIR = os.getenv("PLAN_STORE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".plan_store"
+)
+STORE_VERSION = 4  # 2: query indexes, 3: spatial index, 4: duration sums
+
+MISSING = -(2 ** 31)  # int32 sentinel for "no value"
+NAN = float("nan")
+
+KIND_ACTIVITY = 0
+KIND_LEG = 1
+
+# column name -> array typecode
+_COLUMNS: Dict[str, str] = {
+    # persons (P rows; *_start columns get one extra closing row)
+    "person_plan_start": "q",
+    "person_selected": "i",
+    "person_id_end": "q",
+    # plans
+    "plan_step_start": "q",
+    "plan_selected": "b",
+    "plan_matsim_score": "d",
+    "plan_server_score": "d",
+    # steps
+    "step_kind": "b",
+    "step_label": "i",  # activity type / leg mode, index into meta["labels"]
+    "step_t0": "i",     # activity startTime / leg depTime (seconds)
+    "step_t1": "i",     # activity endTime / leg travelTime (seconds)
+    "step_dur": "i",
+    "step_x": "d",
+    "step_y": "d",
+    # per-plan durationSec sums by activity type / leg mode (see duration_feature), one row
+    # per (plan, feature) with a non-zero sum, in plan order: serverScore = sum(sec * weight)
+    "dsum_plan": "i",
+    "dsum_feature": "i",
+    "dsum_sec": "q",
+}
+# index name -> array typecode, written by StoreWriter.commit
+_INDEXES: Dict[str, str] = {
+    "idx_person_order": "i",   # person rows sorted by personId (UTF-8 bytes)
+    "idx_score_order": "i",    # person rows sorted by selected-plan serverScore
+    # inverted indexes: rows of posting list k are *_rows[*_start[k]:*_start[k + 1]],
+    # k = kind * len(labels) + label, rows ascending
+    "idx_sel_rows": "i",
+    "idx_sel_start": "q",
+    "idx_any_rows": "i",
+    "idx_any_start": "q",
+    # spatial grid over selected-plan activities with coordinates (geometry in meta["grid"]):
+    # points of cell c = iy * nx + ix are idx_geo_*[idx_geo_start[c]:idx_geo_start[c + 1]]
+    "idx_geo_start": "q",
+    "idx_geo_x": "d",
+    "idx_geo_y": "d",
+    "idx_geo_label": "i",
+    "idx_geo_row": "i",    # person row
+    "idx_geo_sum_x": "d",  # per cell, for cluster centroids
+    "idx_geo_sum_y": "d",
+}
+# spilled activity points, in ingest order (typecodes as for idx_geo_*)
+_GEO_POINTS: Dict[str, str] = {"x": "d", "y": "d", "label": "i", "row": "i"}
+_PERSON_IDS = "person_ids.bin"
+_META = "meta.json"
+
+_FLUSH_ROWS = 1 << 16
+GEO_CELL_POINTS = 16      # target points per grid cell
+GEO_MAX_CELLS = 256 * 256  # so a whole-run cluster pass stays cheap
+
+def content_key(stream) -> str:
+    """sha256 over the raw bytes of a seekable binary stream; rewinds it afterwards."""
+    h = hashlib.sha256()
+    while True:
+        chunk = stream.read(1 << 20)
+        if not chunk:
+            break
+        h.update(chunk)
+    stream.seek(0)
+    return h.hexdigest()
+
+def run_key(plans_key: str, facilities_key: Optional[str] = None) -> str:
+    """Store key of a run: the plans hash, or a hash of both when facilities enrich the coordinates."""
+    if not facilities_key:
+        return plans_key
+    return hashlib.sha256(f"{plans_key}:{facilities_key}".encode("ascii")).hexdigest()
+
+def _store_path(key: str) -> str:
+    return os.path.join(STORE_DIR, key)
+
+def duration_feature(kind: int, label: int) -> int:
+    """Column of the dsum_* matrix for a step kind and label code (-1: no label)."""
+    return 2 * (label + 1) + kind
+
+def _int_or_missing(v: Optional[int]) -> int:
+    return MISSING if v is None else v
+
+def _int_or_none(v: int) -> Optional[int]:
+    return None if v == MISSING else v
+
+def _float_or_none(v: float) -> Optional[float]:
+    return None if v != v else v
+
+def _id_order(ends, blob):
+    """
+    Rows sorted by personId bytes: the ids are padded into one fixed-width byte-string
+    array (persons x longest id) and argsorted, without a Python object per person.
+    """
+    import numpy as np
+
+    n = len(ends)
+    if n == 0:
+        return np.zeros(0, dtype=np.int32)
+    starts = np.concatenate(([0], ends[:-1]))
+    lengths = ends - starts
+    width = max(1, int(lengths.max()))
+    padded = np.zeros((n, width), dtype=np.uint8)
+    flat = padded.reshape(-1)
+    step = 1 << 16  # rows per scatter, so the index arrays stay small
+    for a in range(0, n, step):
+        b = min(n, a + step)
+        lens = lengths[a:b]
+        # flat position of every id byte: row * width + offset within the id
+        pos = np.repeat(np.arange(a, b, dtype=np.int64) * width - starts[a:b], lens) + np.arange(
+            starts[a], ends[b - 1], dtype=np.int64)
+        flat[pos] = blob[starts[a]:ends[b - 1]]
+    # zero padding sorts a prefix first, as bytes comparison does (ids hold no NUL bytes)
+    return np.argsort(padded.view(f"S{width}").reshape(-1), kind="stable")
+
+class StoreWriter:
+    """
+    Append persons (as produced by plans.iter_persons with selected_only=False, times in seconds)
+    and commit them as a store. Columns are flushed to disk in batches while persons are
+    added; what stays in memory is 8 bytes per person (selected-plan scores) plus the
+    unflushed batch. Commit sorts the indexes with NumPy, peaking at about
+    persons x (longest personId + 24) bytes for the id order, then ~70 bytes per
+    selected-plan activity point for the grid.
+    """
+
+    def __init__(self, key: str):
+        os.makedirs(STORE_DIR, exist_ok=True)
+        self.key = key
+        self._tmp = tempfile.mkdtemp(prefix=".tmp-", dir=STORE_DIR)
+        self._bufs = {name: array.array(code) for name, code in _COLUMNS.items()}
+        self._files = {name: open(os.path.join(self._tmp, name), "wb") for name in _COLUMNS}
+        self._ids = open(os.path.join(self._tmp, _PERSON_IDS), "wb")
+        self._labels: Dict[str, int] = {}
+        # posting key (label, or ~label for legs) -> person rows, spilled to <tmp>/post-*
+        self._sel_postings: Dict[int, array.array] = {}
+        self._any_postings: Dict[int, array.array] = {}
+        self._posting_files: Dict[tuple, Any] = {}
+        self._sel_scores = array.array("d")
+        self._geo = {name: array.array(code) for name, code in _GEO_POINTS.items()}
+        self._geo_files = {name: open(os.path.join(self._tmp, f"geo-{name}"), "wb") for name in _GEO_POINTS}
+        self._n_persons = 0
+        self._n_plans = 0
+        self._n_steps = 0
+        self._id_bytes = 0
+
+    def __enter__(self) -> "StoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.abort()  # no-op once committed
+
+    def _label(self, s: Optional[str]) -> int:
+        if s is None:
+            return -1
+        code = self._labels.get(s)
+        if code is None:
+            code = self._labels[s] = len(self._labels)
+        return code
+
+    def add(self, person: Dict[str, Any]) -> None:
+        b = self._bufs
+        pid = (person.get("personId") or "").encode("utf-8")
+        self._ids.write(pid)
+        self._id_bytes += len(pid)
+        b["person_id_end"].append(self._id_bytes)
+        b["person_plan_start"].append(self._n_plans)
+        sel_idx = person.get("selectedPlanIndex") or 0
+        b["person_selected"].append(sel_idx)
+        row = self._n_persons
+        self._n_persons += 1
+        sel_keys = set()
+        any_keys = set()
+
+        for plan_no, plan in enumerate(person.get("plans") or []):
+            b["plan_step_start"].append(self._n_steps)
+            b["plan_selected"].append(1 if plan.get("selected") else 0)
+            score = plan.get("matsimScore")
+            b["plan_matsim_score"].append(NAN if score is None else score)
+            b["plan_server_score"].append(plan.get("serverScore") or 0.0)
+            self._n_plans += 1
+            if plan_no == sel_idx:
+                self._sel_scores.append(plan.get("serverScore") or 0.0)
+            keys = set()
+            sums: Dict[int, int] = {}
+
+            for s in plan.get("steps") or []:
+                dur = s["durationSec"]
+                b["step_dur"].append(_int_or_missing(dur))
+                if s["kind"] == "activity":
+                    b["step_kind"].append(KIND_ACTIVITY)
+                    code = self._label(s["type"])
+                    b["step_label"].append(code)
+                    if dur:
+                        f = 2 * code + 2  # duration_feature(KIND_ACTIVITY, code)
+                        sums[f] = sums.get(f, 0) + dur
+                    if code >= 0:
+                        keys.add(code)  # posting key: label for activities, ~label for legs
+                    b["step_t0"].append(_int_or_missing(s["startTime"]))
+                    b["step_t1"].append(_int_or_missing(s["endTime"]))
+                    x = s["x"]; y = s["y"]
+                    b["step_x"].append(NAN if x is None else x)
+                    b["step_y"].append(NAN if y is None else y)
+                    if plan_no == sel_idx and x is not None and y is not None:
+                        g = self._geo
+                        g["x"].append(x); g["y"].append(y)
+                        g["label"].append(code); g["row"].append(row)
+                else:
+                    b["step_kind"].append(KIND_LEG)
+                    code = self._label(s["mode"])
+                    b["step_label"].append(code)
+                    if dur:
+                        f = 2 * code + 3  # duration_feature(KIND_LEG, code)
+                        sums[f] = sums.get(f, 0) + dur
+                    if code >= 0:
+                        keys.add(~code)
+                    b["step_t0"].append(_int_or_missing(s["depTime"]))
+                    b["step_t1"].append(_int_or_missing(s["travelTime"]))
+                    b["step_x"].append(NAN)
+                    b["step_y"].append(NAN)
+                self._n_steps += 1
+            for f, sec in sums.items():
+                b["dsum_plan"].append(self._n_plans - 1)
+                b["dsum_feature"].append(f)
+                b["dsum_sec"].append(sec)
+            any_keys |= keys
+            if plan_no == sel_idx:
+                sel_keys = keys
+
+        if len(self._sel_scores) < self._n_persons:
+            self._sel_scores.append(0.0)  # no plans (or a dangling selected index)
+        for postings, keys in ((self._sel_postings, sel_keys), (self._any_postings, any_keys)):
+            for key in keys:
+                post = postings.get(key)
+                if post is None:
+                    post = postings[key] = array.array("i")
+                post.append(row)
+
+        if len(b["step_kind"]) >= _FLUSH_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        for name, buf in self._bufs.items():
+            if buf:
+                buf.tofile(self._files[name])
+                del buf[:]
+        for name, buf in self._geo.items():
+            if buf:
+                buf.tofile(self._geo_files[name])
+                del buf[:]
+        for scope, postings in (("sel", self._sel_postings), ("any", self._any_postings)):
+            for key, post in postings.items():
+                if post:
+                    fh = self._posting_files.get((scope, key))
+                    if fh is None:
+                        fh = self._posting_files[(scope, key)] = open(
+                            os.path.join(self._tmp, f"post-{scope}-{key}"), "wb")
+                    post.tofile(fh)
+                    del post[:]
+
+    def _write_indexes(self, n_labels: int) -> None:
+        """Person-id order, score order and the inverted indexes (see _INDEXES)."""
+        import numpy as np  # commit only: keeps it off the server's import path
+
+        def write(name: str, data) -> None:
+            with open(os.path.join(self._tmp, name), "wb") as fh:
+                np.asarray(data).astype(_INDEXES[name]).tofile(fh)
+
+        write("idx_person_order", _id_order(np.fromfile(os.path.join(self._tmp, "person_id_end"), dtype=np.int64),
+                                            np.fromfile(os.path.join(self._tmp, _PERSON_IDS), dtype=np.uint8)))
+        # stable, so tied scores keep row order
+        write("idx_score_order", np.argsort(np.frombuffer(self._sel_scores, dtype=np.float64), kind="stable"))
+
+        for scope in ("sel", "any"):
+            start = array.array("q", [0])
+            with open(os.path.join(self._tmp, f"idx_{scope}_rows"), "wb") as out:
+                for kind in (KIND_ACTIVITY, KIND_LEG):
+                    for label in range(n_labels):
+                        key = label if kind == KIND_ACTIVITY else ~label
+                        fh = self._posting_files.pop((scope, key), None)
+                        size = 0
+                        if fh is not None:
+                            fh.close()
+                            with open(fh.name, "rb") as src:
+                                shutil.copyfileobj(src, out)
+                            size = os.path.getsize(fh.name) // 4
+                            os.unlink(fh.name)
+                        start.append(start[-1] + size)
+            write(f"idx_{scope}_start", start)
+
+    def _write_geo_index(self) -> Dict[str, Any]:
+        """Bucket the spilled activity points into a uniform grid (see _INDEXES); returns its geometry."""
+        pts = {}
+        for name, code in _GEO_POINTS.items():
+            self._geo_files[name].close()
+            pts[name] = array.array(code)
+            with open(self._geo_files[name].name, "rb") as fh:
+                pts[name].frombytes(fh.read())
+            os.unlink(self._geo_files[name].name)
+        import numpy as np
+
+        xs = np.frombuffer(pts["x"], dtype=np.float64)
+        ys = np.frombuffer(pts["y"], dtype=np.float64)
+        n = len(xs)
+        x0 = y0 = 0.0
+        cell = 1.0
+        nx = ny = 0
+        if n:
+            x0, y0 = float(xs.min()), float(ys.min())
+            w, h = float(xs.max()) - x0, float(ys.max()) - y0
+            cells = max(1, min(GEO_MAX_CELLS, n // GEO_CELL_POINTS))
+            cell = max(math.sqrt(w * h / cells), w / cells, h / cells, 1.0)
+            nx, ny = int(w / cell) + 1, int(h / cell) + 1
+
+        cell_ids = ((ys - y0) / cell).astype(np.int64) * nx + ((xs - x0) / cell).astype(np.int64)
+        order = np.argsort(cell_ids, kind="stable")  # points of a cell stay in ingest order
+        columns = {f"idx_geo_{name}": np.frombuffer(pts[name], dtype=code)[order]
+                   for name, code in _GEO_POINTS.items()}
+        del order
+        columns["idx_geo_start"] = np.concatenate(
+            ([0], np.cumsum(np.bincount(cell_ids, minlength=nx * ny)))).astype(np.int64)
+        # bincount adds each cell's points in ingest order, i.e. in the same order as the sorted slices
+        columns["idx_geo_sum_x"] = np.bincount(cell_ids, weights=xs, minlength=nx * ny)
+        columns["idx_geo_sum_y"] = np.bincount(cell_ids, weights=ys, minlength=nx * ny)
+        del cell_ids, pts
+        for name, data in columns.items():
+            with open(os.path.join(self._tmp, name), "wb") as fh:
+                data.tofile(fh)
+        return {"x0": x0, "y0": y0, "cell": cell, "nx": nx, "ny": ny, "points": n}
+
+    def commit(self) -> "PlanStore":
+        """Write closing offsets + meta and atomically move the store into place."""
+        self._bufs["person_plan_start"].append(self._n_plans)
+        self._bufs["plan_step_start"].append(self._n_steps)
+        self._flush()
+        for fh in self._files.values():
+            fh.close()
+        self._ids.close()
+        self._write_indexes(len(self._labels))
+        grid = self._write_geo_index()
+
+        labels: List[str] = [None] * len(self._labels)  # type: ignore[list-item]
+        for s, code in self._labels.items():
+            labels[code] = s
+        meta = {
+            "version": STORE_VERSION,
+            "key": self.key,
+            "persons": self._n_persons,
+            "plans": self._n_plans,
+            "steps": self._n_steps,
+            "labels": labels,
+            "grid": grid,
+        }
+        with open(os.path.join(self._tmp, _META), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False)
+
+        final = _store_path(self.key)
+        if os.path.isdir(final) and _current_meta(final) is None:
+            shutil.rmtree(final, ignore_errors=True)  # left by an older STORE_VERSION
+        try:
+            os.rename(self._tmp, final)
+        except OSError:
+            # another worker committed the same run first; keep theirs
+            shutil.rmtree(self._tmp, ignore_errors=True)
+        self._tmp = None
+        store = open_store(self.key)
+        if store is None:
+            raise RuntimeError(f"plan store {self.key} missing after commit")
+        return store
+
+    def abort(self) -> None:
+        if self._tmp is None:
+            return
+        for fh in list(self._files.values()) + list(self._posting_files.values()) + list(self._geo_files.values()):
+            fh.close()
+        self._ids.close()
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        self._tmp = None
+
+def map_column(path: str, code: str):
+    """Read-only typed view over a column file (empty files can't be mmapped)."""
+    if os.path.getsize(path) == 0:
+        return None, memoryview(array.array(code))
+    with open(path, "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, memoryview(mm).cast(code)
+
+class PlanStore:
+    """Read side of a committed store. Rows are served straight from the mapped columns."""
+
+    def __init__(self, path: str, meta: Dict[str, Any]):
+        self.path = path
+        self.meta = meta
+        self.labels: List[Optional[str]] = meta.get("labels") or []
+        self._maps = []
+        self.cols: Dict[str, memoryview] = {}
+        for name, code in list(_COLUMNS.items()) + list(_INDEXES.items()):
+            mm, view = map_column(os.path.join(path, name), code)
+            if mm is not None:
+                self._maps.append(mm)
+            self.cols[name] = view
+        mm, view = map_column(os.path.join(path, _PERSON_IDS), "B")
+        if mm is not None:
+            self._maps.append(mm)
+        self._ids = view
+
+    def __len__(self) -> int:
+        return int(self.meta.get("persons") or 0)
+
+    def person_id_bytes(self, i: int) -> bytes:
+        ends = self.cols["person_id_end"]
+        start = ends[i - 1] if i > 0 else 0
+        return bytes(self._ids[start:ends[i]])
+
+    def person_id(self, i: int) -> str:
+        return self.person_id_bytes(i).decode("utf-8")
+
+    def same_persons(self, other: "PlanStore") -> bool:
+        """True when both stores hold the same personIds in the same row order."""
+        return (len(self) == len(other)
+                and self.cols["person_id_end"].cast("B") == other.cols["person_id_end"].cast("B")
+                and self._ids == other._ids)
+
+    def find(self, person_id: str) -> int:
+        """Row of `person_id` (binary search over idx_person_order), or -1."""
+        order = self.cols["idx_person_order"]
+        ends = self.cols["person_id_end"]
+        ids = self._ids
+        key = person_id.encode("utf-8")
+
+        def id_at(i: int) -> bytes:
+            return bytes(ids[ends[i - 1] if i > 0 else 0:ends[i]])
+
+        lo = bisect.bisect_left(range(len(order)), key, key=lambda j: id_at(order[j]))
+        return order[lo] if lo < len(order) and id_at(order[lo]) == key else -1
+
+    def postings(self, kind: int, label: int, selected_only: bool = True) -> memoryview:
+        """Ascending rows of persons whose selected plan (or any plan) has a step of this kind/label."""
+        scope = "sel" if selected_only else "any"
+        start = self.cols[f"idx_{scope}_start"]
+        k = kind * len(self.labels) + label
+        return self.cols[f"idx_{scope}_rows"][start[k]:start[k + 1]]
+
+    def _steps(self, plan_idx: int) -> List[Dict[str, Any]]:
+        c = self.cols
+        labels = self.labels
+        out: List[Dict[str, Any]] = []
+        for k in range(c["plan_step_start"][plan_idx], c["plan_step_start"][plan_idx + 1]):
+            label = c["step_label"][k]
+            label = labels[label] if label >= 0 else None
+            t0 = _int_or_none(c["step_t0"][k])
+            t1 = _int_or_none(c["step_t1"][k])
+            dur = _int_or_none(c["step_dur"][k])
+            if c["step_kind"][k] == KIND_ACTIVITY:
+                out.append({
+                    "kind": "activity",
+                    "type": label,
+                    "startTime": sec_to_time(t0),
+                    "endTime": sec_to_time(t1),
+                    "x": _float_or_none(c["step_x"][k]),
+                    "y": _float_or_none(c["step_y"][k]),
+                    "durationSec": dur,
+                })
+            else:
+                out.append({
+                    "kind": "leg",
+                    "mode": label,
+                    "depTime": sec_to_time(t0),
+                    "travelTime": sec_to_time(t1),
+                    "durationSec": dur,
+                })
+        return out
+
+    def _plan(self, plan_idx: int) -> Dict[str, Any]:
+        c = self.cols
+        return {
+            "selected": bool(c["plan_selected"][plan_idx]),
+            "matsimScore": _float_or_none(c["plan_matsim_score"][plan_idx]),
+            "serverScore": c["plan_server_score"][plan_idx],
+            "steps": self._steps(plan_idx),
+        }
+
+    def person(self, i: int, selected_only: bool = True) -> Dict[str, Any]:
+        c = self.cols
+        first = c["person_plan_start"][i]
+        sel_idx = c["person_selected"][i]
+        if selected_only:
+            plans = [self._plan(first + sel_idx)]
+        else:
+            plans = [self._plan(p) for p in range(first, c["person_plan_start"][i + 1])]
+        return {"personId": self.person_id(i), "plans": plans, "selectedPlanIndex": sel_idx}
+
+    def iter_persons(self, start: int = 0, limit: Optional[int] = None,
+                     selected_only: bool = True) -> Iterator[Dict[str, Any]]:
+        stop = len(self) if limit is None else min(len(self), start + max(0, limit))
+        for i in range(max(0, start), stop):
+            yield self.person(i, selected_only=selected_only)
+
+    def close(self) -> None:
+        for view in list(self.cols.values()) + [self._ids]:
+            view.release()
+        self.cols = {}
+        for mm in self._maps:
+            try:
+                mm.close()
+            except BufferError:
+                pass  # a caller still holds a view; the map goes away with it
+        self._maps = []
+
+def _current_meta(path: str) -> Optional[Dict[str, Any]]:
+    """meta.json of a committed store in the current layout, without mapping its columns."""
+    try:
+        with open(os.path.join(path, _META), encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("version") == STORE_VERSION else None
+
+def open_store(key: str) -> Optional[PlanStore]:
+    """Open a committed store, or None if the run was never ingested (or is from an older layout)."""
+    path = _store_path(key)
+    meta = _current_meta(path)
+    if meta is None:
+        return None
+    try:
+        return PlanStore(path, meta)
+    except OSError:
+        return None  # evicted (see run_registry) while being opened
+
+def ingest(persons: Iterable[Dict[str, Any]], key: str) -> PlanStore:
+    """Write every person into a new store for `key` and return it opened."""
+    with StoreWriter(key) as writer:
+        for person in persons:
+            writer.add(person)
+        return writer.commit()
@@ -0,0 +1,467 @@
+# plans.py
+"""
+MATSim plans parsing shared by the HTTP routes and the plan store.
+Kept free of Flask so it can run in ingest jobs / worker processes.
+
+Parsed persons carry times as integer seconds ("startTime", "endTime",
+"depTime", "travelTime"); output_person turns them into the "HH:MM:SS"
+strings of the /upload payload.
+"""
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from xml.parsers import expat
+
+from matsim_time import parse_time_to_seconds, sec_to_time
+from metrics import PERSONS_PARSED, STAGE_SECONDS
+
+def safe_float(val: Optional[str]) -> Optional[float]:
+    if val is None or val == "":
+        return None
+    try:
+        return float(val)
+    except Exception:
+        return None
+
+# ---- memory budget ----
+
+class ParseBudgetExceeded(Exception):
+    """Raised mid-parse when a ParseBudget limit is hit; the message is safe to show to clients."""
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _env_number(name: str) -> Optional[float]:
+    try:
+        val = float(os.getenv(name, ""))
+    except ValueError:
+        return None
+    return val if val > 0 else None
+
+class ParseBudget:
+    """
+    Limits for one parse: max persons emitted and max process RSS (MB).
+    RSS is sampled every `check_every` persons. None disables a limit.
+    """
+
+    def __init__(self, max_rss_mb: Optional[float] = None, max_persons: Optional[int] = None,
+                 check_every: int = 1000):
+        self.max_rss_mb = max_rss_mb
+        self.max_persons = max_persons
+        self.check_every = max(1, check_every)
+
+    @classmethod
+    def from_env(cls) -> "ParseBudget":
+        """$PLAN_MAX_RSS_MB / $PLAN_MAX_PERSONS; unset or <= 0 means unlimited."""
+        max_persons = _env_number("PLAN_MAX_PERSONS")
+        return cls(_env_number("PLAN_MAX_RSS_MB"), int(max_persons) if max_persons else None)
+
+    def rss_only(self) -> "ParseBudget":
+        """The RSS limit alone, for parses written to the plan store rather than held as a response."""
+        return ParseBudget(self.max_rss_mb, None, self.check_every)
+
+    def check(self, n_persons: int) -> None:
+        if self.max_persons is not None and n_persons > self.max_persons:
+            raise ParseBudgetExceeded(
+                f"plans file has more than {self.max_persons} persons (PLAN_MAX_PERSONS)"
+            )
+        if self.max_rss_mb is not None and n_persons % self.check_every == 0:
+            rss = current_rss_mb()
+            if rss > self.max_rss_mb:
+                raise ParseBudgetExceeded(
+                    f"parsing stopped after {n_persons} persons: memory use {rss:.0f} MB "
+                    f"exceeds the {self.max_rss_mb:.0f} MB budget (PLAN_MAX_RSS_MB)"
+                )
+
+DEFAULT_WEIGHTS = {
+    "act": {"Home": 1.0, "Work": 0.5, "Business": 0.3, "Shopping": 0.2, "__other__": 0.1},
+    "leg": {"car": -2.0, "walk": 0.5, "pt": 0.1, "__other__": 0.0},
+}
+
+def score_plan(steps: List[Dict[str, Any]], weights=DEFAULT_WEIGHTS) -> float:
+    score = 0.0
+    for s in steps:
+        if s.get("kind") == "activity":
+            w = weights["act"].get(s.get("type"), weights["act"]["__other__"])
+            score += (s.get("durationSec") or 0) * w
+        elif s.get("kind") == "leg":
+            w = weights["leg"].get(s.get("mode"), weights["leg"]["__other__"])
+            score += (s.get("durationSec") or 0) * w
+    return score
+
+def _output_steps(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for s in steps:
+        if s["kind"] == "activity":
+            out.append({
+                "kind": "activity",
+                "type": s["type"],
+                "startTime": sec_to_time(s["startTime"]),
+                "endTime": sec_to_time(s["endTime"]),
+                "x": s["x"],
+                "y": s["y"],
+                "durationSec": s["durationSec"],
+            })
+        else:
+            out.append({
+                "kind": "leg",
+                "mode": s["mode"],
+                "depTime": sec_to_time(s["depTime"]),
+                "travelTime": sec_to_time(s["travelTime"]),
+                "durationSec": s["durationSec"],
+            })
+    return out
+
+def output_person(person: Dict[str, Any], selected_only: bool = False) -> Dict[str, Any]:
+    """
+    /upload payload form of a parsed person: times as "HH:MM:SS" strings,
+    optionally with only the selected plan.
+    """
+    plans = person["plans"]
+    sel_idx = person.get("selectedPlanIndex") or 0
+    if selected_only:
+        plans = plans[sel_idx:sel_idx + 1]
+    return {
+        "personId": person["personId"],
+        "plans": [
+            {
+                "selected": pl["selected"],
+                "matsimScore": pl["matsimScore"],
+                "serverScore": pl["serverScore"],
+                "steps": _output_steps(pl["steps"]),
+            }
+            for pl in plans
+        ],
+        "selectedPlanIndex": sel_idx,
+    }
+
+def finalize_plan(steps: List[Dict[str, Any]], last_leg_arrival: Optional[int],
+                  weights=DEFAULT_WEIGHTS) -> float:
+    """
+    Per-plan engine: backfill missing activity end times (next step's start /
+    departure, else the last leg arrival), set durationSec on every step and
+    return the plan's serverScore. All times are integer seconds.
+    """
+    for i, s in enumerate(steps):
+        if s["kind"] == "activity":
+            st = s["startTime"]
+            et = s["endTime"]
+            if et is None:
+                for n in steps[i + 1:]:
+                    et = n["startTime"] if n["kind"] == "activity" else n["depTime"]
+                    if et is not None:
+                        break
+                if et is None:
+                    et = last_leg_arrival
+                s["endTime"] = et
+            s["durationSec"] = (et - st) if (st is not None and et is not None) else None
+        else:
+            s["durationSec"] = s["travelTime"]
+
+    return score_plan(steps, weights)
+
+BATCH_PLANS = 2048
+
+class _PlanBuilder:
+    """
+    Person/plan/step state machine fed with (tag, attrib) start/end events.
+    Every parser backend drives the same builder, so they produce identical output.
+    Completed persons accumulate in `done` until the backend drains them.
+    """
+
+    def __init__(self, facilities_map: Optional[Dict[str, tuple]] = None, selected_only: bool = True,
+                 engine: str = "plan"):
+        self.facilities_map = facilities_map or {}
+        self.selected_only = selected_only
+        self.done: List[Dict[str, Any]] = []
+        self.finalize_sec = 0.0  # time spent in finalize_plan / finalize_batch
+
+        # "batch": plans are finalized BATCH_PLANS at a time by plan_engine (NumPy)
+        self._finalize_batch = None
+        self.batch_plans = BATCH_PLANS
+        self._pending: List[tuple] = []
+        self._held: List[Dict[str, Any]] = []
+        if engine == "batch":
+            from plan_engine import finalize_batch  # plan_engine imports this module
+            self._finalize_batch = finalize_batch
+        elif engine != "plan":
+            raise ValueError(f"unknown plan finalize engine: {engine!r}")
+
+        self.current_person: Optional[Dict[str, Any]] = None
+        self.inside_plan = False
+        self.plan_selected_flag = False
+        self.plan_matsim_score: Optional[float] = None
+        self._reset_plan()
+
+    def _reset_plan(self) -> None:
+        self.steps: List[Dict[str, Any]] = []
+        self.last_open_activity_idx: Optional[int] = None
+        self.current_time: Optional[int] = None
+        self.last_leg_arrival: Optional[int] = None
+
+    def start(self, tag: str, attrib: Dict[str, str]) -> None:
+        if tag == "person":
+            self.current_person = {"personId": attrib.get("id"), "plans": []}
+
+        elif tag == "plan" and self.current_person is not None:
+            self.inside_plan = True
+            self.plan_selected_flag = (attrib.get("selected") == "yes")
+            self.plan_matsim_score = safe_float(attrib.get("score"))
+            self._reset_plan()
+
+        elif self.inside_plan and tag in ("act", "activity") and self.current_person is not None:
+            self._activity(attrib)
+
+        elif self.inside_plan and tag == "leg" and self.current_person is not None:
+            self._leg(attrib)
+
+    def _activity(self, attrib: Dict[str, str]) -> None:
+        steps = self.steps
+        start_time = attrib.get("start_time")
+        end_time = attrib.get("end_time")
+
+        facility_id = attrib.get("facility")
+        x = attrib.get("x")
+        y = attrib.get("y")
+        if (x is None or y is None) and facility_id and self.facilities_map:
+            xy = self.facilities_map.get(facility_id)
+            if xy:
+                x, y = xy  # tuple(float, float)
+
+        if start_time:
+            st = parse_time_to_seconds(start_time)
+        else:
+            st = self.current_time if self.current_time is not None else 0
+        et = parse_time_to_seconds(end_time)
+
+        step: Dict[str, Any] = {
+            "kind": "activity",
+            "type": attrib.get("type"),
+            "startTime": st,
+            "endTime": et,
+            "x": float(x) if x not in (None, "") else None,
+            "y": float(y) if y not in (None, "") else None,
+            "durationSec": None
+        }
+        steps.append(step)
+        self.last_open_activity_idx = len(steps) - 1
+
+        if end_time:
+            self.current_time = et
+        else:
+            max_dur = attrib.get("max_dur")
+            md = parse_time_to_seconds(max_dur) if max_dur else None
+            if st is not None and md is not None:
+                step["endTime"] = st + md
+                self.current_time = st + md
+
+    def _leg(self, attrib: Dict[str, str]) -> None:
+        steps = self.steps
+        dep_time = attrib.get("dep_time") or attrib.get("depTime")
+        trav_time = attrib.get("trav_time") or attrib.get("travTime")
+        dep = parse_time_to_seconds(dep_time)
+
+        if self.last_open_activity_idx is not None and dep is not None:
+            prev_act = steps[self.last_open_activity_idx]
+            if prev_act["endTime"] is None:
+                prev_act["endTime"] = dep
+
+        if not dep_time:
+            dep = self.current_time if self.current_time is not None else 0
+        tt = parse_time_to_seconds(trav_time)
+
+        steps.append({
+            "kind": "leg",
+            "mode": attrib.get("mode"),
+            "depTime": dep,
+            "travelTime": tt,
+            "durationSec": None
+        })
+
+        if dep is not None and tt is not None:
+            self.last_leg_arrival = dep + tt
+            self.current_time = self.last_leg_arrival
+
+    def end(self, tag: str) -> None:
+        if tag == "plan" and self.inside_plan:
+            steps = self.steps
+            plan_obj = {
+                "selected": self.plan_selected_flag,
+                "matsimScore": self.plan_matsim_score,
+                "serverScore": None,
+                "steps": steps
+            }
+            if self._finalize_batch is not None:
+                self._pending.append((plan_obj, self.last_leg_arrival))
+            else:
+                t0 = time.perf_counter()
+                plan_obj["serverScore"] = finalize_plan(steps, self.last_leg_arrival)
+                self.finalize_sec += time.perf_counter() - t0
+
+            if self.current_person is not None:
+                self.current_person["plans"].append(plan_obj)
+
+            self.inside_plan = False
+            self.plan_selected_flag = False
+            self.plan_matsim_score = None
+            self._reset_plan()
+
+        elif tag == "person" and self.current_person is not None:
+            person = self.current_person
+            self.current_person = None
+
+            # prefer selected plan index
+            sel_idx = 0
+            for i, pl in enumerate(person["plans"]):
+                if pl.get("selected"):
+                    sel_idx = i
+                    break
+            person["selectedPlanIndex"] = sel_idx
+
+            # keep only the selected plan to shrink payload if requested
+            if self.selected_only and person["plans"]:
+                person["plans"] = [person["plans"][sel_idx]]
+
+            # only emit persons that actually have plans
+            if person["plans"]:
+                if self._finalize_batch is None:
+                    self.done.append(person)
+                else:
+                    # held back until the batch holding its plans is finalized
+                    self._held.append(person)
+                    if len(self._pending) >= self.batch_plans:
+                        self.flush()
+
+    def flush(self) -> None:
+        """Finalize pending plans as one batch and release the persons waiting on them."""
+        if self._pending:
+            t0 = time.perf_counter()
+            self._finalize_batch(self._pending)
+            self.finalize_sec += time.perf_counter() - t0
+            self._pending = []
+        if self._held:
+            self.done.extend(self._held)
+            self._held = []
+
+# ---- parser backends: (text stream, builder) -> persons ----
+
+def _iter_etree(f, builder: _PlanBuilder) -> Iterator[Dict[str, Any]]:
+    """
+    Reference backend: stdlib ElementTree iterparse with start/end events.
+    Every element is cleared on its end event, and finished persons are detached
+    from <population>, otherwise the root keeps an (empty) shell per person alive.
+    """
+    done = builder.done
+    root = None
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            builder.start(elem.tag, elem.attrib)
+        else:
+            builder.end(elem.tag)
+            elem.clear()
+            if elem.tag == "person":
+                root.clear()
+                if done:
+                    yield from done
+                    done.clear()
+    builder.flush()
+    yield from done
+    done.clear()
+
+EXPAT_READ_SIZE = 1 << 20
+
+def _iter_expat(f, builder: _PlanBuilder) -> Iterator[Dict[str, Any]]:
+    """
+    Fast backend: pyexpat callbacks straight into the builder.
+    No Element objects are built, and <route>/<attributes> text is never collected.
+    """
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+    done = builder.done
+    while True:
+        chunk = f.read(EXPAT_READ_SIZE)
+        parser.Parse(chunk, not chunk)
+        if not chunk:
+            builder.flush()
+        if done:
+            yield from done
+            done.clear()
+        if not chunk:
+            break
+
+PARSER_BACKENDS: Dict[str, Callable[[Any, _PlanBuilder], Iterator[Dict[str, Any]]]] = {
+    "etree": _iter_etree,
+    "expat": _iter_expat,
+}
+DEFAULT_PARSER = os.getenv("PLAN_PARSER", "expat")
+DEFAULT_ENGINE = os.getenv("PLAN_FINALIZE", "plan")
+
+def _timed(persons: Iterator[Dict[str, Any]], builder: _PlanBuilder) -> Iterator[Dict[str, Any]]:
+    """
+    Pass persons through, recording the time spent producing them (not the consumer's)
+    as stage "parse" and the builder's share of it as stage "finalize" once the parse ends.
+    """
+    parse_sec = 0.0
+    n = 0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                person = next(persons)
+            except StopIteration:
+                return
+            finally:
+                parse_sec += time.perf_counter() - t0
+            n += 1
+            yield person
+    finally:
+        STAGE_SECONDS.observe(parse_sec, stage="parse")
+        STAGE_SECONDS.observe(builder.finalize_sec, stage="finalize")
+        PERSONS_PARSED.inc(n)
+
+def within_budget(persons: Iterable[Dict[str, Any]], budget: ParseBudget) -> Iterator[Dict[str, Any]]:
+    """Pass persons through, raising ParseBudgetExceeded once `budget` is crossed."""
+    n = 0
+    for person in persons:
+        n += 1
+        budget.check(n)
+        yield person
+
+def iter_persons(f, facilities_map: Optional[Dict[str, tuple]] = None,
+                 selected_only: bool = True, backend: Optional[str] = None,
+                 budget: Optional[ParseBudget] = None,
+                 engine: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream persons out of a plans XML text stream.
+    Yields {"personId", "plans", "selectedPlanIndex"} for every person with at least one plan;
+    with selected_only, "plans" holds just the selected plan.
+    `backend` picks an entry of PARSER_BACKENDS (default: $PLAN_PARSER, else "expat").
+    With a `budget`, ParseBudgetExceeded is raised as soon as a limit is crossed.
+    `engine` is "plan" (finalize each plan as it closes) or "batch" (NumPy, see
+    plan_engine); default $PLAN_FINALIZE, else "plan".
+    """
+    name = backend or DEFAULT_PARSER
+    try:
+        run = PARSER_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown plans parser backend: {name!r}") from None
+    builder = _PlanBuilder(facilities_map, selected_only, engine or DEFAULT_ENGINE)
+    persons = _timed(run(f, builder), builder)
+    return within_budget(persons, budget) if budget is not None else persons
@@ -0,0 +1,175 @@
+# plans_parallel.py
+"""
+Multi-process plans parsing.
+
+The parent process decompresses the plans stream (text, or raw bytes from
+mapped_io) and cuts it into chunks at </person> boundaries. A ProcessPoolExecutor parses the chunks with the
+expat backend, step/duration logic included. Results come back in person
+order, so callers see the same sequence as plans.iter_persons.
+"""
+import io
+import os
+import re
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AnyStr, Dict, Iterator, List, Optional
+
+from plans import ParseBudget, iter_persons, within_budget
+
+CHUNK_CHARS = 8 << 20  # ~8M characters of XML per task
+_PERSON_OPEN = re.compile(r"<person[\s/>]")
+_PERSON_CLOSE = "</person>"
+_PERSON_OPEN_B = re.compile(rb"<person[\s/>]")
+_PERSON_CLOSE_B = b"</person>"
+_HEAD_BYTES = 4096  # enough for the XML declaration
+_DECLARATION_B = re.compile(rb"<\?xml[^>]*\?>")
+_ENCODING_B = re.compile(rb"""encoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+_WIDE_ENCODING_B = re.compile(rb"(?i)^(utf-?(16|32)|ucs-?[24])")
+
+# per-worker state, set by _init_worker
+_worker_facilities: Optional[Dict[str, tuple]] = None
+
+def parse_workers_from_env() -> int:
+    """$PLAN_PARSE_WORKERS: a number, or "auto" for one per CPU. 0/1/unset means serial parsing."""
+    raw = (os.getenv("PLAN_PARSE_WORKERS") or "").strip().lower()
+    if raw == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 0
+
+def split_person_chunks(f, chunk_chars: int = CHUNK_CHARS) -> Iterator[AnyStr]:
+    """
+    Cut a plans XML stream (text or binary) into fragments of whole <person> elements.
+    Everything before the first <person> (declaration, DOCTYPE, <population>,
+    population attributes) and the closing </population> are dropped.
+    """
+    buf = None
+    started = False
+    while True:
+        data = f.read(chunk_chars)
+        if buf is None:
+            binary = not isinstance(data, str)
+            person_open = _PERSON_OPEN_B if binary else _PERSON_OPEN
+            person_close = _PERSON_CLOSE_B if binary else _PERSON_CLOSE
+            population_close = b"</population>" if binary else "</population>"
+            buf = data
+        else:
+            buf += data
+        if not started:
+            m = person_open.search(buf)
+            if m is None:
+                if not data:
+                    return
+                continue
+            buf = buf[m.start():]
+            started = True
+        if not data:
+            end = buf.rfind(population_close)
+            if end >= 0:
+                buf = buf[:end]
+            if buf.strip():
+                yield buf
+            return
+        cut = buf.rfind(person_close)
+        if cut >= 0:
+            cut += len(person_close)
+            yield buf[:cut]
+            buf = buf[cut:]
+
+class _Prepend:
+    """Reader returning `head` before the rest of `f`: a peeked stream put back together."""
+
+    def __init__(self, head: AnyStr, f):
+        self._head = head
+        self._f = f
+
+    def read(self, size: int = -1) -> AnyStr:
+        if not self._head:
+            return self._f.read(size)
+        if size is None or size < 0:
+            data = self._head + self._f.read()
+        else:
+            data = self._head[:size]
+        self._head = self._head[len(data):]
+        return data
+
+def _xml_declaration(head: bytes) -> Optional[bytes]:
+    """
+    The XML declaration at the start of a binary plans stream (b"" if there is none),
+    to be put in front of every fragment so it is decoded like the whole file.
+    None if fragments cannot be cut from the raw bytes (UTF-16/32).
+    """
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")) or b"\x00" in head[:4]:
+        return None
+    m = _DECLARATION_B.match(head[3:] if head.startswith(b"\xef\xbb\xbf") else head)
+    if m is None:
+        return b""
+    enc = _ENCODING_B.search(m.group())
+    if enc is not None and _WIDE_ENCODING_B.match(enc.group(1)):
+        return None
+    return m.group()
+
+def _init_worker(facilities_map: Optional[Dict[str, tuple]]) -> None:
+    global _worker_facilities
+    _worker_facilities = facilities_map
+
+def _parse_chunk(fragment: AnyStr, selected_only: bool, declaration: bytes = b"",
+                 facilities_map: Optional[Dict[str, tuple]] = None) -> List[Dict[str, Any]]:
+    if isinstance(fragment, str):
+        doc = io.StringIO("<population>" + fragment + "</population>")
+    else:
+        doc = io.BytesIO(declaration + b"<population>" + fragment + b"</population>")
+    facilities = _worker_facilities if facilities_map is None else facilities_map
+    return list(iter_persons(doc, facilities, selected_only, backend="expat"))
+
+def _iter_chunks(pool: Executor, f, facilities_map, selected_only: bool, workers: int,
+                 chunk_chars: int, declaration: bytes) -> Iterator[Dict[str, Any]]:
+    pending: deque = deque()
+    try:
+        for fragment in split_person_chunks(f, chunk_chars):
+            pending.append(pool.submit(_parse_chunk, fragment, selected_only, declaration, facilities_map))
+            # keep at most two chunks per worker in flight so memory stays bounded
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # limit reached / client gone: drop queued chunks instead of parsing them
+        for fut in pending:
+            fut.cancel()
+
+def _iter_parallel(f, facilities_map, selected_only: bool, workers: int, chunk_chars: int,
+                   declaration: bytes, pool: Optional[Executor]) -> Iterator[Dict[str, Any]]:
+    if pool is not None:
+        # a shared pool has no per-run initializer: the facilities go with each chunk
+        # (a FacilityTable pickles as its path)
+        yield from _iter_chunks(pool, f, facilities_map or {}, selected_only, workers, chunk_chars, declaration)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(facilities_map,)) as own:
+        yield from _iter_chunks(own, f, None, selected_only, workers, chunk_chars, declaration)
+
+def iter_persons_parallel(f, facilities_map: Optional[Dict[str, tuple]] = None,
+                          selected_only: bool = True, workers: Optional[int] = None,
+                          budget: Optional[ParseBudget] = None,
+                          chunk_chars: int = CHUNK_CHARS,
+                          pool: Optional[Executor] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Same contract as plans.iter_persons, parsed by `workers` processes (default: one per CPU).
+    With `pool`, the chunks go to that (long-lived) executor, `workers` being its size;
+    otherwise a pool is started for this parse.
+    Stop iterating to honour a limit; outstanding chunks are cancelled.
+    Binary input keeps its XML declaration (and so its encoding) in every chunk;
+    UTF-16/32 files, which cannot be cut as bytes, are parsed serially.
+    """
+    workers = workers or os.cpu_count() or 1
+    head = f.read(_HEAD_BYTES)
+    declaration = b"" if isinstance(head, str) else _xml_declaration(head)
+    f = _Prepend(head, f)
+    if declaration is None:
+        persons = iter_persons(f, facilities_map, selected_only, backend="expat")
+    else:
+        persons = _iter_parallel(f, facilities_map, selected_only, workers, chunk_chars, declaration, pool)
+    return within_budget(persons, budget) if budget is not None else persons
@@ -0,0 +1,117 @@
+# rescore.py
+"""
+What-if serverScores for an ingested run under new weights.
+
+serverScore is a weighted sum of step durations, so it is linear in the
+weights: with S the plans x features matrix of durationSec sums per activity
+type / leg mode (plan_store's dsum_* columns, written at ingest), the scores
+under a weight vector w are S @ w. S is stored sparse, one row per non-zero
+(plan, feature) sum, and K weight sets are scored together as S @ W, so a
+request costs a few passes over those rows and never touches the plans XML.
+"""
+import copy
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from plan_store import KIND_ACTIVITY, KIND_LEG, PlanStore, duration_feature
+from plans import DEFAULT_WEIGHTS
+
+RESCORE_MAX_SETS = 64
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+class WeightsError(ValueError):
+    """A weight set that can't be used; the message is safe to show to clients."""
+
+def merge_weights(raw: Any) -> Dict[str, Dict[str, float]]:
+    """A client weight set laid over DEFAULT_WEIGHTS: {"leg": {"car": -3}} changes only car."""
+    if not isinstance(raw, dict):
+        raise WeightsError("each weight set must be an object with 'act' and/or 'leg'")
+    merged = copy.deepcopy(DEFAULT_WEIGHTS)
+    for group in ("act", "leg"):
+        part = raw.get(group) or {}
+        if not isinstance(part, dict):
+            raise WeightsError(f"weights.{group} must be an object")
+        for name, w in part.items():
+            if isinstance(w, bool) or not isinstance(w, (int, float)):
+                raise WeightsError(f"weights.{group}.{name} must be a number")
+            merged[group][name] = float(w)
+    return merged
+
+def weight_matrix(store: PlanStore, weight_sets: List[Dict[str, Dict[str, float]]]) -> np.ndarray:
+    """features x K: the weight each set gives every (kind, label) column of the dsum matrix."""
+    labels: List[Optional[str]] = [None] + list(store.labels)
+    W = np.zeros((2 * len(labels), len(weight_sets)), dtype=np.float64)
+    for k, weights in enumerate(weight_sets):
+        for kind, group in ((KIND_ACTIVITY, weights["act"]), (KIND_LEG, weights["leg"])):
+            other = group.get("__other__", 0.0)
+            for code, label in enumerate(labels, start=-1):
+                W[duration_feature(kind, code), k] = group.get(label, other)
+    return W
+
+def plan_scores(store: PlanStore, weight_sets: List[Dict[str, Dict[str, float]]]) -> np.ndarray:
+    """plans x K serverScores, one column per weight set."""
+    c = store.cols
+    plan = np.frombuffer(c["dsum_plan"], dtype=np.int32)
+    feature = np.frombuffer(c["dsum_feature"], dtype=np.int32)
+    sec = np.frombuffer(c["dsum_sec"], dtype=np.int64).astype(np.float64)
+    n_plans = len(c["plan_server_score"])
+    W = weight_matrix(store, weight_sets)
+    out = np.empty((n_plans, len(weight_sets)), dtype=np.float64)
+    for k in range(len(weight_sets)):
+        out[:, k] = np.bincount(plan, weights=sec * W[feature, k], minlength=n_plans)
+    return out
+
+def _quantiles(values: np.ndarray) -> Dict[str, float]:
+    if not len(values):
+        return {}
+    return {f"p{int(q * 100)}": float(v) for q, v in zip(QUANTILES, np.quantile(values, QUANTILES, method="lower"))}
+
+def rescore_store(store: PlanStore, weight_sets: List[Dict[str, Dict[str, float]]],
+                  cursor: int = 0, limit: int = 0) -> List[Dict[str, Any]]:
+    """
+    Per weight set: selected-plan score distribution and mean change against the stored
+    serverScore, how many persons would now rank another of their plans above the
+    selected one, and the selected scores of persons [cursor, cursor + limit).
+    """
+    c = store.cols
+    scores = plan_scores(store, weight_sets)
+    start = np.frombuffer(c["person_plan_start"], dtype=np.int64)
+    selected = np.frombuffer(c["person_selected"], dtype=np.int32).astype(np.int64)
+    counts = np.diff(start)
+    has = (counts > 0) & (selected < counts)  # plan-less persons (and dangling indexes) have no score
+    sel_plan = (start[:-1] + selected)[has]
+    old = np.frombuffer(c["plan_server_score"], dtype=np.float64)[sel_plan]
+    nonempty = counts > 0
+    multi = (counts > 1) & has
+
+    rows = range(max(0, cursor), min(len(store), max(0, cursor) + max(0, limit)))
+    page_plan = start[:-1][rows.start:rows.stop] + selected[rows.start:rows.stop]
+    page_ok = has[rows.start:rows.stop]
+
+    out = []
+    for k, weights in enumerate(weight_sets):
+        col = scores[:, k]
+        sel = col[sel_plan]
+        # best plan per person: max over each person's run of plans (kept for 2+ plans)
+        firsts = start[:-1][nonempty]
+        best = np.maximum.reduceat(col, firsts)[multi[nonempty]] if len(firsts) else np.empty(0)
+        own = col[(start[:-1] + selected)[multi]]
+        out.append({
+            "weights": weights,
+            "persons": int(has.sum()),
+            "selectedScore": {
+                "mean": float(sel.mean()) if len(sel) else None,
+                "min": float(sel.min()) if len(sel) else None,
+                "max": float(sel.max()) if len(sel) else None,
+                "quantiles": _quantiles(sel),
+            },
+            "meanDelta": float((sel - old).mean()) if len(sel) else None,
+            # summation order differs from the parser's, so near-ties are ties
+            "selectedNotBest": int(((own < best) & ~np.isclose(own, best, rtol=1e-12, atol=1e-9)).sum()),
+            "page": [
+                {"personId": store.person_id(r), "serverScore": float(col[p]) if ok else None}
+                for r, p, ok in zip(rows, page_plan.tolist(), page_ok.tolist())
+            ],
+        })
+    return out
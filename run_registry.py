@@ -0,0 +1,223 @@
+# run_registry.py
+"""
+Registry of ingested runs: SQLite metadata next to the plan stores, and LRU
+eviction of whole runs under a disk budget.
+
+The stores themselves are the shared data: every worker process (gunicorn
+workers, the ASGI ingest pool) opens the same STORE_DIR/<run key>/ columns
+read-only through mmap, so the page cache holds one copy of a run however
+many workers serve it. The registry keeps one row per run in
+STORE_DIR/registry.sqlite3 ($RUN_REGISTRY_DB): size on disk, persons,
+created / last-used times and hits. SQLite (WAL) makes those rows safe to
+update from every worker at once.
+
+Once the runs together take more than $RUN_STORE_MAX_MB, the least recently
+used ones are evicted: the directory is renamed out of the way first, so
+open_store() sees the run as unknown at once (its next upload re-ingests it),
+then deleted. A worker that still has an evicted run mapped keeps reading
+it, since unlinked files live until they are unmapped. Runs used within
+RUN_EVICT_MIN_IDLE seconds, and the one being registered, are never evicted.
+The store directories stay the source of truth: rows are reconciled with
+them once per process, so runs written before the registry existed (or by a
+crashed worker) are picked up, rows whose directory vanished are dropped,
+and .tmp- build directories no one has written to for an hour are removed.
+A run's size is measured at commit and again when aggregate.py caches a
+summary in its directory.
+"""
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from plan_store import STORE_DIR, PlanStore, open_store
+
+RUN_STORE_MAX_MB = float(os.getenv("RUN_STORE_MAX_MB", "10240"))  # 0: no limit
+RUN_EVICT_MIN_IDLE = float(os.getenv("RUN_EVICT_MIN_IDLE", "60"))  # seconds
+RUN_REGISTRY_DB = os.getenv("RUN_REGISTRY_DB") or os.path.join(STORE_DIR, "registry.sqlite3")
+
+_TOUCH_EVERY = 10.0  # seconds between last-used writes for one run, per process
+_RUN_DIR = re.compile(r"^[0-9a-f]{64}$")
+_EVICTING = ".evict-"
+_BUILDING = ".tmp-"  # StoreWriter's temporary directories
+_STALE_BUILD = 3600.0  # seconds without a write before a .tmp- directory counts as crashed
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+def _last_write(path: str) -> float:
+    """Newest mtime of a directory and the files in it."""
+    newest = os.path.getmtime(path)
+    with os.scandir(path) as it:
+        for entry in it:
+            newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+    return newest
+
+class RunRegistry:
+    def __init__(self, db_path: str = RUN_REGISTRY_DB, store_dir: str = STORE_DIR,
+                 max_bytes: float = RUN_STORE_MAX_MB * (1 << 20), min_idle: float = RUN_EVICT_MIN_IDLE):
+        self.db_path = db_path
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.min_idle = min_idle
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connection, opened (and reconciled with the store directories) on first use in this process."""
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " key TEXT PRIMARY KEY, bytes INTEGER NOT NULL, persons INTEGER,"
+                " created_at REAL NOT NULL, last_used_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS runs_lru ON runs (last_used_at)")
+            self._db = db
+            self._sync()
+        return self._db
+
+    def _sync(self) -> None:
+        """
+        Add store directories without a row, drop rows without a directory, finish
+        crashed evictions and remove the leftovers of crashed builds.
+        """
+        try:
+            names = os.listdir(self.store_dir)
+        except FileNotFoundError:
+            names = []
+        on_disk = set()
+        stale = time.time() - _STALE_BUILD
+        for name in names:
+            path = os.path.join(self.store_dir, name)
+            if name.startswith(_EVICTING):
+                shutil.rmtree(path, ignore_errors=True)
+            elif name.startswith(_BUILDING):
+                try:
+                    if _last_write(path) < stale:  # a live build in another worker keeps writing
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass  # committed or aborted meanwhile
+            elif _RUN_DIR.match(name) and os.path.isdir(path):
+                on_disk.add(name)
+        known = {row[0] for row in self._db.execute("SELECT key FROM runs")}
+        for key in on_disk - known:
+            path = os.path.join(self.store_dir, key)
+            try:
+                mtime = os.path.getmtime(path)
+                self._db.execute(
+                    "INSERT OR IGNORE INTO runs (key, bytes, persons, created_at, last_used_at) VALUES (?, ?, NULL, ?, ?)",
+                    (key, _dir_bytes(path), mtime, mtime),
+                )
+            except OSError:
+                pass  # evicted meanwhile
+        for key in known - on_disk:
+            self._db.execute("DELETE FROM runs WHERE key = ?", (key,))
+
+    def opened(self, key: str) -> None:
+        """Mark a run as used (a store hit); writes at most every few seconds per run."""
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(key, 0.0) < _TOUCH_EVERY:
+                return
+            self._touched[key] = now
+            db = self._conn()
+            cur = db.execute("UPDATE runs SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            if cur.rowcount == 0:
+                path = os.path.join(self.store_dir, key)
+                try:
+                    db.execute(
+                        "INSERT OR IGNORE INTO runs (key, bytes, persons, created_at, last_used_at, hits)"
+                        " VALUES (?, ?, NULL, ?, ?, 1)",
+                        (key, _dir_bytes(path), os.path.getmtime(path), now),
+                    )
+                except OSError:
+                    pass
+
+    def committed(self, store: PlanStore) -> None:
+        """Register a freshly ingested run, then evict least recently used runs while over budget."""
+        key = store.meta["key"]
+        now = time.time()
+        with self._lock:
+            self._touched[key] = now
+            self._conn().execute(
+                "INSERT INTO runs (key, bytes, persons, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET bytes = excluded.bytes, persons = excluded.persons,"
+                " last_used_at = excluded.last_used_at",
+                (key, _dir_bytes(store.path), store.meta.get("persons"), now, now),
+            )
+        self.evict_over_budget(keep=key)
+
+    def grown(self, key: str) -> None:
+        """Re-measure a run that gained files after its commit (aggregate-*.json), then evict while over budget."""
+        try:
+            size = _dir_bytes(os.path.join(self.store_dir, key))
+        except OSError:
+            return  # evicted meanwhile
+        with self._lock:
+            self._conn().execute("UPDATE runs SET bytes = ? WHERE key = ?", (size, key))
+        self.evict_over_budget(keep=key)
+
+    def evict_over_budget(self, keep: Optional[str] = None) -> List[str]:
+        """Evict LRU runs until the total fits max_bytes; returns the evicted keys."""
+        if self.max_bytes <= 0:
+            return []
+        evicted = []
+        with self._lock:
+            db = self._conn()
+            total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM runs").fetchone()[0]
+            if total <= self.max_bytes:
+                return []
+            idle_since = time.time() - self.min_idle
+            for key, size in db.execute(
+                "SELECT key, bytes FROM runs WHERE last_used_at < ? ORDER BY last_used_at", (idle_since,)
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                self._evict(key)
+                total -= size
+                evicted.append(key)
+        return evicted
+
+    def _evict(self, key: str) -> None:
+        path = os.path.join(self.store_dir, key)
+        gone = os.path.join(self.store_dir, f"{_EVICTING}{key}-{os.getpid()}")
+        try:
+            os.rename(path, gone)  # atomic: from here on open_store() misses the run
+        except OSError:
+            pass  # already evicted by another worker
+        else:
+            shutil.rmtree(gone, ignore_errors=True)
+        self._db.execute("DELETE FROM runs WHERE key = ?", (key,))
+        self._touched.pop(key, None)
+
+    def runs(self) -> List[Dict[str, Any]]:
+        """Registered runs, most recently used first."""
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT key, bytes, persons, created_at, last_used_at, hits FROM runs ORDER BY last_used_at DESC"
+            ).fetchall()
+        return [{"runKey": k, "bytes": b, "persons": p, "createdAt": c, "lastUsedAt": u, "hits": h}
+                for k, b, p, c, u, h in rows]
+
+# shared by every route of this process
+registry = RunRegistry()
+
+def open_run(key: str) -> Optional[PlanStore]:
+    """open_store, counting a hit in the registry when the run is stored."""
+    store = open_store(key)
+    if store is not None:
+        registry.opened(key)
+    return store
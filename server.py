@@ -1,110 +1,96 @@
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, g, request, jsonify as _flask_jsonify, make_response, stream_with_context
 from flask_cors import CORS
 from flask_compress import Compress
+import cProfile
 import gzip
 import io
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import facility_store
+import layer_tiles
+import network_store
+import plan_store
+import run_registry
+from aggregate import cached_aggregate
+from compare import compare_stores
+from jobs import Job, JobQueue, QueueFull
+from mapped_io import open_mapped
+from matsim_time import parse_time_to_seconds
+from metrics import (HTTP_REQUESTS, HTTP_SECONDS, PROMETHEUS_MIMETYPE, STAGE_SECONDS, cache_lookup,
+                     render_prometheus)
+from plan_columns import MSGPACK_MIMETYPE, encode_msgpack
+from plan_query import PersonFilter, query_rows
+from plan_spatial import ACTIVITY_MAX_POINTS, query_activities
+from plans import ParseBudget, ParseBudgetExceeded, iter_persons, output_person, within_budget
+from plans_parallel import iter_persons_parallel, parse_workers_from_env
 
 app = Flask(__name__)
 
 # --- CORS: explicitly allow your FE origins ---
+CORS_ORIGINS = ("http://localhost:3000", "http://127.0.0.1:3000")
 CORS(
     app,
-    resources={r"/*": {"origins": ["http://localhost:3000", "http://127.0.0.1:3000"]}},
+    resources={r"/*": {"origins": list(CORS_ORIGINS)}},
     supports_credentials=False
 )
 
-# --- gzip compression for big JSON ---
+# --- gzip compression for big JSON (NDJSON streams are compressed chunk by chunk) ---
+app.config["COMPRESS_MIMETYPES"] = [
+    "application/json", "application/x-ndjson", "application/x-msgpack",
+    "text/html", "text/css", "text/javascript", "application/javascript", "text/xml",
+]
+app.config["COMPRESS_STREAMS"] = True
 Compress(app)
 
 # --- REGISTER the AI story blueprint (separate module) ---
 from story_api import story_bp
 app.register_blueprint(story_bp)
 
-def parse_time_to_seconds(time_str: Optional[str]) -> Optional[int]:
-    if not time_str:
-        return None
-    try:
-        h, m, s = time_str.split(":")
-        return int(h) * 3600 + int(m) * 60 + int(s)
-    except Exception:
-        return None
-
-def sec_to_time(sec: Optional[int]) -> Optional[str]:
-    if sec is None:
-        return None
-    sec = max(0, int(round(sec)))
-    h = sec // 3600
-    m = (sec % 3600) // 60
-    s = sec % 60
-    return f"{h:02d}:{m:02d}:{s:02d}"
-
-def safe_float(val: Optional[str]) -> Optional[float]:
-    if val is None or val == "":
-        return None
-    try:
-        return float(val)
-    except Exception:
-        return None
-
-# ---- helpers for reading .xml or .xml.gz ----
-def open_maybe_gzip(file_storage):
-    """
-    Return a text-mode file-like object from a Werkzeug FileStorage,
-    auto-detecting gzip by first two bytes.
+# ---- .xml / .xml.gz uploads are memory-mapped and parsed as raw bytes (see mapped_io) ----
+def parse_facilities(file_storage, key: Optional[str] = None):
     """
-    head = file_storage.stream.read(2)
-    file_storage.stream.seek(0)
-    if head == b"\x1f\x8b":
-        return gzip.open(file_storage.stream, "rt", encoding="utf-8")
-    return io.TextIOWrapper(file_storage.stream, encoding="utf-8")
-
-def parse_facilities(file_storage) -> Dict[str, tuple]:
-    """
-    Parse facilities XML (v2) into {facilityId: (x, y)}.
+    Facilities XML (v2) as a {facilityId: (x, y)} lookup backed by a cached,
+    memory-mapped FacilityTable; each distinct file is parsed only once.
     Supports gzip.
     """
     if not file_storage:
         return {}
-    facilities: Dict[str, tuple] = {}
-    with open_maybe_gzip(file_storage) as f:
-        context = ET.iterparse(f, events=("start",))
-        for event, elem in context:
-            if elem.tag == "facility":
-                fid = elem.attrib.get("id")
-                x = elem.attrib.get("x")
-                y = elem.attrib.get("y")
-                if fid and x and y:
-                    try:
-                        facilities[fid] = (float(x), float(y))
-                    except Exception:
-                        pass
-                elem.clear()
-    return facilities
-
-DEFAULT_WEIGHTS = {
-    "act": {"Home": 1.0, "Work": 0.5, "Business": 0.3, "Shopping": 0.2, "__other__": 0.1},
-    "leg": {"car": -2.0, "walk": 0.5, "pt": 0.1, "__other__": 0.0},
-}
-
-def score_plan(steps: List[Dict[str, Any]], weights=DEFAULT_WEIGHTS) -> float:
-    score = 0.0
-    for s in steps:
-        if s.get("kind") == "activity":
-            w = weights["act"].get(s.get("type"), weights["act"]["__other__"])
-            score += (s.get("durationSec") or 0) * w
-        elif s.get("kind") == "leg":
-            w = weights["leg"].get(s.get("mode"), weights["leg"]["__other__"])
-            score += (s.get("durationSec") or 0) * w
-    return score
+    key = key or plan_store.content_key(file_storage.stream)
+    table = facility_store.open_table(key)
+    cache_lookup("facilities", table is not None)
+    if table is None:
+        with open_mapped(file_storage) as f:
+            table = facility_store.build_table(key, facility_store.iter_facilities(f))
+    return table
+
+def parse_network(file_storage, key: Optional[str] = None) -> network_store.NetworkTable:
+    """MATSim network XML as a cached, memory-mapped NetworkTable; each distinct file is parsed only once."""
+    key = key or plan_store.content_key(file_storage.stream)
+    table = network_store.open_table(key)
+    cache_lookup("network", table is not None)
+    if table is None:
+        with open_mapped(file_storage) as f:
+            table = network_store.build_table(key, network_store.iter_network(f))
+    return table
 
 @app.after_request
 def add_cors_headers(resp):
     origin = request.headers.get("Origin")
-    if origin in ("http://localhost:3000", "http://127.0.0.1:3000"):
+    if origin in CORS_ORIGINS:
         resp.headers["Access-Control-Allow-Origin"] = origin
         resp.headers["Vary"] = "Origin"
         resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
@@ -112,15 +98,311 @@ def add_cors_headers(resp):
     return resp
 
 @app.route("/upload", methods=["OPTIONS"])
-def upload_preflight():
+@app.route("/aggregate", methods=["OPTIONS"])
+@app.route("/jobs", methods=["OPTIONS"])
+@app.route("/compare", methods=["OPTIONS"])
+@app.route("/runs/<run_key>/rescore", methods=["OPTIONS"])
+@app.route("/network/routes", methods=["OPTIONS"])
+def upload_preflight(**_):
     resp = make_response("", 204)
     origin = request.headers.get("Origin")
-    if origin in ("http://localhost:3000", "http://127.0.0.1:3000"):
+    if origin in CORS_ORIGINS:
         resp.headers["Access-Control-Allow-Origin"] = origin
     resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
     resp.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
     return resp
 
+# ---- instrumentation: per-route metrics (GET /metrics, see metrics) and ?profile=1 ----
+# ?profile=1 answers with a cProfile summary instead of the response; off unless $PROFILE_REQUESTS=1
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))  # functions listed
+PROFILE_SORT = os.getenv("PROFILE_SORT", "cumulative")
+
+def jsonify(*args, **kwargs) -> Response:
+    """flask.jsonify, timed as stage "jsonify"."""
+    with STAGE_SECONDS.time(stage="jsonify"):
+        return _flask_jsonify(*args, **kwargs)
+
+@app.before_request
+def start_request_timer():
+    g.request_t0 = time.perf_counter()
+    if PROFILE_REQUESTS and request.args.get("profile") == "1":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _profile_summary(profiler: cProfile.Profile, resp: Response) -> Response:
+    """
+    Replace a profiled response with its pstats summary (text/plain; the original status
+    goes in X-Profiled-Status). A streamed body is drained first, so its work is profiled too.
+    """
+    try:
+        body = resp.get_data()
+    finally:
+        profiler.disable()
+    out = io.StringIO()
+    out.write(f"{request.method} {request.full_path} -> {resp.status_code}, {len(body)} bytes\n")
+    pstats.Stats(profiler, stream=out).sort_stats(PROFILE_SORT).print_stats(PROFILE_TOP)
+    summary = Response(out.getvalue(), mimetype="text/plain")
+    summary.headers["X-Profiled-Status"] = str(resp.status_code)
+    return summary
+
+@app.after_request
+def record_request(resp):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        resp = _profile_summary(profiler, resp)
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=str(resp.status_code))
+    # until the response is built: a streamed body is still to come
+    HTTP_SECONDS.observe(time.perf_counter() - g.get("request_t0", time.perf_counter()), route=route)
+    return resp
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Stage timers, LLM latency/tokens, cache hit rates and per-route counts, for Prometheus to scrape."""
+    return Response(render_prometheus(), content_type=PROMETHEUS_MIMETYPE)
+
+# $PLAN_PARSE_WORKERS > 1 (or "auto") parses big plans files in a process pool
+PARSE_WORKERS = parse_workers_from_env()
+
+# --- ingest process pool: set up by asgi.py so parsing never runs in the serving process ---
+_ingest_pool: Optional[ProcessPoolExecutor] = None
+_ingest_workers = 0
+
+def start_ingest_pool(workers: int) -> None:
+    """Parse new uploads in `workers` processes from now on (the WSGI dev server parses in-process)."""
+    global _ingest_pool, _ingest_workers
+    if _ingest_pool is None and workers > 0:
+        # forkserver: never fork the (threaded, event-looped) server process itself
+        _ingest_pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("forkserver"))
+        _ingest_workers = workers
+
+def stop_ingest_pool() -> None:
+    global _ingest_pool
+    if _ingest_pool is not None:
+        _ingest_pool.shutdown(cancel_futures=True)
+        _ingest_pool = None
+
+def _parse_all_plans(f, facilities_map, budget: ParseBudget) -> Iterator[Dict[str, Any]]:
+    """Every person with all plans, as the plan store expects."""
+    if _ingest_pool is not None:
+        # with the ingest pool on, even a streamed parse happens in its worker processes
+        return iter_persons_parallel(f, facilities_map, selected_only=False, workers=_ingest_workers,
+                                     budget=budget, pool=_ingest_pool)
+    if PARSE_WORKERS > 1:
+        return iter_persons_parallel(f, facilities_map, selected_only=False, workers=PARSE_WORKERS,
+                                     budget=budget)
+    return iter_persons(f, facilities_map, selected_only=False, budget=budget)
+
+def _spill_upload(file_storage) -> str:
+    """Copy an upload to a named temp file a worker process can open; the caller deletes it."""
+    fd, path = tempfile.mkstemp(prefix="upload-")
+    with os.fdopen(fd, "wb") as out:
+        file_storage.stream.seek(0)
+        shutil.copyfileobj(file_storage.stream, out, 1 << 20)
+    return path
+
+def _ingest_paths(plans_path: str, facilities_path: Optional[str], facilities_key: Optional[str],
+                  run_key: str, budget: ParseBudget) -> None:
+    """Ingest-pool task: build the run's plan store from spilled upload files."""
+    facilities_map = {}
+    if facilities_path:
+        with open(facilities_path, "rb") as fh:
+            facilities_map = parse_facilities(fh, facilities_key)
+    with open_mapped(plans_path) as f:
+        plan_store.ingest(iter_persons(f, facilities_map, selected_only=False, budget=budget), run_key).close()
+
+def _build_facilities_path(path: str, facilities_key: str) -> None:
+    """Ingest-pool task: build the facility table for a spilled facilities upload."""
+    with open(path, "rb") as fh:
+        parse_facilities(fh, facilities_key)
+
+def _load_facilities(facilities_file, facilities_key: Optional[str]):
+    """parse_facilities, with a missing table built in the ingest pool when there is one."""
+    if not facilities_file:
+        return {}
+    if _ingest_pool is not None and facility_store.open_table(facilities_key) is None:
+        path = _spill_upload(facilities_file)
+        try:
+            with STAGE_SECONDS.time(stage="ingest_pool"):
+                _ingest_pool.submit(_build_facilities_path, path, facilities_key).result()
+        finally:
+            os.unlink(path)
+        cache_lookup("facilities", False)
+        return facility_store.open_table(facilities_key) or parse_facilities(facilities_file, facilities_key)
+    return parse_facilities(facilities_file, facilities_key)
+
+def _build_network_path(path: str, network_key: str) -> None:
+    """Ingest-pool task: build the network table for a spilled network upload."""
+    with open(path, "rb") as fh:
+        parse_network(fh, network_key).close()
+
+def _load_network(network_file, network_key: str) -> network_store.NetworkTable:
+    """parse_network, with a missing table built in the ingest pool when there is one."""
+    if _ingest_pool is not None and network_store.open_table(network_key) is None:
+        path = _spill_upload(network_file)
+        try:
+            with STAGE_SECONDS.time(stage="ingest_pool"):
+                _ingest_pool.submit(_build_network_path, path, network_key).result()
+        finally:
+            os.unlink(path)
+        cache_lookup("network", False)
+        return network_store.open_table(network_key) or parse_network(network_file, network_key)
+    return parse_network(network_file, network_key)
+
+def _ingest_in_pool(plans_file, facilities_file, facilities_key: Optional[str], run_key: str,
+                    budget: ParseBudget) -> plan_store.PlanStore:
+    paths = [_spill_upload(plans_file)]
+    try:
+        if facilities_file:
+            paths.append(_spill_upload(facilities_file))
+        facilities_path = paths[1] if facilities_file else None
+        # blocks this request's thread only; ParseBudgetExceeded comes back from the worker as-is
+        with STAGE_SECONDS.time(stage="ingest_pool"):
+            _ingest_pool.submit(_ingest_paths, paths[0], facilities_path, facilities_key, run_key, budget).result()
+    finally:
+        for path in paths:
+            os.unlink(path)
+    store = plan_store.open_store(run_key)
+    if store is None:
+        raise RuntimeError(f"plan store {run_key} missing after ingest")
+    run_registry.registry.committed(store)
+    return store
+
+def _open_or_ingest(plans_file, facilities_file, facilities_key: Optional[str], run_key: str,
+                    budget: ParseBudget) -> plan_store.PlanStore:
+    """
+    The run's plan store (a registry hit), parsing the upload into it first if it is new.
+    The store is on disk, so only budget's RSS limit applies to the ingest; callers apply
+    its person limit to what they answer with.
+    """
+    store = run_registry.open_run(run_key)
+    cache_lookup("plan_store", store is not None)
+    if store is None:
+        budget = budget.rss_only()
+        if _ingest_pool is not None:
+            return _ingest_in_pool(plans_file, facilities_file, facilities_key, run_key, budget)
+        facilities_map = parse_facilities(facilities_file, facilities_key) if facilities_file else {}
+        with open_mapped(plans_file) as f:
+            store = plan_store.ingest(_parse_all_plans(f, facilities_map, budget), run_key)
+        run_registry.registry.committed(store)
+    return store
+
+NDJSON_CHUNK_BYTES = 64 * 1024
+
+def _ndjson_lines(persons: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """One JSON document per line; the first person goes out alone, then ~64KB chunks."""
+    buf = []
+    size = 0
+    first = True
+    encode_sec = 0.0  # json.dumps only, recorded as stage "ndjson"
+    try:
+        for p in persons:
+            t0 = time.perf_counter()
+            line = json.dumps(p, ensure_ascii=False, separators=(",", ":")) + "\n"
+            encode_sec += time.perf_counter() - t0
+            buf.append(line)
+            size += len(line)
+            if first or size >= NDJSON_CHUNK_BYTES:
+                yield "".join(buf)
+                buf = []
+                size = 0
+                first = False
+        if buf:
+            yield "".join(buf)
+    finally:
+        STAGE_SECONDS.observe(encode_sec, stage="ndjson")
+
+def _store_persons(store: plan_store.PlanStore, max_persons: int,
+                   selected_only: bool) -> Iterator[Dict[str, Any]]:
+    """Persons straight from a plan store; the store is closed when the iteration ends."""
+    try:
+        yield from store.iter_persons(limit=max_persons, selected_only=selected_only)
+    finally:
+        store.close()
+
+def _stream_persons(plans_file, facilities_file, facilities_key: Optional[str], run_key: str,
+                    max_persons: int, selected_only: bool, budget: ParseBudget) -> Iterator[Dict[str, Any]]:
+    """
+    Persons for the NDJSON response, in file order.
+    Served from the plan store when the run is known; otherwise each person is
+    yielded as soon as it is parsed while being written to the store. The store is
+    only committed if the whole file was read (i.e. the limit did not cut it short).
+    If the parse budget is exceeded the stream ends with an {"error": ...} line.
+    Runs before the generator starts, since Flask closes request.files once the view returns.
+    """
+    store = run_registry.open_run(run_key)
+    cache_lookup("plan_store", store is not None)
+    if store is not None:
+        return _store_persons(store, max_persons, selected_only)
+
+    facilities_map = _load_facilities(facilities_file, facilities_key)
+    plans = open_mapped(plans_file)  # the mapping outlives request.files
+
+    def from_xml() -> Iterator[Dict[str, Any]]:
+        sent = 0
+        with plan_store.StoreWriter(run_key) as writer, plans as f:
+            try:
+                for person in _parse_all_plans(f, facilities_map, budget):
+                    if sent >= max_persons:
+                        return  # writer aborts on exit; a later full read builds the store
+                    writer.add(person)
+                    yield output_person(person, selected_only)
+                    sent += 1
+            except ParseBudgetExceeded as e:
+                yield {"error": str(e)}
+                return
+            store = writer.commit()
+            run_registry.registry.committed(store)
+            store.close()
+    return from_xml()
+
+def _preview_persons(plans_file, facilities_file, facilities_key: Optional[str], run_key: str,
+                     max_persons: int, selected_only: bool,
+                     budget: ParseBudget) -> Tuple[List[Dict[str, Any]], Optional[Job]]:
+    """
+    Persons for the JSON response and the ingest job building the run's store, if one was started.
+    A stored run is read from its columns. A new one is answered from a parse that stops after
+    max_persons, while an ingest job parses the whole upload into the store in the background;
+    the budget applies to the answer, not to that ingest.
+    """
+    store = run_registry.open_run(run_key)
+    cache_lookup("plan_store", store is not None)
+    if store is not None:
+        try:
+            return list(within_budget(store.iter_persons(limit=max_persons, selected_only=selected_only),
+                                      budget)), None
+        finally:
+            store.close()
+
+    facilities_map = _load_facilities(facilities_file, facilities_key)  # built once, shared with the job
+    job = _ingest_in_background(run_key, plans_file, facilities_file)
+    persons: List[Dict[str, Any]] = []
+    if max_persons <= 0:
+        return persons, job
+    with open_mapped(plans_file) as f, closing(_parse_all_plans(f, facilities_map, budget)) as parsed:
+        for person in parsed:
+            persons.append(output_person(person, selected_only))
+            if len(persons) >= max_persons:
+                break
+    return persons, job
+
+def _wants_msgpack(response_format: str) -> bool:
+    """format=msgpack, or an Accept header preferring application/x-msgpack over JSON."""
+    if response_format == "msgpack":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+def _msgpack_persons(store: plan_store.PlanStore, max_persons: int, selected_only: bool,
+                     budget: ParseBudget) -> Response:
+    """The first max_persons persons as plan_columns' msgpack column layout."""
+    budget.check(min(len(store), max(0, max_persons)))
+    with STAGE_SECONDS.time(stage="msgpack"):
+        body = encode_msgpack(store, 0, max_persons, selected_only)
+    resp = Response(body, mimetype=MSGPACK_MIMETYPE)
+    resp.headers["Vary"] = "Accept"
+    return resp
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     # Query params to tame payload size
@@ -130,6 +412,7 @@ def upload_file():
         max_persons = 200
 
     selected_only_flag = request.args.get("selected_only", "true").lower() != "false"
+    response_format = request.args.get("format", "json").lower()
 
     plans_file = request.files.get("file")
     if not plans_file:
@@ -137,178 +420,543 @@ def upload_file():
 
     # optional facilities file for enriching coordinates
     facilities_file = request.files.get("facilities")
-    facilities_map = parse_facilities(facilities_file) if facilities_file else {}
-
-    with open_maybe_gzip(plans_file) as f:
-        context = ET.iterparse(f, events=("start", "end"))
-
-        persons: List[Dict[str, Any]] = []
-        current_person: Optional[Dict[str, Any]] = None
-
-        inside_plan = False
-        plan_selected_flag = False
-        plan_matsim_score: Optional[float] = None
-
-        steps: List[Dict[str, Any]] = []
-        last_open_activity_idx: Optional[int] = None
-        current_time: Optional[str] = None
-        last_leg_arrival: Optional[str] = None
-
-        for event, elem in context:
-            tag = elem.tag
-
-            if event == "start":
-                if tag == "person":
-                    current_person = {"personId": elem.attrib.get("id"), "plans": []}
-
-                elif tag == "plan" and current_person is not None:
-                    inside_plan = True
-                    plan_selected_flag = (elem.attrib.get("selected") == "yes")
-                    plan_matsim_score = safe_float(elem.attrib.get("score"))
-
-                    steps = []
-                    last_open_activity_idx = None
-                    current_time = None
-                    last_leg_arrival = None
-
-                elif inside_plan and tag in ("act", "activity") and current_person is not None:
-                    act_type = elem.attrib.get("type")
-                    start_time = elem.attrib.get("start_time")
-                    end_time = elem.attrib.get("end_time")
-                    max_dur = elem.attrib.get("max_dur")
-
-                    facility_id = elem.attrib.get("facility")
-                    x = elem.attrib.get("x")
-                    y = elem.attrib.get("y")
-                    if (x is None or y is None) and facility_id and facilities_map:
-                        xy = facilities_map.get(facility_id)
-                        if xy:
-                            x, y = xy  # tuple(float, float)
-
-                    st = start_time or current_time or "00:00:00"
-
-                    step: Dict[str, Any] = {
-                        "kind": "activity",
-                        "type": act_type,
-                        "startTime": st,
-                        "endTime": end_time,
-                        "x": float(x) if x not in (None, "") else None,
-                        "y": float(y) if y not in (None, "") else None,
-                        "durationSec": None
-                    }
-                    steps.append(step)
-                    last_open_activity_idx = len(steps) - 1
-
-                    if end_time:
-                        current_time = end_time
-                    elif max_dur:
-                        st_s = parse_time_to_seconds(st)
-                        md_s = parse_time_to_seconds(max_dur)
-                        if st_s is not None and md_s is not None:
-                            et_s = st_s + md_s
-                            step["endTime"] = sec_to_time(et_s)
-                            current_time = step["endTime"]
-
-                elif inside_plan and tag == "leg" and current_person is not None:
-                    mode = elem.attrib.get("mode")
-                    dep_time = elem.attrib.get("dep_time") or elem.attrib.get("depTime")
-                    trav_time = elem.attrib.get("trav_time") or elem.attrib.get("travTime")
-
-                    if last_open_activity_idx is not None and dep_time:
-                        prev_act = steps[last_open_activity_idx]
-                        if prev_act.get("endTime") in (None, ""):
-                            prev_act["endTime"] = dep_time
-
-                    dt = dep_time or current_time or "00:00:00"
-
-                    step = {
-                        "kind": "leg",
-                        "mode": mode,
-                        "depTime": dt,
-                        "travelTime": trav_time,
-                        "durationSec": None
-                    }
-                    steps.append(step)
-
-                    dep_s = parse_time_to_seconds(dt)
-                    tt_s = parse_time_to_seconds(trav_time) if trav_time else None
-                    if dep_s is not None and tt_s is not None:
-                        arr_s = dep_s + tt_s
-                        last_leg_arrival = sec_to_time(arr_s)
-                        current_time = last_leg_arrival
-
-            elif event == "end":
-                if tag == "plan" and inside_plan:
-                    # finalize durations
-                    for i, s in enumerate(steps):
-                        if s["kind"] == "activity":
-                            st_s = parse_time_to_seconds(s.get("startTime"))
-                            et = s.get("endTime")
-                            if et is None:
-                                found: Optional[str] = None
-                                for j in range(i + 1, len(steps)):
-                                    n = steps[j]
-                                    if n["kind"] == "leg" and n.get("depTime"):
-                                        found = n.get("depTime")
-                                        break
-                                    if n["kind"] == "activity" and n.get("startTime"):
-                                        found = n.get("startTime")
-                                        break
-                                if found:
-                                    s["endTime"] = found
-                                elif last_leg_arrival:
-                                    s["endTime"] = last_leg_arrival
-
-                            et_s = parse_time_to_seconds(s.get("endTime"))
-                            s["durationSec"] = (et_s - st_s) if (st_s is not None and et_s is not None) else None
-                        else:
-                            tt_s = parse_time_to_seconds(s.get("travelTime"))
-                            s["durationSec"] = tt_s if tt_s is not None else None
-
-                    server_score = score_plan(steps, DEFAULT_WEIGHTS)
-
-                    if current_person is not None:
-                        plan_obj = {
-                            "selected": plan_selected_flag,
-                            "matsimScore": plan_matsim_score,
-                            "serverScore": server_score,
-                            "steps": steps
-                        }
-                        current_person["plans"].append(plan_obj)
-
-                    inside_plan = False
-                    plan_selected_flag = False
-                    plan_matsim_score = None
-                    steps = []
-                    last_open_activity_idx = None
-                    current_time = None
-                    last_leg_arrival = None
-
-                elif tag == "person" and current_person is not None:
-                    # prefer selected plan index
-                    sel_idx = 0
-                    for i, pl in enumerate(current_person["plans"]):
-                        if pl.get("selected"):
-                            sel_idx = i
-                            break
-                    current_person["selectedPlanIndex"] = sel_idx
-
-                    # keep only the selected plan to shrink payload if requested
-                    if selected_only_flag and current_person["plans"]:
-                        current_person["plans"] = [current_person["plans"][sel_idx]]
-
-                    # only append persons that actually have plans
-                    if current_person["plans"]:
-                        persons.append(current_person)
-
-                    current_person = None
-                    elem.clear()
-
-                    # stop once we hit the limit
-                    if len(persons) >= max_persons:
-                        break
-
-        return jsonify(persons)
+
+    # parse each distinct (plans, facilities) upload once; later requests read the columnar store
+    facilities_key = plan_store.content_key(facilities_file.stream) if facilities_file else None
+    run_key = plan_store.run_key(plan_store.content_key(plans_file.stream), facilities_key)
+
+    # $PLAN_MAX_RSS_MB / $PLAN_MAX_PERSONS: abort instead of letting a huge file or limit OOM the worker
+    budget = ParseBudget.from_env()
+
+    if response_format == "ndjson":
+        persons = _stream_persons(plans_file, facilities_file, facilities_key, run_key,
+                                  max_persons, selected_only_flag, budget)
+        resp = Response(stream_with_context(_ndjson_lines(persons)), mimetype="application/x-ndjson")
+        resp.headers["X-Run-Key"] = run_key  # for /runs/<key>/... once the whole file was read
+        return resp
+
+    if not _wants_msgpack(response_format):
+        try:
+            persons, job = _preview_persons(plans_file, facilities_file, facilities_key, run_key,
+                                            max_persons, selected_only_flag, budget)
+        except ParseBudgetExceeded as e:
+            return jsonify({"error": str(e)}), 413
+        resp = jsonify(persons)
+        resp.headers["X-Run-Key"] = run_key
+        if job is not None:
+            resp.headers["X-Ingest-Job"] = job.id  # GET /jobs/<id>: the run is stored once it is done
+        return resp
+
+    # the msgpack column layout is encoded from the store, so a new run is ingested first
+    try:
+        store = _open_or_ingest(plans_file, facilities_file, facilities_key, run_key, budget)
+        try:
+            resp = _msgpack_persons(store, max_persons, selected_only_flag, budget)
+        finally:
+            store.close()
+    except ParseBudgetExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    resp.headers["X-Run-Key"] = run_key
+    return resp
+
+# ---- background ingest jobs ----
+# $INGEST_JOB_WORKERS parses at a time (default: CPUs / parse workers), $INGEST_JOB_QUEUE more may wait
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // max(1, PARSE_WORKERS))
+INGEST_JOB_QUEUE = int(os.getenv("INGEST_JOB_QUEUE", "16"))
+ingest_jobs = JobQueue(INGEST_JOB_WORKERS, INGEST_JOB_QUEUE)
+
+def _ingest_job(job: Job, plans_path: str, facilities_path: Optional[str]) -> str:
+    """Job body: hash the spilled upload(s) and parse the plans into the plan store. Returns the run key."""
+    try:
+        facilities_key = None
+        facilities_map = {}
+        if facilities_path:
+            job.phase = "facilities"
+            with open(facilities_path, "rb") as fh:
+                facilities_key = plan_store.content_key(fh)
+                facilities_map = parse_facilities(fh, facilities_key)
+        with open(plans_path, "rb") as raw:
+            job.phase = "hashing"
+            run_key = plan_store.run_key(plan_store.content_key(raw), facilities_key)
+            store = run_registry.open_run(run_key)
+            cache_lookup("plan_store", store is not None)
+            if store is None:
+                job.phase = "parsing"
+                with open_mapped(raw) as f:
+                    persons = _parse_all_plans(f, facilities_map, ParseBudget.from_env().rss_only())
+                    store = plan_store.ingest(job.track(persons, f), run_key)
+                run_registry.registry.committed(store)
+        job.persons = len(store)
+        job.bytes_read = job.bytes_total
+        store.close()
+        job.phase = None
+        return run_key
+    finally:
+        os.unlink(plans_path)
+        if facilities_path:
+            os.unlink(facilities_path)
+
+def _submit_ingest(plans_file, facilities_file) -> Job:
+    """Spill the upload(s) and queue an ingest job for them; QueueFull when the queue is."""
+    plans_path = _spill_upload(plans_file)
+    facilities_path = _spill_upload(facilities_file) if facilities_file else None
+    job = Job(bytes_total=os.path.getsize(plans_path))
+    try:
+        return ingest_jobs.submit(job, _ingest_job, plans_path, facilities_path)
+    except QueueFull:
+        os.unlink(plans_path)
+        if facilities_path:
+            os.unlink(facilities_path)
+        raise
+
+# run key -> the job ingesting it, so concurrent first uploads of one run share a parse
+_background_ingests: Dict[str, Job] = {}
+_background_lock = threading.Lock()
+
+def _ingest_in_background(run_key: str, plans_file, facilities_file) -> Optional[Job]:
+    """The job storing a new run, started unless one already is; None when the queue is full."""
+    with _background_lock:
+        job = _background_ingests.get(run_key)
+        if job is not None and job.status in ("queued", "running"):
+            return job
+        try:
+            job = _submit_ingest(plans_file, facilities_file)
+        except QueueFull as e:
+            app.logger.info("run %s not stored this time: %s", run_key[:12], e)  # the next upload retries
+            _background_ingests.pop(run_key, None)
+            return None
+        _background_ingests[run_key] = job
+        for key in [k for k, j in _background_ingests.items() if j.status in ("done", "error")]:
+            del _background_ingests[key]
+        return job
+
+def _job_view(job: Job) -> Dict[str, Any]:
+    out = job.to_dict()
+    out["runKey"] = job.result
+    out["result"] = f"/jobs/{job.id}/result" if job.status == "done" else None
+    return out
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Same multipart body as /upload (file, optional facilities), but answers 202 with
+    a job id right away; poll GET /jobs/<id> for progress, then read
+    GET /jobs/<id>/result. 503 when every ingest worker is busy and the queue is full.
+    """
+    plans_file = request.files.get("file")
+    if not plans_file:
+        return jsonify({"error": "No file uploaded"}), 400
+    facilities_file = request.files.get("facilities")
+
+    try:
+        job = _submit_ingest(plans_file, facilities_file)
+    except QueueFull as e:
+        resp = jsonify({"error": str(e)})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+    resp = jsonify(_job_view(job))
+    resp.headers["Location"] = f"/jobs/{job.id}"
+    return resp, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str):
+    """{status, phase, bytesRead, bytesTotal, persons, personsPerSec, elapsedSec, error, runKey, result}"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(_job_view(job))
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id: str):
+    """The finished job's persons, with /upload's limit, selected_only and format (or Accept) params."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    if job.status != "done":
+        return jsonify(_job_view(job)), 409
+    store = run_registry.open_run(job.result)
+    if store is None:
+        return jsonify({"error": "run no longer stored"}), 410
+
+    try:
+        max_persons = int(request.args.get("limit", "200"))
+    except Exception:
+        max_persons = 200
+    selected_only_flag = request.args.get("selected_only", "true").lower() != "false"
+    response_format = request.args.get("format", "json").lower()
+
+    if response_format != "ndjson" and _wants_msgpack(response_format):
+        try:
+            return _msgpack_persons(store, max_persons, selected_only_flag, ParseBudget.from_env())
+        except ParseBudgetExceeded as e:
+            return jsonify({"error": str(e)}), 413
+        finally:
+            store.close()
+    persons = _store_persons(store, max_persons, selected_only_flag)
+    if response_format == "ndjson":
+        return Response(stream_with_context(_ndjson_lines(persons)), mimetype="application/x-ndjson")
+    try:
+        return jsonify(list(within_budget(persons, ParseBudget.from_env())))
+    except ParseBudgetExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    finally:
+        persons.close()
+
+@app.route("/aggregate", methods=["POST"])
+def aggregate_file():
+    """
+    Whole-population summaries (mode share, travel minutes, activity counts,
+    departure histograms, serverScore distribution) for the same multipart
+    upload as /upload. Query: selected_only (default true), score_bins (default 20).
+    """
+    selected_only_flag = request.args.get("selected_only", "true").lower() != "false"
+    try:
+        score_bins = min(200, max(1, int(request.args.get("score_bins", "20"))))
+    except Exception:
+        score_bins = 20
+
+    plans_file = request.files.get("file")
+    if not plans_file:
+        return jsonify({"error": "No file uploaded"}), 400
+    facilities_file = request.files.get("facilities")
+
+    facilities_key = plan_store.content_key(facilities_file.stream) if facilities_file else None
+    run_key = plan_store.run_key(plan_store.content_key(plans_file.stream), facilities_key)
+
+    try:
+        store = _open_or_ingest(plans_file, facilities_file, facilities_key, run_key, ParseBudget.from_env())
+    except ParseBudgetExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    try:
+        resp = jsonify(cached_aggregate(store, selected_only_flag, score_bins))
+        resp.headers["X-Run-Key"] = run_key
+        return resp
+    finally:
+        store.close()
+
+# ---- query API over an ingested run (run key: X-Run-Key header of /upload, or a job's runKey) ----
+_RUN_KEY = re.compile(r"^[0-9a-f]{64}$")
+QUERY_MAX_LIMIT = 1000
+
+def _open_run(run_key: str) -> Optional[plan_store.PlanStore]:
+    return run_registry.open_run(run_key) if _RUN_KEY.match(run_key) else None
+
+def _list_arg(name: str) -> list:
+    """?mode=pt,walk and ?mode=pt&mode=walk both give ["pt", "walk"]."""
+    return [v for raw in request.args.getlist(name) for v in raw.split(",") if v]
+
+def _person_filter(selected_only: bool) -> PersonFilter:
+    """PersonFilter from the query string; ValueError on a malformed number or time."""
+    def score(name: str) -> Optional[float]:
+        raw = request.args.get(name)
+        return None if raw in (None, "") else float(raw)
+
+    def clock(name: str) -> Optional[int]:
+        raw = request.args.get(name)
+        if raw in (None, ""):
+            return None
+        sec = parse_time_to_seconds(raw)
+        if sec is None:
+            raise ValueError(f"{name}: expected H:MM[:SS]")
+        return sec
+
+    return PersonFilter(
+        modes=_list_arg("mode"),
+        activities=_list_arg("activity"),
+        min_score=score("minScore"),
+        max_score=score("maxScore"),
+        t_from=clock("from"),
+        t_to=clock("to"),
+        selected_only=selected_only,
+    )
+
+@app.route("/runs", methods=["GET"])
+def list_runs():
+    """Runs in the registry (most recently used first) and the disk budget they share (see run_registry)."""
+    runs = run_registry.registry.runs()
+    return jsonify({
+        "runs": runs,
+        "bytes": sum(r["bytes"] for r in runs),
+        "budgetBytes": int(run_registry.registry.max_bytes) or None,
+    })
+
+@app.route("/runs/<run_key>/persons", methods=["GET"])
+def query_persons(run_key: str):
+    """
+    One page of a run's persons, in file order.
+    Query: cursor (from the previous page's nextCursor), limit (default 100, max 1000),
+    selected_only, mode, activity (comma-separated or repeated; any of), minScore,
+    maxScore (serverScore), from, to (H:MM[:SS] window a matching step must overlap).
+    Returns {"persons": [...], "nextCursor": str | null}. A page may hold fewer than
+    `limit` persons while nextCursor is set: each page scans a bounded number of rows.
+    """
+    store = _open_run(run_key)
+    if store is None:
+        return jsonify({"error": "unknown run"}), 404
+    try:
+        selected_only_flag = request.args.get("selected_only", "true").lower() != "false"
+        try:
+            cursor = int(request.args.get("cursor") or 0)
+            limit = min(QUERY_MAX_LIMIT, max(1, int(request.args.get("limit", "100"))))
+            f = _person_filter(selected_only_flag)
+        except ValueError as e:
+            return jsonify({"error": f"bad query: {e}"}), 400
+        rows, next_row = query_rows(store, f, cursor, limit)
+        return jsonify({
+            "persons": [store.person(i, selected_only=selected_only_flag) for i in rows],
+            "nextCursor": None if next_row is None else str(next_row),
+        })
+    finally:
+        store.close()
+
+@app.route("/runs/<run_key>/persons/<path:person_id>", methods=["GET"])
+def get_person(run_key: str, person_id: str):
+    """One person by id (all plans unless selected_only=true)."""
+    store = _open_run(run_key)
+    if store is None:
+        return jsonify({"error": "unknown run"}), 404
+    try:
+        row = store.find(person_id)
+        if row < 0:
+            return jsonify({"error": "unknown person"}), 404
+        selected_only_flag = request.args.get("selected_only", "false").lower() != "false"
+        return jsonify(store.person(row, selected_only=selected_only_flag))
+    finally:
+        store.close()
+
+@app.route("/runs/<run_key>/activities", methods=["GET"])
+def query_activities_in_view(run_key: str):
+    """
+    Selected-plan activities inside a map view.
+    Query: bbox=minX,minY,maxX,maxY (in the run's x/y CRS), zoom (Leaflet zoom),
+    maxPoints (default ACTIVITY_MAX_POINTS). Returns the points when at most maxPoints
+    are in view, otherwise clusters sized for the zoom (see plan_spatial).
+    """
+    store = _open_run(run_key)
+    if store is None:
+        return jsonify({"error": "unknown run"}), 404
+    try:
+        try:
+            bbox = tuple(float(v) for v in request.args.get("bbox", "").split(","))
+            if len(bbox) != 4 or not all(v == v for v in bbox) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                raise ValueError("bbox: expected minX,minY,maxX,maxY")
+            zoom = min(30.0, max(0.0, float(request.args.get("zoom", "12"))))
+            max_points = min(ACTIVITY_MAX_POINTS, max(0, int(request.args.get("maxPoints", ACTIVITY_MAX_POINTS))))
+        except ValueError as e:
+            return jsonify({"error": f"bad query: {e}"}), 400
+        return jsonify(query_activities(store, bbox, zoom, max_points))
+    finally:
+        store.close()
+
+@app.route("/runs/<run_key>/rescore", methods=["POST"])
+def rescore_run(run_key: str):
+    """
+    serverScores of a stored run under new weights, without re-parsing (see rescore).
+    Body: {"weights": {"act": {...}, "leg": {...}}} or a list of up to RESCORE_MAX_SETS such
+    sets, each laid over DEFAULT_WEIGHTS. Query: cursor, limit (default 0, max 1000) for
+    per-person selected-plan scores. Returns {"results": [...]}, one entry per weight set.
+    """
+    # NumPy is imported on the first rescore, not at startup
+    from rescore import RESCORE_MAX_SETS, WeightsError, merge_weights, rescore_store
+
+    store = _open_run(run_key)
+    if store is None:
+        return jsonify({"error": "unknown run"}), 404
+    try:
+        data = request.get_json(silent=True) or {}
+        raw = data.get("weights") if isinstance(data, dict) else None
+        raw_sets = raw if isinstance(raw, list) else [raw or {}]
+        try:
+            if not 1 <= len(raw_sets) <= RESCORE_MAX_SETS:
+                raise WeightsError(f"between 1 and {RESCORE_MAX_SETS} weight sets")
+            weight_sets = [merge_weights(w) for w in raw_sets]
+            cursor = max(0, int(request.args.get("cursor") or 0))
+            limit = min(QUERY_MAX_LIMIT, max(0, int(request.args.get("limit", "0"))))
+        except ValueError as e:
+            return jsonify({"error": f"bad request: {e}"}), 400
+        return jsonify({"results": rescore_store(store, weight_sets, cursor, limit)})
+    finally:
+        store.close()
+
+# ---- baseline vs scenario (see compare) ----
+@app.route("/compare", methods=["GET", "POST"])
+def compare_runs():
+    """
+    Per-person and population deltas (main mode, travel time, serverScore) between two runs.
+    POST: multipart "baseline" and "scenario" plans files (each parsed once, as for /upload).
+    GET: ?baseline=<runKey>&scenario=<runKey> for runs already ingested.
+    Query: limit (per-person deltas returned, default 200, max 1000), changed_only (default true).
+    """
+    changed_only = request.args.get("changed_only", "true").lower() != "false"
+    try:
+        limit = min(QUERY_MAX_LIMIT, max(0, int(request.args.get("limit", "200"))))
+    except ValueError:
+        limit = 200
+
+    stores = []
+    try:
+        if request.method == "GET":
+            for name in ("baseline", "scenario"):
+                store = _open_run(request.args.get(name, ""))
+                if store is None:
+                    return jsonify({"error": f"unknown {name} run"}), 404
+                stores.append(store)
+        else:
+            files = [request.files.get("baseline"), request.files.get("scenario")]
+            if not all(files):
+                return jsonify({"error": "baseline and scenario files are both required"}), 400
+            for f in files:
+                key = plan_store.content_key(f.stream)
+                stores.append(_open_or_ingest(f, None, None, key, ParseBudget.from_env()))
+        base, scen = stores
+        result = compare_stores(base, scen, limit, changed_only)
+        result["baselineKey"] = base.meta["key"]
+        result["scenarioKey"] = scen.meta["key"]
+        return jsonify(result)
+    except ParseBudgetExceeded as e:
+        return jsonify({"error": str(e)}), 413
+    finally:
+        for store in stores:
+            store.close()
+
+# ---- pre-rendered map layer tiles (see layer_tiles) ----
+_TILE_VERSION = re.compile(r"^[0-9a-f]{16}$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # for URLs that carry a content hash
+
+def _gzip_json(body: bytes, etag: str, cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Response:
+    """Pre-gzipped JSON as stored (inflated for clients without gzip), with an ETag for conditional GETs."""
+    if "gzip" in request.accept_encodings:
+        resp = Response(body, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(gzip.decompress(body), mimetype="application/json")
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = cache_control
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
+
+@app.route("/tiles", methods=["GET"])
+def list_tile_layers():
+    return jsonify({"layers": sorted(layer_tiles.layer_sources())})
+
+# one worker: a build is CPU-bound Python, and must not take an ingest slot
+tile_jobs = JobQueue(1, 16)
+_tile_builds: Dict[str, Job] = {}  # "<layer>/<version>" -> its build
+_tile_builds_lock = threading.Lock()
+
+def _tile_job(job: Job, layer: str, source: str, version: str) -> str:
+    job.phase = "tiles"
+    layer_tiles.ensure_built(layer, source, version)
+    job.phase = None
+    return version
+
+def _build_tiles_in_background(layer: str, source: str, version: str) -> Optional[Job]:
+    """The job building that tile version, queued unless one already is; None when the queue is full."""
+    key = f"{layer}/{version}"
+    with _tile_builds_lock:
+        job = _tile_builds.get(key)
+        if job is not None:
+            return job  # an error is kept too: the same source would fail the same way
+        try:
+            job = _tile_builds[key] = tile_jobs.submit(Job(), _tile_job, layer, source, version)
+        except QueueFull as e:
+            app.logger.info("tiles for %s not queued: %s", layer, e)
+            return None
+        return job
+
+def prebuild_tile_layers() -> None:
+    """Queue a build for every layer whose current tiles are missing (at startup; returns at once)."""
+    for layer in layer_tiles.layer_sources():
+        try:
+            current = layer_tiles.current_layer(layer)
+        except OSError as e:
+            app.logger.warning("tiles for %s: %s", layer, e)
+            continue
+        if current is not None and layer_tiles.built_meta(layer, current[1]) is None:
+            _build_tiles_in_background(layer, *current)
+
+@app.route("/tiles/<layer>.json", methods=["GET"])
+def tile_layer_meta(layer: str):
+    """
+    Current version, zoom range and bounds of a layer, plus its tile URL template and
+    the URL of its properties (a list indexed by the tiles' feature ids).
+    Revalidated on every use (no-cache + ETag), so a changed source file shows up at once.
+    While that version's tiles are still being built: 503 with Retry-After.
+    """
+    try:
+        current = layer_tiles.current_layer(layer)
+        meta = current and layer_tiles.built_meta(layer, current[1])
+    except (OSError, ValueError) as e:
+        return jsonify({"error": f"layer {layer}: {e}"}), 500
+    if current is None:
+        return jsonify({"error": "unknown layer"}), 404
+    if meta is None:
+        job = _build_tiles_in_background(layer, *current)
+        if job is not None and job.status == "error":
+            return jsonify({"error": f"layer {layer}: {job.error}"}), 500
+        resp = jsonify({"error": f"layer {layer} is being built", "status": job.status if job else "queued"})
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+    base = f"/tiles/{layer}/{meta['version']}"
+    resp = jsonify(dict(meta, url=base + "/{z}/{x}/{y}.json", properties=base + "/properties.json"))
+    resp.set_etag(meta["version"])
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+@app.route("/tiles/<layer>/<version>/properties.json", methods=["GET"])
+def get_tile_properties(layer: str, version: str):
+    """Every feature's properties of one layer version, as a list indexed by feature id."""
+    body = layer_tiles.read_properties(layer, version) if (
+        _TILE_VERSION.match(version) and layer in layer_tiles.layer_sources()) else None
+    if body is None:
+        return jsonify({"error": "unknown layer version"}), 404
+    return _gzip_json(body, f"{version}-properties")
+
+@app.route("/tiles/<layer>/<version>/<int:z>/<int:x>/<int:y>.json", methods=["GET"])
+def get_tile(layer: str, version: str, z: int, x: int, y: int):
+    """One GeoJSON tile, sent gzip-encoded as stored (or inflated for clients without gzip)."""
+    body = layer_tiles.read_tile(layer, version, z, x, y) if (
+        _TILE_VERSION.match(version) and layer in layer_tiles.layer_sources()) else None
+    if body is None:
+        return jsonify({"error": "unknown layer version"}), 404
+    return _gzip_json(body, f"{version}-{z}-{x}-{y}")
+
+# ---- MATSim network: transit routes, cached per network file (see network_store) ----
+@app.route("/network/routes", methods=["POST"])
+def network_routes_upload():
+    """
+    Upload a network XML (.xml/.xml.gz, field "network" or "file") and get the links
+    allowing ?mode= (default bus) as simplified GeoJSON lines in the network's CRS.
+    X-Network-Key names the cached table for GET /network/<key>/routes next time.
+    """
+    f = request.files.get("network") or request.files.get("file")
+    if not f:
+        return jsonify({"error": "No network file"}), 400
+    key = plan_store.content_key(f.stream)
+    try:
+        table = _load_network(f, key)
+    except ET.ParseError as e:
+        return jsonify({"error": f"bad network XML: {e}"}), 400
+    return _network_routes(table, key)
+
+@app.route("/network/<network_key>/routes", methods=["GET"])
+def network_routes(network_key: str):
+    table = network_store.open_table(network_key) if _RUN_KEY.match(network_key) else None
+    if table is None:
+        return jsonify({"error": "unknown network"}), 404
+    return _network_routes(table, network_key)
+
+def _network_routes(table: network_store.NetworkTable, key: str) -> Response:
+    mode = request.args.get("mode", "bus")
+    try:
+        body = table.routes_gzip(mode)
+        etag = table.routes_version(mode)
+    finally:
+        table.close()
+    resp = _gzip_json(body, etag)
+    resp.headers["X-Network-Key"] = key
+    return resp
 
 if __name__ == "__main__":
+    prebuild_tile_layers()
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -1,13 +1,22 @@
 # story_api.py
+import asyncio
 import os
 import json
 import logging
 import re
+import threading
+import time
 from typing import Any, Dict, List, Tuple, Optional
 from collections import Counter, defaultdict
 
-from flask import Blueprint, request, jsonify
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+
+# shared, memoized H:MM[:SS] parser (same rules as the plan parser)
+from matsim_time import parse_time_to_seconds as _parse_matsim_time_to_sec
+from metrics import LLM_SECONDS, LLM_TOKENS
+from story_cache import StoryCache, story_key
 
 # --- logging setup ---
 _LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -21,11 +30,40 @@ DEFAULT_WEIGHTS: Dict[str, Dict[str, float]] = {
     "leg": {"car": -2.0, "walk": 0.5, "pt": 0.1, "__other__": 0.0},
 }
 
-client = OpenAI()
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
+# /story/batch limits
+STORY_BATCH_MAX_ITEMS = int(os.getenv("STORY_BATCH_MAX_ITEMS", "1000"))
+STORY_BATCH_CONCURRENCY = int(os.getenv("STORY_BATCH_CONCURRENCY", "8"))
+STORY_BATCH_MAX_CONCURRENCY = int(os.getenv("STORY_BATCH_MAX_CONCURRENCY", "32"))
+
 story_bp = Blueprint("story_bp", __name__)
 
+# responses keyed on the summarized plan (see story_cache); $STORY_CACHE_DB adds a SQLite tier
+story_cache = StoryCache()
+
+# ---------------- OpenAI clients ----------------
+# Built on the first LLM call, not at import: importing openai is most of the server's
+# startup time, and plan-only deployments run without $OPENAI_API_KEY.
+_client_lock = threading.Lock()
+
+def _openai_client(name: str) -> Any:
+    """The shared `client` (OpenAI) or `async_client` (AsyncOpenAI, for asgi.py), created once."""
+    c = globals().get(name)
+    if c is None:
+        with _client_lock:
+            c = globals().get(name)
+            if c is None:
+                from openai import AsyncOpenAI, OpenAI
+                c = globals()[name] = OpenAI() if name == "client" else AsyncOpenAI()
+    return c
+
+def __getattr__(name: str) -> Any:
+    # story_api.client / story_api.async_client keep working as module attributes
+    if name in ("client", "async_client"):
+        return _openai_client(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # ---------------- utilities ----------------
 
 def _sec(x: Any) -> int:
@@ -34,23 +72,6 @@ def _sec(x: Any) -> int:
     except Exception:
         return 0
 
-def _parse_matsim_time_to_sec(s: Any) -> Optional[int]:
-    """Accepts H:MM[:SS] where H may be >= 0 (MATSim allows >24h). -> seconds or None."""
-    if not isinstance(s, str) or not s:
-        return None
-    try:
-        parts = s.split(":")
-        if not (1 <= len(parts) <= 3):
-            return None
-        h = int(parts[0])
-        m = int(parts[1]) if len(parts) >= 2 else 0
-        sec = int(parts[2]) if len(parts) == 3 else 0
-        if not (0 <= m < 60 and 0 <= sec < 60 and h >= 0):
-            return None
-        return h * 3600 + m * 60 + sec
-    except Exception:
-        return None
-
 def _display_time_hhmm(total_sec: int) -> str:
     """If <24h: HH:MM, else: 翌HH:MM (next-day clock)."""
     day = 24 * 3600
@@ -235,130 +256,159 @@ def _validate_payload(obj: Dict[str, Any]) -> Dict[str, str]:
     bubble = _sanitize_inline(bubble)
     return {"title": title, "one_liner": one_liner, "bubble": bubble}
 
-# ---------------- route ----------------
+# ---------------- story pipeline ----------------
 
-@story_bp.route("/story", methods=["POST"])
-def generate_story():
-    """
-    Body: {
-      "personId": str,
-      "plan": { "steps": [...] },   # ONE plan (already chosen)
-      "weights": { "act": {...}, "leg": {...} },  # optional
-      "lang": "ja" | "en"                         # optional
-    }
-    Returns: { "title": str, "one_liner": str, "bubble": str }
-    """
-    data = request.get_json(force=True) or {}
-    person_id = data.get("personId")
-    plan = data.get("plan") or {}
-    steps = plan.get("steps") or []
-    weights = data.get("weights") or DEFAULT_WEIGHTS
-    lang = (data.get("lang") or "ja").lower()
+def _prepare_story(person_id: Any, steps: List[Dict[str, Any]], weights: Any, lang: str) -> Dict[str, Any]:
+    """Summarize one plan and build the LLM request + cache key for it (no network I/O)."""
     sys_lang = "Japanese" if lang == "ja" else "English"
-
-    if not person_id or not isinstance(steps, list) or not steps:
-        return jsonify({"error": "invalid payload"}), 400
-
     lines, stats = _summarize_plan(steps, cap=60)
     approved_facts = _safe_facts(stats)
     must_use = _core_facts(stats, approved_facts)  # 2–4 prioritized facts
 
-    try:
-        # ---- Build request payload for the LLM ----
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You write short, concrete, optimistic day-in-the-life blurbs "
-                    "grounded ONLY in the given simulation data. "
-                    f"Language: {sys_lang}. Audience: general public. "
-                    "Style: concise but vivid, time-anchored. Do not use line breaks. "
-                    "Do not introduce numeric values (times, counts, minutes) that are not listed as MUST-USE facts."
-                ),
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"personId: {person_id}\n"
-                    f"Weights(act/leg): {json.dumps(weights, ensure_ascii=False)}\n\n"
-                    "Chronology sample:\n" + "\n".join(lines) + "\n\n"
-                    "Aggregated stats (JSON):\n" + json.dumps(stats, ensure_ascii=False) + "\n\n"
-                    "APPROVED facts (for 'bubble' enum):\n- " + "\n- ".join(approved_facts) + "\n\n"
-                    "MUST-USE facts for 'one_liner' (include AT LEAST TWO; use numbers/times VERBATIM):\n- " + "\n- ".join(must_use) + "\n\n"
-                    "Task: Return JSON {title, one_liner, bubble} only.\n"
-                    "- title ≤20 chars, punchy and neutral.\n"
-                    "- one_liner: 2–3 sentences, 80–200 chars, NO line breaks. "
-                    "Weave at least TWO of the MUST-USE facts naturally (use numbers/times exactly as written).\n"
-                    "- bubble: pick EXACTLY one from APPROVED facts.\n"
-                ),
-            },
-        ]
-
-        response_format = {
-            "type": "json_schema",
-            "json_schema": {
-                "name": "story_payload",
-                "strict": True,
-                "schema": {
-                    "type": "object",
-                    "additionalProperties": False,
-                    "properties": {
-                        "title": {
-                            "type": "string",
-                            "maxLength": 20,
-                            "pattern": r"^[^\n\r\t]{1,20}$"
-                        },
-                        "one_liner": {
-                            "type": "string",
-                            "maxLength": 200,
-                            "pattern": r"^[^\n\r\t]{80,200}$"
-                        },
-                        "bubble": {
-                            "type": "string",
-                            "maxLength": 28,
-                            "enum": approved_facts
-                        }
+    # ---- Build request payload for the LLM ----
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You write short, concrete, optimistic day-in-the-life blurbs "
+                "grounded ONLY in the given simulation data. "
+                f"Language: {sys_lang}. Audience: general public. "
+                "Style: concise but vivid, time-anchored. Do not use line breaks. "
+                "Do not introduce numeric values (times, counts, minutes) that are not listed as MUST-USE facts."
+            ),
+        },
+        {
+            "role": "user",
+            "content": (
+                f"personId: {person_id}\n"
+                f"Weights(act/leg): {json.dumps(weights, ensure_ascii=False)}\n\n"
+                "Chronology sample:\n" + "\n".join(lines) + "\n\n"
+                "Aggregated stats (JSON):\n" + json.dumps(stats, ensure_ascii=False) + "\n\n"
+                "APPROVED facts (for 'bubble' enum):\n- " + "\n- ".join(approved_facts) + "\n\n"
+                "MUST-USE facts for 'one_liner' (include AT LEAST TWO; use numbers/times VERBATIM):\n- " + "\n- ".join(must_use) + "\n\n"
+                "Task: Return JSON {title, one_liner, bubble} only.\n"
+                "- title ≤20 chars, punchy and neutral.\n"
+                "- one_liner: 2–3 sentences, 80–200 chars, NO line breaks. "
+                "Weave at least TWO of the MUST-USE facts naturally (use numbers/times exactly as written).\n"
+                "- bubble: pick EXACTLY one from APPROVED facts.\n"
+            ),
+        },
+    ]
+
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "story_payload",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "additionalProperties": False,
+                "properties": {
+                    "title": {
+                        "type": "string",
+                        "maxLength": 20,
+                        "pattern": r"^[^\n\r\t]{1,20}$"
                     },
-                    "required": ["title", "one_liner", "bubble"]
-                }
+                    "one_liner": {
+                        "type": "string",
+                        "maxLength": 200,
+                        "pattern": r"^[^\n\r\t]{80,200}$"
+                    },
+                    "bubble": {
+                        "type": "string",
+                        "maxLength": 28,
+                        "enum": approved_facts
+                    }
+                },
+                "required": ["title", "one_liner", "bubble"]
             }
         }
+    }
 
-        # ---- Log full context safely (DEBUG only) ----
-        logger.debug("LLM context messages:\n%s", json.dumps(messages, ensure_ascii=False, indent=2))
-        logger.debug("LLM response_format:\n%s", json.dumps(response_format, ensure_ascii=False, indent=2))
-
-        # ---- Call LLM ----
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            response_format=response_format,
-            messages=messages,
-            temperature=0.5,
-            max_tokens=260,
-            timeout=20,
-        )
-
-        # ---- Handle response ----
-        raw = resp.choices[0].message.content or "{}"
-        resp_id = getattr(resp, "id", None)
-        model = getattr(resp, "model", OPENAI_MODEL)
-        usage = getattr(resp, "usage", None)
-        logger.info("LLM response (id=%s, model=%s): %s", resp_id, model, raw)
-        if usage:
-            try:
-                logger.info("LLM usage: %s", usage)
-            except Exception:
-                pass
+    return {
+        "approved_facts": approved_facts,
+        "must_use": must_use,
+        "messages": messages,
+        "response_format": response_format,
+        "cache_key": story_key(OPENAI_MODEL, lang, weights, lines, stats),
+    }
+
+_PARSE_FAILED = {"title": "シミュ結果", "one_liner": "AI応答の解析に失敗", "bubble": "今日の移動をひとことで"}
+_CALL_FAILED = {"title": "シミュ結果", "one_liner": "AI生成に失敗しました", "bubble": "今日の変化をひとことで"}
+
+def _completion_args(job: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """chat.completions.create kwargs for a prepared story (same for the sync and async clients)."""
+    messages = job["messages"]
+    response_format = job["response_format"]
+    # ---- Log full context safely (DEBUG only) ----
+    logger.debug("LLM context messages:\n%s", json.dumps(messages, ensure_ascii=False, indent=2))
+    logger.debug("LLM response_format:\n%s", json.dumps(response_format, ensure_ascii=False, indent=2))
+    return {
+        "model": OPENAI_MODEL,
+        "response_format": response_format,
+        "messages": messages,
+        "temperature": 0.5,
+        "max_tokens": 260,
+        "timeout": timeout,
+    }
 
+def _read_completion(resp: Any) -> Tuple[Dict[str, Any], bool]:
+    """Raw JSON object from a completion. Returns (obj, cacheable)."""
+    raw = resp.choices[0].message.content or "{}"
+    resp_id = getattr(resp, "id", None)
+    model = getattr(resp, "model", OPENAI_MODEL)
+    usage = getattr(resp, "usage", None)
+    logger.info("LLM response (id=%s, model=%s): %s", resp_id, model, raw)
+    if usage:
         try:
-            obj = json.loads(raw)
-        except json.JSONDecodeError as je:
-            logger.error("Failed to parse LLM JSON (id=%s): %s | raw=%r", resp_id, je, raw)
-            obj = {"title": "シミュ結果", "one_liner": "AI応答の解析に失敗", "bubble": "今日の移動をひとことで"}
+            logger.info("LLM usage: %s", usage)
+            for kind in ("prompt", "completion", "total"):
+                n = getattr(usage, f"{kind}_tokens", None)
+                if isinstance(n, int):
+                    LLM_TOKENS.observe(n, kind=kind)
+        except Exception:
+            pass
 
+    try:
+        return json.loads(raw), True
+    except json.JSONDecodeError as je:
+        logger.error("Failed to parse LLM JSON (id=%s): %s | raw=%r", resp_id, je, raw)
+        return dict(_PARSE_FAILED), False
+
+def _observe_llm(t0: float, outcome: str) -> None:
+    """LLM latency since t0 by outcome: ok, bad_json (unparseable answer) or error (no answer)."""
+    LLM_SECONDS.observe(time.perf_counter() - t0, outcome=outcome)
+
+def _call_llm(job: Dict[str, Any], timeout: float = 20) -> Tuple[Dict[str, Any], bool]:
+    """Run the chat completion for a prepared story. Returns (raw obj, cacheable)."""
+    t0 = time.perf_counter()
+    try:
+        resp = _openai_client("client").chat.completions.create(**_completion_args(job, timeout))
+        result = _read_completion(resp)
+    except Exception as e:
+        logger.exception("LLM call failed: %s", e)
+        _observe_llm(t0, "error")
+        return dict(_CALL_FAILED), False
+    _observe_llm(t0, "ok" if result[1] else "bad_json")
+    return result
+
+async def _acall_llm(job: Dict[str, Any], timeout: float = 20) -> Tuple[Dict[str, Any], bool]:
+    """_call_llm on the async client: the event loop keeps serving while the LLM answers."""
+    t0 = time.perf_counter()
+    try:
+        resp = await _openai_client("async_client").chat.completions.create(**_completion_args(job, timeout))
+        result = _read_completion(resp)
     except Exception as e:
         logger.exception("LLM call failed: %s", e)
-        obj = {"title": "シミュ結果", "one_liner": "AI生成に失敗しました", "bubble": "今日の変化をひとことで"}
+        _observe_llm(t0, "error")
+        return dict(_CALL_FAILED), False
+    _observe_llm(t0, "ok" if result[1] else "bad_json")
+    return result
+
+def _finish_story(obj: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, str]:
+    """Validate the LLM object and scrub numbers/times not backed by approved facts."""
+    approved_facts = job["approved_facts"]
+    must_use = job["must_use"]
 
     # numeric/time cleanup (no tone/phrase filtering)
     payload = _validate_payload(obj)
@@ -372,5 +422,156 @@ def generate_story():
         payload["one_liner"] = clean_one[:200]
     except Exception as _e:
         logger.warning("sanitize failed: %s", _e)
+    return payload
+
+def _run_story(job: Dict[str, Any], timeout: float = 20) -> Dict[str, str]:
+    """LLM call + cleanup for a prepared story; successful results go into the cache."""
+    obj, cacheable = _call_llm(job, timeout)
+    payload = _finish_story(obj, job)
+    # fallback texts after an LLM failure are never cached
+    if cacheable:
+        story_cache.set(job["cache_key"], payload)
+    return payload
+
+async def arun_story(job: Dict[str, Any], timeout: float = 20) -> Dict[str, str]:
+    """_run_story for the ASGI routes."""
+    obj, cacheable = await _acall_llm(job, timeout)
+    payload = _finish_story(obj, job)
+    if cacheable:
+        # the SQLite tier ($STORY_CACHE_DB) blocks: keep it off the event loop
+        await asyncio.to_thread(story_cache.set, job["cache_key"], payload)
+    return payload
+
+# ---------------- request parsing (shared with asgi.py) ----------------
+
+class StoryRequestError(ValueError):
+    """Bad /story or /story/batch body; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+def story_request(data: Any) -> Dict[str, Any]:
+    """Prepared job for a /story body, or StoryRequestError."""
+    data = data if isinstance(data, dict) else {}
+    person_id = data.get("personId")
+    plan = data.get("plan") or {}
+    steps = plan.get("steps") or []
+    weights = data.get("weights") or DEFAULT_WEIGHTS
+    lang = (data.get("lang") or "ja").lower()
+
+    if not person_id or not isinstance(steps, list) or not steps:
+        raise StoryRequestError("invalid payload")
+    return _prepare_story(person_id, steps, weights, lang)
+
+def batch_request(data: Any) -> Dict[str, Any]:
+    """
+    Plan a /story/batch body: {"ready": lines that need no LLM call (invalid items,
+    cache hits), "todo": {cache_key: (job, [(index, personId), ...])}, "concurrency",
+    "timeout"}. Items with identical summaries share one todo entry.
+    """
+    data = data if isinstance(data, dict) else {}
+    items = data.get("items")
+    weights = data.get("weights") or DEFAULT_WEIGHTS
+    lang = (data.get("lang") or "ja").lower()
+    if not isinstance(items, list) or not items:
+        raise StoryRequestError("invalid payload")
+    if len(items) > STORY_BATCH_MAX_ITEMS:
+        raise StoryRequestError(f"too many items (max {STORY_BATCH_MAX_ITEMS})", 413)
+    try:
+        concurrency = int(data.get("concurrency") or STORY_BATCH_CONCURRENCY)
+        timeout = float(data.get("timeout") or 20)
+    except (TypeError, ValueError):
+        raise StoryRequestError("invalid payload")
+
+    ready: List[Dict[str, Any]] = []
+    todo: Dict[str, Tuple[Dict[str, Any], List[Tuple[int, Any]]]] = {}
+    for i, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        person_id = item.get("personId")
+        steps = (item.get("plan") or {}).get("steps") or []
+        if not person_id or not isinstance(steps, list) or not steps:
+            ready.append({"index": i, "personId": person_id, "error": "invalid payload"})
+            continue
+        job = _prepare_story(person_id, steps, weights, lang)
+        key = job["cache_key"]
+        if key in todo:
+            todo[key][1].append((i, person_id))
+            continue
+        cached = story_cache.get(key)
+        if cached is not None:
+            ready.append({"index": i, "personId": person_id, **cached, "cached": True})
+        else:
+            todo[key] = (job, [(i, person_id)])
+    return {
+        "ready": ready,
+        "todo": todo,
+        "concurrency": min(max(1, concurrency), STORY_BATCH_MAX_CONCURRENCY),
+        "timeout": min(max(1.0, timeout), 60.0),
+    }
+
+def batch_lines(payload: Dict[str, Any], owners: List[Tuple[int, Any]]) -> str:
+    """NDJSON lines for a fresh LLM result, one per batch item that asked for it."""
+    return "".join(
+        json.dumps({"index": i, "personId": person_id, **payload, "cached": False}, ensure_ascii=False) + "\n"
+        for i, person_id in owners
+    )
 
-    return jsonify(payload)
+# ---------------- route ----------------
+
+@story_bp.route("/story", methods=["POST"])
+def generate_story():
+    """
+    Body: {
+      "personId": str,
+      "plan": { "steps": [...] },   # ONE plan (already chosen)
+      "weights": { "act": {...}, "leg": {...} },  # optional
+      "lang": "ja" | "en"                         # optional
+    }
+    Returns: { "title": str, "one_liner": str, "bubble": str }
+    """
+    try:
+        job = story_request(request.get_json(force=True))
+    except StoryRequestError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    cached = story_cache.get(job["cache_key"])
+    if cached is not None:
+        return jsonify(cached)
+    return jsonify(_run_story(job))
+
+@story_bp.route("/story/batch", methods=["POST"])
+def generate_story_batch():
+    """
+    Body: {
+      "items": [ { "personId": str, "plan": { "steps": [...] } }, ... ],
+      "weights": { "act": {...}, "leg": {...} },  # optional, shared by all items
+      "lang": "ja" | "en",                        # optional, shared by all items
+      "concurrency": int,                         # optional, parallel LLM calls
+      "timeout": float                            # optional, seconds per LLM call
+    }
+    Returns NDJSON, one line per item as soon as it is ready (not in input order):
+      { "index": int, "personId": str, "title": str, "one_liner": str, "bubble": str, "cached": bool }
+      { "index": int, "personId": str, "error": "invalid payload" }
+    """
+    try:
+        batch = batch_request(request.get_json(force=True))
+    except StoryRequestError as e:
+        return jsonify({"error": str(e)}), e.status
+    todo = batch["todo"]
+
+    def lines():
+        for row in batch["ready"]:
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+        if not todo:
+            return
+        pool = ThreadPoolExecutor(max_workers=min(batch["concurrency"], len(todo)))
+        try:
+            futures = {pool.submit(_run_story, job, batch["timeout"]): owners for job, owners in todo.values()}
+            for fut in as_completed(futures):
+                yield batch_lines(fut.result(), futures[fut])
+        finally:
+            # client went away: don't start the calls still queued
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
@@ -0,0 +1,98 @@
+# story_cache.py
+"""
+Cache for /story responses.
+
+Two tiers: an in-process LRU with TTL, and an optional SQLite file
+($STORY_CACHE_DB) that survives restarts and is shared by workers on one host.
+Keys hash everything the prompt is built from except the person id, so
+agents with identical summarized days share one LLM call.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from metrics import cache_lookup
+
+STORY_CACHE_SIZE = int(os.getenv("STORY_CACHE_SIZE", "4096"))
+STORY_CACHE_TTL = float(os.getenv("STORY_CACHE_TTL", str(24 * 3600)))  # seconds
+STORY_CACHE_DB = os.getenv("STORY_CACHE_DB") or None
+
+_PURGE_EVERY = 500  # SQLite writes between expired-row sweeps
+
+def story_key(model: str, lang: str, weights: Any, lines: List[str], stats: Dict[str, Any]) -> str:
+    """Stable hash of the (model, lang, weights, chronology lines, stats) a story is generated from."""
+    blob = json.dumps([model, lang, weights, lines, stats], ensure_ascii=False, sort_keys=True,
+                      separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class StoryCache:
+    def __init__(self, maxsize: int = STORY_CACHE_SIZE, ttl: float = STORY_CACHE_TTL,
+                 db_path: Optional[str] = STORY_CACHE_DB):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS story_cache ("
+                " key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    cache_lookup("story", True)
+                    return dict(payload)
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT payload, expires_at FROM story_cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    payload = json.loads(row[0])
+                    self._remember(key, payload, row[1])
+                    self.hits += 1
+                    cache_lookup("story", True)
+                    return dict(payload)
+
+            self.misses += 1
+            cache_lookup("story", False)
+            return None
+
+    def set(self, key: str, payload: Dict[str, str]) -> None:
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, dict(payload), expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO story_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(payload, ensure_ascii=False), expires_at),
+                )
+                self._writes += 1
+                if self._writes % _PURGE_EVERY == 0:
+                    self._db.execute("DELETE FROM story_cache WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, key: str, payload: Dict[str, str], expires_at: float) -> None:
+        self._mem[key] = (expires_at, payload)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
@@ -0,0 +1,8 @@
+# tests/conftest.py
+"""Make the top-level modules and benchmarks/synthetic.py importable, as the benchmark scripts do."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
@@ -0,0 +1,88 @@
+# tests/test_layer_tiles.py
+"""Clipping to tiles must keep exactly the part of a feature inside each tile, and builds must reference properties by id."""
+import gzip
+import json
+
+import pytest
+
+import layer_tiles
+from layer_tiles import _clip, _tile_lat, _tile_lon, _tile_of, _tile_pieces
+
+Z = 12
+X, Y = 3558, 1630  # Osaka
+
+def _area(ring):
+    return abs(sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(ring, ring[1:]))) / 2
+
+def _square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+def _tile_box(x, y):
+    return _tile_lon(x, Z), _tile_lat(y + 1, Z), _tile_lon(x + 1, Z), _tile_lat(y, Z)
+
+@pytest.fixture
+def no_buffer(monkeypatch):
+    monkeypatch.setattr(layer_tiles, "TILE_BUFFER_PX", 0.0)
+
+def _pieces(geom):
+    pts = [p for p in layer_tiles._positions(geom["coordinates"])]
+    x0, y1 = _tile_of(min(p[0] for p in pts), min(p[1] for p in pts), Z)
+    x1, y0 = _tile_of(max(p[0] for p in pts), max(p[1] for p in pts), Z)
+    return list(_tile_pieces(geom, x0, y0, x1, y1, Z, 12))
+
+def test_polygon_pieces_add_up_to_the_polygon(no_buffer):
+    # a rectangle over a 3x3 block of tiles, corners inside the outer ones
+    x0, y0, _, _ = _tile_box(X, Y + 2)
+    _, _, x1, y1 = _tile_box(X + 2, Y)
+    dx, dy = (x1 - x0) / 6, (y1 - y0) / 6
+    ring = _square(x0 + dx, y0 + dy, x1 - dx, y1 - dy)
+    pieces = _pieces({"type": "Polygon", "coordinates": [ring]})
+    assert len(pieces) == 9
+    for x, y, piece in pieces:
+        bx0, by0, bx1, by1 = _tile_box(x, y)
+        for px, py in piece["coordinates"][0]:
+            assert bx0 - 1e-9 <= px <= bx1 + 1e-9 and by0 - 1e-9 <= py <= by1 + 1e-9
+    assert sum(_area(p["coordinates"][0]) for _, _, p in pieces) == pytest.approx(_area(ring))
+
+def test_line_is_split_at_tile_edges(no_buffer):
+    x0, y0, x1, _ = _tile_box(X, Y)
+    lat = (y0 + _tile_box(X, Y)[3]) / 2
+    line = [[x0 + (x1 - x0) / 2, lat], [x1 + (x1 - x0) * 1.5, lat]]  # half of tile X, all of X + 1, half of X + 2
+    pieces = _pieces({"type": "LineString", "coordinates": line})
+    assert [x for x, _, _ in pieces] == [X, X + 1, X + 2]
+    assert pieces[0][2]["coordinates"][-1][0] == pytest.approx(x1)
+    assert pieces[1][2]["coordinates"][0][0] == pytest.approx(x1)
+
+def test_line_leaving_and_reentering_a_slab_becomes_a_multilinestring():
+    line = [[0.0, 0.0], [2.0, 0.0], [2.0, 1.0], [0.0, 1.0]]
+    out = _clip({"type": "LineString", "coordinates": line}, -1.0, 1.0, 0, 6)
+    assert out == {"type": "MultiLineString", "coordinates": [[[0.0, 0.0], [1.0, 0.0]], [[1.0, 1.0], [0.0, 1.0]]]}
+
+def test_hole_outside_the_slab_is_dropped_and_outer_ring_kept():
+    poly = [_square(0.0, 0.0, 4.0, 4.0), _square(3.0, 1.0, 3.5, 2.0)]
+    out = _clip({"type": "Polygon", "coordinates": poly}, 0.0, 2.0, 0, 6)
+    assert len(out["coordinates"]) == 1
+    assert _area(out["coordinates"][0]) == pytest.approx(8.0)
+
+def test_geometry_outside_the_slab_is_gone():
+    assert _clip({"type": "Point", "coordinates": [5.0, 0.0]}, 0.0, 1.0, 0, 6) is None
+    assert _clip({"type": "Polygon", "coordinates": [_square(2.0, 0.0, 3.0, 1.0)]}, 0.0, 1.0, 0, 6) is None
+
+def test_build_references_properties_by_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(layer_tiles, "TILE_DIR", str(tmp_path))
+    x0, y0, x1, y1 = _tile_box(X, Y)
+    features = [
+        {"type": "Feature", "properties": {"name": "a"}, "geometry": {"type": "Point", "coordinates": [x0 + 1e-4, y0 + 1e-4]}},
+        {"type": "Feature", "properties": {"name": "b"},
+         "geometry": {"type": "LineString", "coordinates": [[x0 + 1e-4, y0 + 1e-4], [x1 + (x1 - x0) / 2, y0 + 1e-4]]}},
+    ]
+    src = tmp_path / "layer.geojson"
+    src.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    meta = layer_tiles.ensure_built("layer", str(src), "0" * 16)
+    assert meta["features"] == 2
+    props = json.loads(gzip.decompress(layer_tiles.read_properties("layer", "0" * 16)))
+    assert props == [{"name": "a"}, {"name": "b"}]
+    tile = json.loads(gzip.decompress(layer_tiles.read_tile("layer", "0" * 16, Z, X, Y)))
+    assert sorted(f["id"] for f in tile["features"]) == [0, 1]
+    assert all(f["properties"] == {} for f in tile["features"])
+    assert layer_tiles.built_meta("layer", "1" * 16) is None
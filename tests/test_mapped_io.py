@@ -0,0 +1,42 @@
+# tests/test_mapped_io.py
+"""GzipBlockReader must inflate every member of a multi-member .gz, wherever GZIP_BLOCK cuts the input."""
+import gzip
+import io
+
+import pytest
+
+import mapped_io
+from mapped_io import open_mapped
+
+FIRST = b"<person id='a'/>\n" * 2000
+SECOND = b"<person id='b'/>\n" * 3000
+THIRD = b"<person id='c'/>\n"
+
+def _members(*parts: bytes) -> bytes:
+    return b"".join(gzip.compress(p, mtime=0) for p in parts)
+
+def _read_all(data: bytes, read_size: int = 4096) -> bytes:
+    with open_mapped(io.BytesIO(data)) as f:
+        return b"".join(iter(lambda: f.read(read_size), b""))
+
+@pytest.mark.parametrize("cut", [-1, 0, 1, 2, 3])
+def test_member_boundary_at_block_end(monkeypatch, cut):
+    # cut = 1: the block ends one byte into the second member, splitting its 1f 8b magic
+    first = gzip.compress(FIRST, mtime=0)
+    monkeypatch.setattr(mapped_io, "GZIP_BLOCK", len(first) + cut)
+    assert _read_all(_members(FIRST, SECOND, THIRD)) == FIRST + SECOND + THIRD
+
+@pytest.mark.parametrize("block", [1, 2, 7, 1 << 10])
+def test_small_blocks(monkeypatch, block):
+    monkeypatch.setattr(mapped_io, "GZIP_BLOCK", block)
+    assert _read_all(_members(FIRST, THIRD, SECOND)) == FIRST + THIRD + SECOND
+
+@pytest.mark.parametrize("padding", [b"\0", b"\0" * 512], ids=["1-byte", "512-bytes"])
+def test_trailing_padding_ends_the_input(monkeypatch, padding):
+    monkeypatch.setattr(mapped_io, "GZIP_BLOCK", len(gzip.compress(FIRST, mtime=0)) + 1)
+    assert _read_all(_members(FIRST, SECOND) + padding) == FIRST + SECOND
+
+def test_truncated_member_raises():
+    data = _members(FIRST)
+    with pytest.raises(EOFError):
+        _read_all(data[:-20])
@@ -0,0 +1,76 @@
+# tests/test_plans.py
+"""
+The plans parser's backends, finalize engines and the parallel parser must agree
+person for person, and ParseBudget must stop a parse that crosses it.
+"""
+import io
+
+import pytest
+
+from plans import ParseBudget, ParseBudgetExceeded, current_rss_mb, iter_persons
+from plans_parallel import iter_persons_parallel
+from synthetic import SyntheticPlansStream, iter_plans_xml
+
+PERSONS = 600
+
+@pytest.fixture(scope="module")
+def plans_xml() -> str:
+    return "".join(iter_plans_xml(PERSONS, plans_per_person=2, seed=7))
+
+@pytest.fixture(scope="module")
+def reference(plans_xml):
+    return list(iter_persons(io.BytesIO(plans_xml.encode("utf-8")), selected_only=False,
+                             backend="expat", engine="plan"))
+
+def test_reference_covers_the_population(reference):
+    # plan-less persons are skipped, everyone else comes out once, in file order
+    assert 0.9 * PERSONS < len(reference) <= PERSONS
+    ids = [int(p["personId"]) for p in reference]
+    assert ids == sorted(set(ids))
+
+@pytest.mark.parametrize("selected_only", [False, True])
+def test_etree_matches_expat(plans_xml, selected_only):
+    expat = list(iter_persons(io.StringIO(plans_xml), selected_only=selected_only, backend="expat"))
+    etree = list(iter_persons(io.StringIO(plans_xml), selected_only=selected_only, backend="etree"))
+    assert etree == expat
+
+def test_batch_engine_matches_per_plan(plans_xml, reference):
+    batch = list(iter_persons(io.BytesIO(plans_xml.encode("utf-8")), selected_only=False,
+                              backend="expat", engine="batch"))
+    assert batch == reference
+
+@pytest.mark.parametrize("as_bytes", [True, False])
+def test_parallel_matches_serial(plans_xml, reference, as_bytes):
+    f = io.BytesIO(plans_xml.encode("utf-8")) if as_bytes else io.StringIO(plans_xml)
+    # small chunks so the population is spread over many tasks
+    assert list(iter_persons_parallel(f, selected_only=False, workers=2, chunk_chars=16 << 10)) == reference
+
+def test_parallel_keeps_the_declared_encoding(plans_xml, reference):
+    latin1 = plans_xml.replace('encoding="utf-8"', 'encoding="ISO-8859-1"').replace(' id="1"', ' id="1é"')
+    f = io.BytesIO(latin1.encode("latin-1"))
+    serial = list(iter_persons(io.BytesIO(latin1.encode("latin-1")), selected_only=False))
+    assert "1é" in {p["personId"] for p in serial}
+    assert list(iter_persons_parallel(f, selected_only=False, workers=2, chunk_chars=16 << 10)) == serial
+
+def test_budget_stops_at_max_persons(plans_xml):
+    seen = []
+    with pytest.raises(ParseBudgetExceeded, match="PLAN_MAX_PERSONS"):
+        for p in iter_persons(io.StringIO(plans_xml), budget=ParseBudget(max_persons=50)):
+            seen.append(p)
+    assert len(seen) == 50
+
+def test_budget_stops_over_max_rss(plans_xml):
+    with pytest.raises(ParseBudgetExceeded, match="PLAN_MAX_RSS_MB"):
+        list(iter_persons(io.StringIO(plans_xml), budget=ParseBudget(max_rss_mb=1, check_every=1)))
+
+def test_parallel_budget_stops_at_max_persons(plans_xml):
+    f = io.BytesIO(plans_xml.encode("utf-8"))
+    with pytest.raises(ParseBudgetExceeded):
+        list(iter_persons_parallel(f, selected_only=False, workers=2, chunk_chars=16 << 10,
+                                   budget=ParseBudget(max_persons=50)))
+
+def test_streaming_parse_memory_is_bounded():
+    # 50k persons (~65 MB of XML) generated on the fly: holding them would take far more than the margin
+    budget = ParseBudget(max_rss_mb=current_rss_mb() + 64, check_every=2000)
+    n = sum(1 for _ in iter_persons(SyntheticPlansStream(50_000), selected_only=False, budget=budget))
+    assert n > 45_000